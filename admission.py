@@ -0,0 +1,210 @@
+import asyncio
+import heapq
+import itertools
+import math
+import time
+from contextlib import asynccontextmanager
+from typing import Any, Dict, List, Optional
+
+from ocr_pool import PoolBusyError
+
+# Waiting work is served in priority order: interactive requests before bulk
+# work (batches, documents, background jobs)
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BULK = 1
+
+
+class DeadlineExceededError(PoolBusyError):
+    """Raised when a request's deadline has passed, or would pass before its OCR could finish"""
+
+    def __init__(self, retry_after: int, reason: str = "deadline"):
+        super().__init__(retry_after)
+        self.args = (f"Request deadline cannot be met ({reason})",)
+        self.reason = reason
+
+    def __reduce__(self):
+        return DeadlineExceededError, (self.retry_after, self.reason)
+
+
+def parse_deadline(value: Optional[str], default_ms: float = 0) -> Optional[float]:
+    """Absolute ``time.monotonic()`` deadline from a remaining budget in milliseconds.
+
+    A relative budget avoids depending on the client's clock. Returns None
+    when neither the header nor ``default_ms`` sets one.
+    """
+    if value is None or not value.strip():
+        budget_ms = default_ms
+    else:
+        try:
+            budget_ms = float(value)
+        except ValueError:
+            raise ValueError(f"Invalid deadline '{value}', expected milliseconds")
+        if not math.isfinite(budget_ms) or budget_ms < 0:
+            raise ValueError(f"Invalid deadline '{value}', expected milliseconds")
+    if budget_ms <= 0:
+        return None
+    return time.monotonic() + budget_ms / 1000
+
+
+class AdaptiveLimiter:
+    """Concurrency limit for OCR that adapts to the latency it observes.
+
+    At most ``limit`` images are in OCR at once; others wait, interactive
+    before bulk, for at most ``max_queue`` places. With ``adaptive`` the
+    limit follows a gradient: a fast moving average of OCR latency is
+    compared with a baseline that tracks the latency without queueing, and while
+    recent latency exceeds ``tolerance`` times the baseline the limit
+    shrinks, otherwise it grows by about its square root per sample while
+    at least half of it is in use. Each rejection from the worker pool
+    cuts it by a tenth (multiplicative decrease), so it settles where the
+    workers are busy but work does not queue up behind them.
+
+    Work with a deadline is shed on arrival when the estimated wait plus
+    OCR time would overrun it, and dropped if the deadline passes while it
+    waits, so nothing is spent on results the client has given up on.
+    """
+
+    def __init__(self, initial: int, min_limit: int = 1, max_limit: int = 1000, max_queue: int = 64,
+                 adaptive: bool = True, tolerance: float = 2.0, smoothing: float = 0.2):
+        self.min_limit = max(1, min_limit)
+        self.max_limit = max(self.min_limit, max_limit)
+        self.max_queue = max(0, max_queue)
+        self.adaptive = adaptive
+        self.tolerance = tolerance
+        self.smoothing = smoothing
+        self._limit = float(min(self.max_limit, max(self.min_limit, initial)))
+        self._in_flight = 0
+        self._waiters: List[List[Any]] = []  # heap of [priority, seq, future]
+        self._queued = [0, 0]  # waiting, by priority
+        self._seq = itertools.count()
+        self._short_latency: Optional[float] = None
+        self._long_latency: Optional[float] = None
+        self._counters = {"admitted": 0, "queue_full": 0, "deadline_predicted": 0, "deadline_expired": 0}
+
+    @property
+    def limit(self) -> int:
+        return int(self._limit)
+
+    @property
+    def in_flight(self) -> int:
+        return self._in_flight
+
+    @property
+    def queued(self) -> int:
+        return sum(self._queued)
+
+    def _latency_estimate(self) -> float:
+        # Before the first sample, guess a second, as the worker pool does
+        return self._short_latency if self._short_latency is not None else 1.0
+
+    def retry_after(self) -> int:
+        """Rough number of seconds until a waiting place frees up"""
+        return max(1, math.ceil(self._latency_estimate() * (self.queued + 1) / self.limit))
+
+    def estimated_wait(self, priority: int) -> float:
+        """Seconds until a newcomer of ``priority`` would start OCR, from the work ahead of it"""
+        if self._in_flight < self.limit and not self.queued:
+            return 0.0
+        ahead = sum(self._queued[:priority + 1])
+        return (ahead + 1) / self.limit * self._latency_estimate()
+
+    async def acquire(self, priority: int = PRIORITY_BULK, deadline: Optional[float] = None):
+        """Wait for a slot; raise PoolBusyError when the queue is full, DeadlineExceededError past ``deadline``"""
+        priority = min(max(priority, PRIORITY_INTERACTIVE), PRIORITY_BULK)
+        now = time.monotonic()
+        if deadline is not None and now >= deadline:
+            self._counters["deadline_expired"] += 1
+            raise DeadlineExceededError(self.retry_after(), "expired before OCR")
+        if self._in_flight < self.limit and not self.queued:
+            self._in_flight += 1
+            self._counters["admitted"] += 1
+            return
+        if self.queued >= self.max_queue:
+            self._counters["queue_full"] += 1
+            raise PoolBusyError(self.retry_after())
+        if (deadline is not None and self._short_latency is not None
+                and now + self.estimated_wait(priority) + self._short_latency > deadline):
+            self._counters["deadline_predicted"] += 1
+            raise DeadlineExceededError(self.retry_after(), "queue wait would exceed it")
+
+        waiter = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, [priority, next(self._seq), waiter])
+        self._queued[priority] += 1
+        try:
+            if deadline is None:
+                await asyncio.shield(waiter)
+            else:
+                await asyncio.wait_for(asyncio.shield(waiter), max(0.0, deadline - now))
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if waiter.done() and not waiter.cancelled():
+                # Granted just as the wait ended: hand the slot on
+                self.release()
+            else:
+                waiter.cancel()
+                self._queued[priority] -= 1
+            if isinstance(e, asyncio.TimeoutError):
+                self._counters["deadline_expired"] += 1
+                raise DeadlineExceededError(self.retry_after(), "expired while queued")
+            raise
+        self._counters["admitted"] += 1
+
+    def _grant(self):
+        while self._waiters and self._in_flight < self.limit:
+            priority, _, waiter = heapq.heappop(self._waiters)
+            if waiter.cancelled():
+                continue
+            self._queued[priority] -= 1
+            self._in_flight += 1
+            waiter.set_result(None)
+
+    def release(self, latency: Optional[float] = None, overloaded: bool = False):
+        """Free a slot; ``latency`` of a completed OCR call, ``overloaded`` if the pool rejected it"""
+        self._in_flight -= 1
+        if self.adaptive:
+            if overloaded:
+                self._limit = max(self.min_limit, self._limit * 0.9)
+            elif latency is not None:
+                self._update(latency)
+        self._grant()
+
+    def _update(self, latency: float):
+        if self._short_latency is None:
+            self._short_latency = self._long_latency = latency
+        self._short_latency = 0.7 * self._short_latency + 0.3 * latency
+        # The baseline follows faster latencies quickly and slower ones only
+        # slowly, so sustained queueing does not become the new normal
+        weight = 0.1 if latency < self._long_latency else 0.005
+        self._long_latency += weight * (latency - self._long_latency)
+        gradient = max(0.5, min(1.0, self.tolerance * self._long_latency / self._short_latency))
+        if gradient == 1.0 and self._in_flight < self._limit / 2:
+            return  # Latency is fine, but the limit is not what holds work back
+        target = self._limit * gradient + math.sqrt(self._limit)
+        limit = (1 - self.smoothing) * self._limit + self.smoothing * target
+        self._limit = min(self.max_limit, max(self.min_limit, limit))
+
+    @asynccontextmanager
+    async def slot(self, priority: int = PRIORITY_BULK, deadline: Optional[float] = None):
+        """Hold a slot for the body; its duration feeds the limit"""
+        await self.acquire(priority, deadline)
+        start = time.perf_counter()
+        try:
+            yield
+        except PoolBusyError:
+            self.release(overloaded=True)
+            raise
+        except BaseException:
+            self.release()
+            raise
+        self.release(time.perf_counter() - start)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "adaptive": self.adaptive,
+            "limit": self.limit,
+            "in_flight": self._in_flight,
+            "queued": self.queued,
+            "max_queue": self.max_queue,
+            "latency_ms": round(self._short_latency * 1000, 1) if self._short_latency is not None else None,
+            "baseline_latency_ms": round(self._long_latency * 1000, 1) if self._long_latency is not None else None,
+            **self._counters,
+        }
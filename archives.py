@@ -0,0 +1,94 @@
+import os
+import tarfile
+import threading
+import zipfile
+import zlib
+from typing import Any, BinaryIO, List, NamedTuple, Optional
+
+ARCHIVE_EXTENSIONS = (".zip", ".tar", ".tar.gz", ".tgz", ".tar.bz2", ".tar.xz")
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".tif", ".tiff", ".webp")
+
+
+def is_archive(filename: Optional[str]) -> bool:
+    return bool(filename) and filename.lower().endswith(ARCHIVE_EXTENSIONS)
+
+
+class TooManyImagesError(ValueError):
+    """The archive holds more images than a request may send"""
+
+
+class ArchiveMember(NamedTuple):
+    name: str
+    size: int
+    error: Optional[str]
+    info: Any
+
+
+class Archive:
+    """The images inside a zip or tar archive, read one member at a time.
+
+    ``fileobj`` must be seekable; it is read in place rather than copied.
+    Opening the archive only lists its images (``members``); ``read(member)``
+    decompresses one when it is needed, so at most the members being OCR'd
+    are held in memory.
+
+    Members larger than ``max_member_size`` are listed with an error instead
+    of being read. More than ``max_members`` images, or images adding up to
+    more than ``max_total_size`` uncompressed bytes, raise TooManyImagesError
+and ValueError. The
+    sizes checked are those the archive declares; zip members are never
+    decompressed past them and tar sizes are exact.
+    """
+
+    def __init__(self, fileobj: BinaryIO, max_member_size: int, max_members: int, max_total_size: int):
+        self.max_member_size = max_member_size
+        # Members are read from worker threads, and both formats share one file position
+        self._lock = threading.Lock()
+        self.members: List[ArchiveMember] = []
+        fileobj.seek(0)
+        is_zip = zipfile.is_zipfile(fileobj)
+        fileobj.seek(0)
+        if is_zip:
+            self._archive = zipfile.ZipFile(fileobj)
+            entries = ((info.filename, info.file_size, info) for info in self._archive.infolist() if not info.is_dir())
+        else:
+            self._archive = tarfile.open(fileobj=fileobj, mode="r:*")
+            entries = ((info.name, info.size, info) for info in self._archive if info.isfile())
+
+        try:
+            total = 0
+            for path, size, info in entries:
+                if not path.lower().endswith(IMAGE_EXTENSIONS):
+                    continue
+                if len(self.members) >= max_members:
+                    raise TooManyImagesError(f"Archive contains more than {max_members} images")
+                if size > max_member_size:
+                    self.members.append(ArchiveMember(os.path.basename(path), size, "File too large", info))
+                    continue
+                total += size
+                if total > max_total_size:
+                    raise ValueError(f"Archive images exceed {max_total_size / (1024 * 1024):.1f} MB uncompressed")
+                self.members.append(ArchiveMember(os.path.basename(path), size, None, info))
+        except BaseException:
+            self.close()
+            raise
+
+    def read(self, member: ArchiveMember) -> bytes:
+        """Decompress one listed member; a corrupt member raises ValueError"""
+        with self._lock:
+            try:
+                if isinstance(self._archive, zipfile.ZipFile):
+                    # Never trust the declared size alone, read at most one byte past the limit
+                    with self._archive.open(member.info) as f:
+                        contents = f.read(self.max_member_size + 1)
+                else:
+                    contents = self._archive.extractfile(member.info).read()
+            except (zipfile.BadZipFile, tarfile.TarError, zlib.error, EOFError, OSError) as e:
+                raise ValueError(f"Invalid archive member {member.name}: {str(e)}")
+        if len(contents) > self.max_member_size:
+            raise ValueError("File too large")
+        return contents
+
+    def close(self):
+        with self._lock:
+            self._archive.close()
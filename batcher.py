@@ -0,0 +1,119 @@
+import asyncio
+import logging
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
+
+from ocr_pool import OCRWorkerPool, RemoteOCRPool
+from preprocess import PreprocessOptions
+
+logger = logging.getLogger("paddleocr-api")
+
+# Upload size classes (bytes) used to keep very large pages out of batches of
+# small screenshots, so a small image never waits behind a huge one
+SIZE_BUCKETS = (256 * 1024, 2 * 1024 * 1024)
+
+
+def _size_bucket(num_bytes: int) -> int:
+    for idx, limit in enumerate(SIZE_BUCKETS):
+        if num_bytes <= limit:
+            return idx
+    return len(SIZE_BUCKETS)
+
+
+class MicroBatcher:
+    """Gathers concurrent OCR requests into batches for the worker pool.
+
+    A batch is flushed when it reaches ``max_batch`` images or when
+    ``window_ms`` has passed since its first image arrived, whichever comes
+    first. An image arriving while a pool worker is idle and no other image
+    is waiting is sent right away, so sequential requests never pay the
+    window; it only delays images under concurrent load. Each batch occupies a single slot of the worker pool and every
+    caller gets back only the result for its own image. Only images of the
+    same language share a batch; ``on_model_event`` receives the model
+    registry event each batch reports and ``on_timings`` its stage timings.
+    """
+
+    def __init__(self, pool: Union[OCRWorkerPool, RemoteOCRPool], window_ms: float = 10, max_batch: int = 8,
+                 on_model_event: Optional[Callable[[Dict[str, Any], int], None]] = None,
+                 on_timings: Optional[Callable[[Dict[str, List[float]]], None]] = None):
+        self.pool = pool
+        self.on_model_event = on_model_event
+        self.on_timings = on_timings
+        self.window = max(0.0, window_ms) / 1000
+        self.max_batch = max(1, max_batch)
+        self._pending: Dict[Tuple, List[Tuple[bytes, PreprocessOptions, asyncio.Future]]] = {}
+        self._timers: Dict[Tuple, asyncio.TimerHandle] = {}
+        self._tasks = set()
+        self._starting = 0  # Batches flushed but not yet handed to the pool
+        self._batches = 0
+        self._images = 0
+
+    async def submit(self, image_bytes: bytes, cls: bool = True,
+                     options: PreprocessOptions = PreprocessOptions(), lang: Optional[str] = None) -> Dict[str, Any]:
+        """Queue one image for the next batch and wait for its result"""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        key = (lang, cls, _size_bucket(len(image_bytes)))
+        batch = self._pending.setdefault(key, [])
+        batch.append((image_bytes, options, future))
+
+        if len(batch) >= self.max_batch or (self.pending == 1 and self.pool.idle > self._starting):
+            self._flush(key)
+        elif len(batch) == 1:
+            self._timers[key] = loop.call_later(self.window, self._flush, key)
+
+        return await future
+
+    def _flush(self, key: Tuple):
+        timer = self._timers.pop(key, None)
+        if timer is not None:
+            timer.cancel()
+        batch = self._pending.pop(key, None)
+        if not batch:
+            return
+        lang, cls, _ = key
+        self._starting += 1
+        task = asyncio.ensure_future(self._run(lang, cls, batch))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, lang: Optional[str], cls: bool, batch: List[Tuple[bytes, PreprocessOptions, asyncio.Future]]):
+        self._batches += 1
+        self._images += len(batch)
+        images = [image for image, _, _ in batch]
+        options = [image_options for _, image_options, _ in batch]
+        # The pool counts the batch as pending before run_batch first yields
+        self._starting -= 1
+        try:
+            output = await self.pool.run_batch(images, cls, options, lang)
+        except Exception as e:
+            # Pool rejected or failed the whole batch (e.g. queue full)
+            for _, _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        if self.on_model_event is not None:
+            self.on_model_event(output["model"], len(batch))
+        if self.on_timings is not None:
+            self.on_timings(output["timings"])
+        for (_, _, future), result in zip(batch, output["results"]):
+            if future.done():  # Caller went away
+                continue
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+    @property
+    def pending(self) -> int:
+        """Images waiting for their batch to be flushed"""
+        return sum(len(batch) for batch in self._pending.values())
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "window_ms": self.window * 1000,
+            "max_batch": self.max_batch,
+            "batches": self._batches,
+            "images": self._images,
+            "avg_batch_size": round(self._images / self._batches, 2) if self._batches else 0,
+        }
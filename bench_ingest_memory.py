@@ -0,0 +1,100 @@
+import argparse
+import asyncio
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import tracemalloc
+from io import BytesIO
+
+import numpy as np
+from fastapi import UploadFile
+
+from ingest import open_upload
+
+CHUNK_SIZE = 1024 * 1024
+
+
+def make_upload(size_mb: float) -> UploadFile:
+    """Build an UploadFile spooled the same way Starlette spools multipart uploads"""
+    spooled = tempfile.SpooledTemporaryFile(max_size=CHUNK_SIZE)
+    chunk = os.urandom(CHUNK_SIZE)
+    remaining = int(size_mb * 1024 * 1024)
+    while remaining > 0:
+        spooled.write(chunk[:remaining])
+        remaining -= CHUNK_SIZE
+    spooled.seek(0)
+    return UploadFile(file=spooled, filename="bench.jpg")
+
+
+async def ingest_before(file: UploadFile) -> int:
+    """The previous path: accumulate chunks in a BytesIO, copy them out, wrap in numpy"""
+    contents = BytesIO()
+    chunk = await file.read(CHUNK_SIZE)
+    while chunk:
+        contents.write(chunk)
+        chunk = await file.read(CHUNK_SIZE)
+    contents.seek(0)
+    image_bytes = contents.read()
+    return int(np.frombuffer(image_bytes, np.uint8).sum(dtype=np.uint64) & 1)
+
+
+async def ingest_after(file: UploadFile) -> int:
+    """The current path: map the spooled upload and hand it to numpy without copying"""
+    with open_upload(file, sys.maxsize) as image_bytes:
+        array = np.frombuffer(image_bytes, np.uint8)
+        result = int(array.sum(dtype=np.uint64) & 1)
+        del array
+        return result
+
+
+def run_variant(variant: str, size_mb: float, requests: int):
+    """Measure one variant in this process and print the results as JSON"""
+    ingest = ingest_before if variant == "before" else ingest_after
+    uploads = [make_upload(size_mb) for _ in range(requests)]
+    rss_start = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    tracemalloc.start()
+
+    async def run():
+        for upload in uploads:
+            await ingest(upload)
+    asyncio.run(run())
+
+    _, traced_peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    rss_peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(json.dumps({
+        "variant": variant,
+        "traced_peak_mb": traced_peak / (1024 * 1024),
+        "rss_growth_mb": (rss_peak - rss_start) / 1024,  # ru_maxrss is in KB on Linux
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare peak memory of upload ingestion before and after zero-copy reads")
+    parser.add_argument("--size-mb", type=float, default=10, help="Size of each simulated upload in MB")
+    parser.add_argument("--requests", type=int, default=1, help="Uploads ingested per variant")
+    parser.add_argument("--variant", choices=["before", "after"], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.variant:
+        run_variant(args.variant, args.size_mb, args.requests)
+        return
+
+    # Run each variant in a fresh interpreter so peak RSS is not shared
+    print(f"Ingesting {args.requests} upload(s) of {args.size_mb:.1f} MB")
+    print("| Variant | Peak traced allocations (MB) | Peak RSS growth (MB) |")
+    print("|---------|------------------------------|----------------------|")
+    for variant in ("before", "after"):
+        output = subprocess.check_output([
+            sys.executable, __file__, "--variant", variant,
+            "--size-mb", str(args.size_mb), "--requests", str(args.requests),
+        ])
+        result = json.loads(output.decode().strip().splitlines()[-1])
+        print(f"| {variant} | {result['traced_peak_mb']:.1f} | {result['rss_growth_mb']:.1f} |")
+
+
+if __name__ == "__main__":
+    main()
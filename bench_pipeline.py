@@ -0,0 +1,260 @@
+import argparse
+import cProfile
+import json
+import os
+import pstats
+import resource
+import statistics
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Callable, Dict, List
+
+from ocr_engine import OCREngine, create_engine, engine_options_from_env
+from preprocess import PreprocessOptions, decode_image
+from runtime_config import engine_kwargs, load_runtime_config
+from urls import find_urls
+
+STAGES = ("decode", "detection", "crop", "classification", "recognition", "url_extraction")
+IMAGE_PATTERNS = ("*.jpg", "*.jpeg", "*.png", "*.bmp", "*.webp")
+
+
+# One function per stage, so profiles and py-spy stacks show the stage names
+
+def stage_decode(image_bytes: bytes, options: PreprocessOptions):
+    images, _, _ = decode_image(image_bytes, options)
+    return images
+
+
+def stage_detection(engine: OCREngine, image):
+    return engine.detect(image)
+
+
+def stage_crop(engine: OCREngine, image, boxes):
+    return [engine.crop(image, box) for box in boxes]
+
+
+def stage_classification(engine: OCREngine, crops):
+    return engine.classify(crops) if crops else crops
+
+
+def stage_recognition(engine: OCREngine, crops):
+    return engine.recognize(crops) if crops else []
+
+
+def stage_url_extraction(lines):
+    return find_urls(lines)
+
+
+def _rss_mb() -> float:
+    """Current resident set size (Linux), 0 where /proc is not available"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except (OSError, ValueError):
+        return 0.0
+
+
+class StageRecorder:
+    """Runs stage functions and records their duration, or with ``trace_alloc`` their allocations.
+
+    Allocation tracing slows everything down, so it is a separate pass
+    whose timings are discarded. tracemalloc sees Python and NumPy
+    allocations, not memory allocated inside native inference libraries;
+    the RSS growth column covers those.
+    """
+
+    def __init__(self, trace_alloc: bool = False):
+        self.trace_alloc = trace_alloc
+        self.times: Dict[str, List[float]] = {stage: [] for stage in STAGES}
+        self.allocated: Dict[str, List[int]] = {stage: [] for stage in STAGES}
+        self.peak_allocated: Dict[str, List[int]] = {stage: [] for stage in STAGES}
+        self.rss_growth: Dict[str, List[float]] = {stage: [] for stage in STAGES}
+
+    def __call__(self, stage: str, fn: Callable, *args):
+        if not self.trace_alloc:
+            start = time.perf_counter()
+            result = fn(*args)
+            self.times[stage].append(time.perf_counter() - start)
+            return result
+        rss_before = _rss_mb()
+        tracemalloc.reset_peak()
+        before, _ = tracemalloc.get_traced_memory()
+        result = fn(*args)
+        after, peak = tracemalloc.get_traced_memory()
+        # What the stage returns stays alive until the next stage has used it
+        self.allocated[stage].append(after - before)
+        self.peak_allocated[stage].append(peak - before)
+        self.rss_growth[stage].append(_rss_mb() - rss_before)
+        return result
+
+
+def run_pipeline(engine: OCREngine, image_bytes: bytes, options: PreprocessOptions, cls: bool, record: StageRecorder):
+    """The stages of ``OCREngine.ocr`` plus decoding and URL extraction, for one upload"""
+    lines = []
+    for image in record("decode", stage_decode, image_bytes, options):
+        boxes = record("detection", stage_detection, engine, image)
+        crops = record("crop", stage_crop, engine, image, boxes)
+        if cls:
+            crops = record("classification", stage_classification, engine, crops)
+        recognized = record("recognition", stage_recognition, engine, crops)
+        lines.extend(text for text, score in recognized if score >= engine.drop_score)
+    return record("url_extraction", stage_url_extraction, lines)
+
+
+def summarize(timing: StageRecorder, allocs: StageRecorder, images: int) -> Dict[str, Dict[str, float]]:
+    stages = {}
+    for stage in STAGES:
+        times = timing.times[stage]
+        if not times:
+            continue
+        summary = {
+            "calls": len(times),
+            "median_ms": statistics.median(times) * 1000,
+            "p90_ms": sorted(times)[min(len(times) - 1, int(len(times) * 0.9))] * 1000,
+            "mean_ms": statistics.mean(times) * 1000,
+            "per_image_ms": sum(times) / images * 1000,
+        }
+        if allocs is not None and allocs.allocated[stage]:
+            summary["allocated_kb"] = statistics.mean(allocs.allocated[stage]) / 1024
+            summary["peak_allocated_kb"] = max(allocs.peak_allocated[stage]) / 1024
+            summary["rss_growth_mb"] = max(allocs.rss_growth[stage])
+        stages[stage] = summary
+    return stages
+
+
+def print_stages(stages: Dict[str, Dict[str, float]]):
+    total = sum(summary["per_image_ms"] for summary in stages.values()) or 1
+    print("| Stage | Calls | Median (ms) | p90 (ms) | Per image (ms) | Share | Allocated (KB) | Peak alloc (KB) | RSS growth (MB) |")
+    print("|-------|-------|-------------|----------|----------------|-------|----------------|-----------------|-----------------|")
+    for stage, s in stages.items():
+        memory = " | ".join(f"{s[key]:.1f}" if key in s else "-" for key in ("allocated_kb", "peak_allocated_kb", "rss_growth_mb"))
+        print(f"| {stage} | {s['calls']} | {s['median_ms']:.2f} | {s['p90_ms']:.2f} | {s['per_image_ms']:.2f} | "
+              f"{s['per_image_ms'] / total * 100:.1f}% | {memory} |")
+
+
+def compare(stages: Dict[str, Dict[str, float]], baseline: Dict[str, Any], threshold: float, floor_ms: float) -> List[str]:
+    """Stages whose per-image time grew by more than ``threshold`` (and by at least ``floor_ms``)"""
+    regressions = []
+    print("\n| Stage | Baseline (ms/image) | This run (ms/image) | Change |")
+    print("|-------|---------------------|---------------------|--------|")
+    for stage, summary in stages.items():
+        before = baseline["stages"].get(stage, {}).get("per_image_ms")
+        if not before:
+            continue
+        after = summary["per_image_ms"]
+        change = (after - before) / before
+        print(f"| {stage} | {before:.2f} | {after:.2f} | {change * 100:+.1f}% |")
+        if change > threshold and after - before >= floor_ms:
+            regressions.append(f"{stage}: {before:.2f} -> {after:.2f} ms/image ({change * 100:+.1f}%)")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time each OCR pipeline stage in-process, without HTTP")
+    parser.add_argument("--image-dir", default="./test_images", help="Corpus, e.g. made by generate_test_images.py")
+    parser.add_argument("--max-images", type=int, default=0, help="Use at most this many images")
+    parser.add_argument("--repeat", type=int, default=3, help="Timed passes over the corpus")
+    parser.add_argument("--engine", default="paddle", help="OCR engine (paddle or fake)")
+    parser.add_argument("--lang", default="en", help="OCR language")
+    parser.add_argument("--no-cls", action="store_true", help="Skip angle classification")
+    parser.add_argument("--max-side", type=int, default=2048, help="Downscale target, as OCR_MAX_SIDE (0 keeps full size)")
+    parser.add_argument("--grayscale", action="store_true", help="Decode as grayscale")
+    parser.add_argument("--no-alloc", action="store_true", help="Skip the tracemalloc pass")
+    parser.add_argument("--profile", help="Write a cProfile of the timed passes to this file (open with snakeviz or pstats)")
+    parser.add_argument("--loop", type=float, default=0,
+                        help="Only run the pipeline over and over for this many seconds, e.g. under py-spy record")
+    parser.add_argument("--save-baseline", help="Write the results to this JSON file")
+    parser.add_argument("--baseline", help="Compare with a JSON file written by --save-baseline")
+    parser.add_argument("--max-regression", type=float, default=0.1,
+                        help="Relative slowdown of a stage that fails the run (default 0.1 = 10%%)")
+    parser.add_argument("--noise-floor-ms", type=float, default=0.5,
+                        help="Ignore slowdowns smaller than this many ms per image")
+    args = parser.parse_args()
+
+    files = sorted(path for pattern in IMAGE_PATTERNS for path in Path(args.image_dir).glob(pattern))
+    if args.max_images > 0:
+        files = files[:args.max_images]
+    if not files:
+        print(f"No image files found in {args.image_dir}")
+        return
+    corpus = [path.read_bytes() for path in files]
+    options = PreprocessOptions(max_side=args.max_side, grayscale=args.grayscale)
+    cls = not args.no_cls
+
+    engine_options = {"lang": args.lang, "use_angle_cls": cls}
+    if args.engine == "fake":
+        engine_options.update(engine_options_from_env(os.environ))
+    else:
+        # Same runtime settings as the server (OCR_RUNTIME_CONFIG, OCR_THREADS, OCR_MKLDNN, ...)
+        engine_options.update(engine_kwargs(load_runtime_config(os.environ)))
+    start = time.perf_counter()
+    engine = create_engine(args.engine, **engine_options)
+    load_time = time.perf_counter() - start
+    # Untimed pass so the first images do not pay for initialization
+    for image_bytes in corpus:
+        run_pipeline(engine, image_bytes, options, cls, StageRecorder())
+
+    if args.loop > 0:
+        print(f"Running the pipeline for {args.loop:g}s in process {os.getpid()}")
+        deadline = time.perf_counter() + args.loop
+        passes = 0
+        while time.perf_counter() < deadline:
+            for image_bytes in corpus:
+                run_pipeline(engine, image_bytes, options, cls, StageRecorder())
+            passes += 1
+        print(f"{passes} passes over {len(corpus)} images")
+        return
+
+    timing = StageRecorder()
+    profiler = cProfile.Profile() if args.profile else None
+    if profiler is not None:
+        profiler.enable()
+    for _ in range(args.repeat):
+        for image_bytes in corpus:
+            run_pipeline(engine, image_bytes, options, cls, timing)
+    if profiler is not None:
+        profiler.disable()
+        profiler.dump_stats(args.profile)
+
+    allocs = None
+    if not args.no_alloc:
+        allocs = StageRecorder(trace_alloc=True)
+        tracemalloc.start()
+        for image_bytes in corpus:
+            run_pipeline(engine, image_bytes, options, cls, allocs)
+        tracemalloc.stop()
+
+    stages = summarize(timing, allocs, len(corpus) * args.repeat)
+    peak_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024  # KB on Linux
+    print(f"Engine '{args.engine}' loaded in {load_time:.2f}s; {len(corpus)} images from {args.image_dir}, "
+          f"{args.repeat} timed passes, max_side={args.max_side}, cls={cls}\n")
+    print_stages(stages)
+    print(f"\nPeak RSS: {peak_rss_mb:.1f} MB")
+    if profiler is not None:
+        print(f"\nProfile written to {args.profile}; top functions by cumulative time:")
+        pstats.Stats(args.profile).sort_stats("cumulative").print_stats(15)
+
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as f:
+            json.dump({
+                "config": {"engine": args.engine, "lang": args.lang, "cls": cls, "max_side": args.max_side,
+                           "grayscale": args.grayscale, "images": len(corpus), "repeat": args.repeat,
+                           "created": datetime.now().isoformat(timespec="seconds")},
+                "stages": stages,
+                "peak_rss_mb": peak_rss_mb,
+            }, f, indent=2)
+        print(f"\nBaseline written to {args.save_baseline}")
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(stages, json.load(f), args.max_regression, args.noise_floor_ms)
+        if regressions:
+            print("\nRegressions:\n  " + "\n  ".join(regressions))
+            sys.exit(1)
+        print("\nNo regressions")
+
+
+if __name__ == "__main__":
+    main()
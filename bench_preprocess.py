@@ -0,0 +1,64 @@
+import argparse
+import difflib
+import statistics
+import time
+from pathlib import Path
+
+import ocr_pool
+from preprocess import PreprocessOptions
+
+# Preprocessing settings compared against full-resolution OCR
+CONFIGS = {
+    "full": PreprocessOptions(),
+    "max_side=2048": PreprocessOptions(max_side=2048),
+    "max_side=1600": PreprocessOptions(max_side=1600),
+    "max_side=1280": PreprocessOptions(max_side=1280),
+    "max_side=960": PreprocessOptions(max_side=960),
+    "max_side=1280+gray": PreprocessOptions(max_side=1280, grayscale=True),
+}
+
+
+def similarity(reference: str, text: str) -> float:
+    """Word-level similarity of two OCR outputs (1.0 means identical)"""
+    return difflib.SequenceMatcher(None, reference.split(), text.split()).ratio()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare OCR latency and accuracy for preprocessing settings")
+    parser.add_argument("--image-dir", type=str, default="./test_images", help="Directory containing test images")
+    parser.add_argument("--repeat", type=int, default=3, help="Timed runs per image and setting")
+    parser.add_argument("--lang", type=str, default="en", help="PaddleOCR language")
+    parser.add_argument("--engine", type=str, default="paddle", help="OCR engine (paddle or fake)")
+    args = parser.parse_args()
+
+    files = sorted(Path(args.image_dir).glob("*.jpg")) + sorted(Path(args.image_dir).glob("*.png"))
+    if not files:
+        print(f"No image files found in {args.image_dir}")
+        return
+    images = [path.read_bytes() for path in files]
+
+    ocr_pool._init_worker(args.engine, {"lang": args.lang, "use_angle_cls": True})
+    if not ocr_pool.ping()["ready"]:
+        print("OCR engine could not be initialized")
+        return
+
+    # Warm up so the first setting does not pay for model initialization
+    ocr_pool.run_ocr(images[0])
+
+    references = [ocr_pool.run_ocr(image)["text"] for image in images]
+    print(f"Benchmarking {len(images)} images from {args.image_dir}, {args.repeat} runs each\n")
+    print("| Setting | Median latency (s) | Mean latency (s) | Accuracy vs full |")
+    print("|---------|--------------------|------------------|------------------|")
+    for name, options in CONFIGS.items():
+        latencies, scores = [], []
+        for image, reference in zip(images, references):
+            for _ in range(args.repeat):
+                start = time.perf_counter()
+                result = ocr_pool.run_ocr(image, True, options)
+                latencies.append(time.perf_counter() - start)
+            scores.append(similarity(reference, result["text"]))
+        print(f"| {name} | {statistics.median(latencies):.3f} | {statistics.mean(latencies):.3f} | {statistics.mean(scores) * 100:.1f}% |")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+import argparse
+import json
+import os
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict
+
+from rate_limit import RateLimit, RateLimiter
+
+
+class ListRateLimiter:
+    """The previous limiter: a list of request timestamps per client, rebuilt on every call"""
+
+    def __init__(self, requests_limit: int, window_seconds: float):
+        self.requests_limit = requests_limit
+        self.window_seconds = window_seconds
+        self.clients: Dict[str, list] = {}
+
+    def is_rate_limited(self, client_id: str) -> bool:
+        current_time = time.time()
+        if client_id not in self.clients:
+            self.clients[client_id] = []
+        self.clients[client_id] = [
+            timestamp for timestamp in self.clients[client_id]
+            if current_time - timestamp < self.window_seconds
+        ]
+        if len(self.clients[client_id]) >= self.requests_limit:
+            return True
+        self.clients[client_id].append(current_time)
+        return False
+
+
+def make_limiter(variant: str, limit: RateLimit, max_clients: int, db_path: str):
+    if variant == "list":
+        return ListRateLimiter(limit.requests, limit.window)
+    return RateLimiter(limit, backend=variant, db_path=db_path, max_clients=max_clients)
+
+
+def run_variant(variant: str, clients: int, calls: int, limit: RateLimit, max_clients: int):
+    """Measure one limiter in this process and print the results as JSON"""
+    # Client keys look like IPv4 addresses, picked at random for every call
+    rng = random.Random(42)
+    keys = [f"ip:10.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}" for i in range(clients)]
+    sequence = [keys[rng.randrange(clients)] for _ in range(calls)]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        limiter = make_limiter(variant, limit, max_clients, os.path.join(tmp, "bench.sqlite3"))
+        rss_start = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        limited = 0
+        start = time.perf_counter()
+        for key in sequence:
+            if limiter.is_rate_limited(key):
+                limited += 1
+        elapsed = time.perf_counter() - start
+        rss_peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        tracked = len(limiter.clients) if variant == "list" else limiter.stats()["clients"]
+        if variant != "list":
+            limiter.close()
+
+    print(json.dumps({
+        "variant": variant,
+        "calls_per_second": calls / elapsed,
+        "us_per_call": elapsed / calls * 1e6,
+        "limited": limited,
+        "tracked_clients": tracked,
+        "rss_growth_mb": (rss_peak - rss_start) / 1024,  # ru_maxrss is in KB on Linux
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the previous list-based rate limiter with the token-bucket backends")
+    parser.add_argument("--clients", type=int, default=1_000_000, help="Distinct client keys")
+    parser.add_argument("--calls", type=int, default=2_000_000, help="Rate limit checks per variant")
+    parser.add_argument("--requests", type=int, default=10, help="Requests allowed per window")
+    parser.add_argument("--window", type=float, default=60, help="Window in seconds")
+    parser.add_argument("--max-clients", type=int, default=100_000, help="Clients the memory backend keeps")
+    parser.add_argument("--sqlite-calls", type=int, default=100_000, help="Checks for the (much slower) sqlite backend")
+    parser.add_argument("--variants", default="list,memory,sqlite", help="Comma separated: list, memory, sqlite")
+    parser.add_argument("--variant", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    limit = RateLimit(args.requests, args.window)
+
+    if args.variant:
+        calls = args.sqlite_calls if args.variant == "sqlite" else args.calls
+        run_variant(args.variant, args.clients, calls, limit, args.max_clients)
+        return
+
+    # Run each variant in a fresh interpreter so peak RSS is not shared
+    print(f"{args.clients:,} distinct clients, limit {args.requests} requests per {args.window:g}s")
+    print("| Variant | Checks | Checks/s | µs/check | Limited | Clients tracked | Peak RSS growth (MB) |")
+    print("|---------|--------|----------|----------|---------|-----------------|----------------------|")
+    for variant in args.variants.split(","):
+        output = subprocess.check_output([
+            sys.executable, __file__, "--variant", variant,
+            "--clients", str(args.clients), "--calls", str(args.calls),
+            "--requests", str(args.requests), "--window", str(args.window),
+            "--max-clients", str(args.max_clients), "--sqlite-calls", str(args.sqlite_calls),
+        ])
+        result = json.loads(output.decode().strip().splitlines()[-1])
+        calls = args.sqlite_calls if variant == "sqlite" else args.calls
+        print(f"| {variant} | {calls:,} | {result['calls_per_second']:,.0f} | {result['us_per_call']:.2f} | "
+              f"{result['limited']:,} | {result['tracked_clients']:,} | {result['rss_growth_mb']:.1f} |")
+
+
+if __name__ == "__main__":
+    main()
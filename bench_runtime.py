@@ -0,0 +1,173 @@
+import argparse
+import json
+import math
+import multiprocessing
+import os
+import statistics
+import time
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+from pathlib import Path
+from typing import Any, Dict, List, Tuple
+
+import ocr_pool
+from bench_preprocess import similarity
+from ocr_engine import engine_options_from_env
+from preprocess import PreprocessOptions
+from runtime_config import RuntimeConfig, available_cpus, describe, engine_kwargs, load_runtime_config, make_runtime_config
+
+IMAGE_PATTERNS = ("*.jpg", "*.jpeg", "*.png", "*.bmp", "*.webp")
+
+
+def timed_ocr(image_bytes: bytes, cls: bool, options: PreprocessOptions) -> Tuple[float, str]:
+    """OCR one image in a benchmark worker; its latency and text"""
+    start = time.perf_counter()
+    result = ocr_pool.run_ocr(image_bytes, cls, options)
+    return time.perf_counter() - start, result["text"]
+
+
+def thread_candidates(value: str, workers: int) -> List[int]:
+    """Thread counts to try; ``auto`` is 1, 2, 4, 8 and the CPUs per worker, up to the CPUs per worker"""
+    if value != "auto":
+        return [int(threads) for threads in value.split(",")]
+    per_worker = max(1, available_cpus() // workers)
+    return sorted({threads for threads in (1, 2, 4, 8) if threads <= per_worker} | {per_worker})
+
+
+def model_dirs(value: str) -> Dict[str, str]:
+    dirs = dict(zip(("det_model_dir", "rec_model_dir", "cls_model_dir"), value.split(",")))
+    if len(dirs) < 2:
+        raise ValueError(f"Expected det,rec[,cls] model paths, got '{value}'")
+    return dirs
+
+
+def candidates(base: RuntimeConfig, args) -> List[Tuple[str, RuntimeConfig]]:
+    """The configurations to measure, labelled; the first (the current one) is the accuracy reference"""
+    threads = thread_candidates(args.threads, args.workers)
+    mkldnn = [{"on": True, "off": False, "default": None}[switch] for switch in args.mkldnn.split(",")]
+    variants = [("current", {}, base.backend)]
+    for variant in args.variant:
+        name, _, dirs = variant.partition("=")
+        variants.append((name, model_dirs(dirs), "paddle"))
+    if args.onnx:
+        try:
+            import onnxruntime  # noqa: F401
+            variants.append(("onnx", model_dirs(args.onnx), "onnx"))
+        except ImportError:
+            print("Skipping the onnx backend: onnxruntime is not installed (pip install onnxruntime)")
+
+    configs = [("current", base)]
+    for name, dirs, backend in variants:
+        # oneDNN is a Paddle Inference setting; ONNX Runtime has its own CPU kernels
+        for switch in (mkldnn if backend == "paddle" else [None]):
+            for count in threads:
+                config = make_runtime_config({**base._asdict(), **dirs, "backend": backend, "threads": count, "mkldnn": switch})
+                if all(config != seen for _, seen in configs):
+                    configs.append((name, config))
+    return configs
+
+
+def measure(config: RuntimeConfig, corpus: List[bytes], engine_options: Dict[str, Any], args) -> Dict[str, Any]:
+    """Load ``args.workers`` OCR processes with ``config`` and time ``args.repeat`` passes over the corpus"""
+    if args.engine != "fake":
+        engine_options = {**engine_options, **engine_kwargs(config)}
+    options = PreprocessOptions(max_side=args.max_side)
+    context = multiprocessing.get_context("spawn")
+    start = time.perf_counter()
+    with ProcessPoolExecutor(
+        max_workers=args.workers,
+        mp_context=context,
+        initializer=ocr_pool._init_worker,
+        initargs=(args.engine, engine_options, 1, 1024, config.threads, None, None, context.Barrier(args.workers)),
+    ) as executor:
+        reports = ocr_pool.start_workers(executor, args.workers)
+        load_time = time.perf_counter() - start
+        if not all(report["ready"] for report in reports):
+            return {"error": "OCR engine could not be initialized"}
+        tasks = [image for _ in range(args.repeat) for image in corpus]
+        start = time.perf_counter()
+        try:
+            outputs = list(executor.map(timed_ocr, tasks, repeat(not args.no_cls), repeat(options)))
+        except Exception as e:
+            return {"error": str(e)}
+        wall = time.perf_counter() - start
+    latencies = sorted(latency for latency, _ in outputs)
+    return {
+        "throughput": len(tasks) / wall,
+        "median_ms": statistics.median(latencies) * 1000,
+        "p90_ms": latencies[math.ceil(0.9 * len(latencies)) - 1] * 1000,
+        "load_s": load_time,
+        "texts": [text for _, text in outputs[:len(corpus)]],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sweep OCR runtime settings on this host and report the fastest")
+    parser.add_argument("--image-dir", default="./test_images", help="Corpus, e.g. made by generate_test_images.py")
+    parser.add_argument("--max-images", type=int, default=0, help="Use at most this many images")
+    parser.add_argument("--repeat", type=int, default=2, help="Timed passes over the corpus per setting")
+    parser.add_argument("--engine", default="paddle", help="OCR engine (paddle or fake)")
+    parser.add_argument("--lang", default="en", help="OCR language")
+    parser.add_argument("--no-cls", action="store_true", help="Skip angle classification")
+    parser.add_argument("--max-side", type=int, default=2048, help="Downscale target, as OCR_MAX_SIDE (0 keeps full size)")
+    parser.add_argument("--workers", type=int, default=int(os.environ.get("OCR_WORKERS", "2")),
+                        help="OCR processes running at once, as OCR_WORKERS; threads are per process")
+    parser.add_argument("--threads", default="auto", help='Comma-separated thread counts per worker, or "auto"')
+    parser.add_argument("--mkldnn", default="on,off", help="MKLDNN settings to try: on, off, default")
+    parser.add_argument("--variant", action="append", default=[],
+                        help="Extra Paddle model variant NAME=DET_DIR,REC_DIR[,CLS_DIR], e.g. mobile or int8 models (repeatable)")
+    parser.add_argument("--onnx", help="DET.onnx,REC.onnx[,CLS.onnx]: also try the ONNX Runtime backend with these models")
+    parser.add_argument("--min-similarity", type=float, default=0.98,
+                        help="Settings whose text differs more from the current configuration's are not recommended")
+    parser.add_argument("--output", help="Write the fastest configuration to this JSON file, for OCR_RUNTIME_CONFIG")
+    args = parser.parse_args()
+
+    files = sorted(path for pattern in IMAGE_PATTERNS for path in Path(args.image_dir).glob(pattern))
+    if args.max_images > 0:
+        files = files[:args.max_images]
+    if not files:
+        print(f"No image files found in {args.image_dir}")
+        return
+    corpus = [path.read_bytes() for path in files]
+    engine_options = {"lang": args.lang, "use_angle_cls": not args.no_cls}
+    if args.engine == "fake":
+        engine_options.update(engine_options_from_env(os.environ))
+
+    configs = candidates(load_runtime_config(os.environ, args.workers), args)
+    print(f"Benchmarking {len(configs)} settings on {len(corpus)} images from {args.image_dir}, "
+          f"{args.workers} workers, {args.repeat} passes, {available_cpus()} CPUs\n")
+    print("| Variant | Settings | Images/s | Median (ms) | p90 (ms) | Load (s) | Accuracy vs current |")
+    print("|---------|----------|----------|-------------|----------|----------|---------------------|")
+    results, reference = [], None
+    for name, config in configs:
+        result = measure(config, corpus, engine_options, args)
+        if "error" in result:
+            print(f"| {name} | {describe(config)} | failed: {result['error']} | | | | |")
+            continue
+        if reference is None:
+            reference = result["texts"]
+        result["accuracy"] = statistics.mean(similarity(ref, text) for ref, text in zip(reference, result["texts"]))
+        results.append((name, config, result))
+        print(f"| {name} | {describe(config)} | {result['throughput']:.2f} | {result['median_ms']:.1f} | "
+              f"{result['p90_ms']:.1f} | {result['load_s']:.1f} | {result['accuracy'] * 100:.1f}% |")
+
+    eligible = [entry for entry in results if entry[2]["accuracy"] >= args.min_similarity]
+    if not eligible:
+        print("\nNo setting ran successfully")
+        return
+    name, best, result = max(eligible, key=lambda entry: entry[2]["throughput"])
+    print(f"\nFastest: {name} ({describe(best)}), {result['throughput']:.2f} images/s")
+    if args.engine == "fake":
+        print("(the fake engine ignores runtime settings other than threads)")
+    default = RuntimeConfig()
+    settings = {field: value for field, value in best._asdict().items() if value != getattr(default, field)}
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(settings, f, indent=2)
+        print(f"Saved to {args.output}; use it with OCR_RUNTIME_CONFIG={args.output}")
+    else:
+        print(json.dumps(settings, indent=2))
+
+
+if __name__ == "__main__":
+    main()
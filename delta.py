@@ -0,0 +1,213 @@
+import asyncio
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import Any, Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+import cv2
+import numpy as np
+
+from preprocess import PreprocessOptions, decode_image
+from tiling import reading_order
+
+# Frames are compared as grayscale thumbnails with this long side; JPEGs are
+# decoded straight at reduced resolution
+DIFF_SIDE = 640
+
+# Thumbnail pixels per side of a block, the unit changes are tracked in
+BLOCK = 16
+
+# Grey levels a thumbnail pixel must move by to count as changed; lower
+# differences are compression noise and antialiasing
+PIXEL_THRESHOLD = 16
+
+# (x, y, width, height) of a changed region, in original image pixels
+Region = Tuple[int, int, int, int]
+
+
+class Frame(NamedTuple):
+    """What a session keeps of its last frame: the thumbnail it is compared by and its OCR result"""
+    config: Any
+    thumbnail: np.ndarray
+    scale: float  # thumbnail pixels per original pixel
+    result: Dict[str, Any]
+
+
+def frame_thumbnail(image_bytes) -> Tuple[np.ndarray, float]:
+    """Grayscale thumbnail of an upload and its scale, for comparing it with the previous frame"""
+    decoded, _, origins = decode_image(image_bytes, PreprocessOptions(max_side=DIFF_SIDE, grayscale=True))
+    return decoded[0][:, :, 0], origins[0][2]
+
+
+def _bounds(box: Sequence[Sequence[float]]) -> Tuple[float, float, float, float]:
+    points = np.asarray(box, dtype=np.float64).reshape(-1, 2)
+    x0, y0 = points.min(axis=0)
+    x1, y1 = points.max(axis=0)
+    return x0, y0, x1, y1
+
+
+def _intersects(a: Tuple[float, float, float, float], b: Tuple[float, float, float, float]) -> bool:
+    return a[0] < b[2] and b[0] < a[2] and a[1] < b[3] and b[1] < a[3]
+
+
+def _merge_overlapping(rects: List[List[float]]) -> List[List[float]]:
+    """Union of overlapping rectangles, until none overlap"""
+    merged = True
+    while merged:
+        merged = False
+        for i in range(len(rects)):
+            for j in range(i + 1, len(rects)):
+                if _intersects(rects[i], rects[j]):
+                    a, b = rects[i], rects.pop(j)
+                    rects[i] = [min(a[0], b[0]), min(a[1], b[1]), max(a[2], b[2]), max(a[3], b[3])]
+                    merged = True
+                    break
+            if merged:
+                break
+    return rects
+
+
+def changed_regions(previous: Frame, thumbnail: np.ndarray, lines: Sequence[Sequence[Any]]) -> Optional[List[Region]]:
+    """Regions of the new frame that need OCR again, in original pixels; None when it cannot be compared.
+
+    Changed blocks are grown by one block on every side, so text next to
+    a change is read with it, and each region is widened to the whole of
+    every previous line it touches: a line is either kept or read again,
+    never split.
+    """
+    if previous.thumbnail.shape != thumbnail.shape:
+        return None
+    height, width = thumbnail.shape
+    changed = cv2.absdiff(previous.thumbnail, thumbnail) > PIXEL_THRESHOLD
+    rows, cols = -(-height // BLOCK), -(-width // BLOCK)
+    changed = np.pad(changed, ((0, rows * BLOCK - height), (0, cols * BLOCK - width)))
+    blocks = changed.reshape(rows, BLOCK, cols, BLOCK).any(axis=(1, 3)).astype(np.uint8)
+    if not blocks.any():
+        return []
+    blocks = cv2.dilate(blocks, np.ones((3, 3), np.uint8))
+    count, _, stats, _ = cv2.connectedComponentsWithStats(blocks, connectivity=8)
+
+    scale = previous.scale
+    full_width, full_height = width / scale, height / scale
+    rects = []
+    for x, y, w, h, _ in stats[1:count]:
+        rects.append([x * BLOCK / scale, y * BLOCK / scale,
+                      min(full_width, (x + w) * BLOCK / scale), min(full_height, (y + h) * BLOCK / scale)])
+    line_bounds = [_bounds(line[0]) for line in lines]
+
+    def grow(rect):
+        for bounds in line_bounds:
+            if _intersects(rect, bounds):
+                rect = [min(rect[0], bounds[0]), min(rect[1], bounds[1]), max(rect[2], bounds[2]), max(rect[3], bounds[3])]
+        return rect
+
+    # Widening a region can make it reach more lines, or another region
+    rects = _merge_overlapping(rects)
+    while True:
+        grown = _merge_overlapping([grow(rect) for rect in rects])
+        if grown == rects:
+            break
+        rects = grown
+    regions = []
+    for x0, y0, x1, y1 in rects:
+        x0, y0 = max(0, int(x0)), max(0, int(y0))
+        x1, y1 = min(int(full_width + 0.5), int(np.ceil(x1))), min(int(full_height + 0.5), int(np.ceil(y1)))
+        if x1 > x0 and y1 > y0:
+            regions.append((x0, y0, x1 - x0, y1 - y0))
+    return regions
+
+
+def region_fraction(regions: Sequence[Region], thumbnail: np.ndarray, scale: float) -> float:
+    """Share of the image covered by ``regions``, which do not overlap"""
+    height, width = thumbnail.shape[:2]
+    area = (width / scale) * (height / scale)
+    return min(1.0, sum(w * h for _, _, w, h in regions) / area) if area else 1.0
+
+
+def refresh_thumbnail(previous: Frame, thumbnail: np.ndarray, regions: Sequence[Region]) -> np.ndarray:
+    """The previous thumbnail with ``regions`` taken from the new one.
+
+    What a session compares the next frame with must match the result it
+    keeps, so blocks that moved by less than the threshold are not
+    updated: changes that creep in a little per frame still add up to one.
+    """
+    updated = previous.thumbnail.copy()
+    height, width = thumbnail.shape
+    for x, y, w, h in regions:
+        x0, y0 = int(x * previous.scale), int(y * previous.scale)
+        x1, y1 = min(width, int(np.ceil((x + w) * previous.scale))), min(height, int(np.ceil((y + h) * previous.scale)))
+        updated[y0:y1, x0:x1] = thumbnail[y0:y1, x0:x1]
+    return updated
+
+
+def merge_frame_lines(previous_lines: Sequence[Sequence[Any]], new_lines: Sequence[Sequence[Any]],
+                      regions: Sequence[Region]) -> List[List[Any]]:
+    """Previous lines outside ``regions`` plus the lines read in them again, in reading order"""
+    rects = [(x, y, x + w, y + h) for x, y, w, h in regions]
+    kept = [line for line in previous_lines if not any(_intersects(_bounds(line[0]), rect) for rect in rects)]
+    ordered = reading_order([{"bounds": _bounds(line[0]), "line": line} for line in [*kept, *new_lines]])
+    return [list(entry["line"]) for entry in ordered]
+
+
+class FrameSessions:
+    """The last frame of each client session, for delta OCR of the next one.
+
+    Bounded by ``max_sessions`` (least recently used go first) and by
+    ``ttl_seconds`` of inactivity. Frames of one session are processed one
+    at a time, as each is compared with the one before it. Sessions live
+    in the memory of one API process.
+    """
+
+    def __init__(self, max_sessions: int = 128, ttl_seconds: float = 300):
+        self.max_sessions = max_sessions
+        self.ttl = ttl_seconds
+        self._frames: "OrderedDict[str, Tuple[float, Frame]]" = OrderedDict()
+        self._locks: Dict[str, Tuple[asyncio.Lock, int]] = {}  # lock and the requests using it
+        self._counters = {"full": 0, "partial": 0, "unchanged": 0, "evictions": 0}
+
+    @asynccontextmanager
+    async def serialized(self, session: str):
+        """Hold the session's lock for the body, so its frames are read in turn"""
+        lock, users = self._locks.get(session, (None, 0))
+        lock = lock or asyncio.Lock()
+        self._locks[session] = (lock, users + 1)
+        try:
+            async with lock:
+                yield
+        finally:
+            lock, users = self._locks[session]
+            if users == 1:
+                del self._locks[session]
+            else:
+                self._locks[session] = (lock, users - 1)
+
+    def get(self, session: str, config: Any) -> Optional[Frame]:
+        """The session's last frame, if it was read with the same ``config``"""
+        entry = self._frames.get(session)
+        if entry is None:
+            return None
+        updated, frame = entry
+        if time.monotonic() - updated > self.ttl:
+            self._remove(session)
+            return None
+        return frame if frame.config == config else None
+
+    def put(self, session: str, frame: Frame, kind: str):
+        """Record ``frame`` as the session's last, ``kind`` being how it was read: full, partial or unchanged"""
+        self._frames.pop(session, None)
+        self._frames[session] = (time.monotonic(), frame)
+        self._counters[kind] += 1
+        while len(self._frames) > self.max_sessions:
+            self._remove(next(iter(self._frames)))
+            self._counters["evictions"] += 1
+
+    def _remove(self, session: str):
+        del self._frames[session]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "sessions": len(self._frames),
+            "max_sessions": self.max_sessions,
+            "thumbnail_mb": round(sum(frame.thumbnail.nbytes for _, frame in self._frames.values()) / (1024 * 1024), 2),
+            **self._counters,
+        }
@@ -0,0 +1,85 @@
+import io
+import mmap
+import os
+from contextlib import contextmanager
+from typing import Callable, Iterator, Tuple
+
+from fastapi import UploadFile
+
+# Allowance for multipart boundaries and part headers on top of the file itself
+MULTIPART_OVERHEAD = 64 * 1024
+
+
+class FileTooLargeError(Exception):
+    """Raised when an upload exceeds the allowed size"""
+
+    def __init__(self, file_size: int, max_size: int):
+        super().__init__(f"File too large. Maximum size allowed is {max_size / (1024 * 1024):.1f} MB")
+        self.file_size = file_size
+        self.max_size = max_size
+
+
+def content_length_exceeds(headers, max_body_size: int) -> bool:
+    """True if the declared Content-Length is already over the limit"""
+    content_length = headers.get("content-length", "")
+    return content_length.isdigit() and int(content_length) > max_body_size + MULTIPART_OVERHEAD
+
+
+def _noop():
+    pass
+
+
+def _map_spooled(spooled, size: int) -> Tuple[memoryview, Callable[[], None]]:
+    """Expose the spooled upload as a buffer, without copying when possible"""
+    if size == 0:
+        return memoryview(b""), _noop
+
+    # Starlette spools uploads into a SpooledTemporaryFile: small ones stay
+    # in a BytesIO whose buffer can be shared, larger ones roll over to a
+    # temporary file that can be memory-mapped
+    raw = getattr(spooled, "_file", spooled)
+    if isinstance(raw, io.BytesIO):
+        view = raw.getbuffer()
+        return view, view.release
+
+    try:
+        mapped = mmap.mmap(raw.fileno(), 0, access=mmap.ACCESS_READ)
+    except (AttributeError, OSError, ValueError, io.UnsupportedOperation):
+        # Fall back to a single preallocated buffer
+        buffer = bytearray(size)
+        spooled.readinto(buffer)
+        return memoryview(buffer), _noop
+
+    view = memoryview(mapped)
+
+    def close():
+        view.release()
+        mapped.close()
+    return view, close
+
+
+@contextmanager
+def open_upload(file: UploadFile, max_size: int) -> Iterator[memoryview]:
+    """Yield the contents of an upload as a read-only-by-convention buffer.
+
+    The size is checked before anything is read, and the buffer is only
+    valid inside the ``with`` block.
+    """
+    spooled = file.file
+    spooled.flush()
+    spooled.seek(0, os.SEEK_END)
+    size = spooled.tell()
+    spooled.seek(0)
+    if size > max_size:
+        raise FileTooLargeError(size, max_size)
+
+    view, close = _map_spooled(spooled, size)
+    try:
+        yield view
+    finally:
+        try:
+            close()
+        except BufferError:
+            # A worker still holds a reference (request was cancelled mid-OCR);
+            # the buffer is released when that reference goes away
+            pass
@@ -0,0 +1,275 @@
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Optional
+
+from ocr_pool import PoolBusyError
+
+logger = logging.getLogger("paddleocr-api")
+
+TERMINAL_STATUSES = ("done", "failed", "cancelled")
+
+# Seconds between checks for changes made by other processes sharing the database
+POLL_INTERVAL = 0.5
+
+
+class JobQueueFullError(Exception):
+    """Raised when too many jobs are already waiting"""
+
+
+class JobStore:
+    """Jobs persisted in sqlite: queued -> running -> done | failed | cancelled.
+
+    Several API processes may open the same database; claiming a job is a
+    single UPDATE so each job runs once, and running jobs record the pid of
+    the process running them. Upload bytes are kept only until the job
+    finishes.
+    """
+
+    def __init__(self, path: str):
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, timeout=5, isolation_level=None, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("""CREATE TABLE IF NOT EXISTS jobs (
+            id TEXT PRIMARY KEY, status TEXT, priority INTEGER, params TEXT, image BLOB,
+            created REAL, started REAL, finished REAL, result TEXT, error TEXT, owner INTEGER)""")
+        self._db.execute("CREATE INDEX IF NOT EXISTS jobs_queue ON jobs (status, priority DESC, created)")
+
+    def _execute(self, sql: str, args=()) -> sqlite3.Cursor:
+        with self._lock:
+            return self._db.execute(sql, args)
+
+    def recover(self) -> int:
+        """Requeue jobs whose process stopped while running them"""
+        owners = self._execute("SELECT DISTINCT owner FROM jobs WHERE status = 'running'").fetchall()
+        recovered = 0
+        for (owner,) in owners:
+            if owner is not None and owner != os.getpid() and _process_alive(owner):
+                continue
+            recovered += self._execute("UPDATE jobs SET status = 'queued', started = NULL, owner = NULL "
+                                       "WHERE status = 'running' AND owner IS ?", (owner,)).rowcount
+        return recovered
+
+    def add(self, job_id: str, priority: int, params: Dict[str, Any], image: bytes):
+        self._execute("INSERT INTO jobs (id, status, priority, params, image, created) VALUES (?, 'queued', ?, ?, ?, ?)",
+                      (job_id, priority, json.dumps(params), image, time.time()))
+
+    def count(self, status: str) -> int:
+        return self._execute("SELECT COUNT(*) FROM jobs WHERE status = ?", (status,)).fetchone()[0]
+
+    def claim(self) -> Optional[tuple]:
+        """Mark the next queued job (highest priority, then oldest) running and return it"""
+        with self._lock:
+            return self._db.execute(
+                """UPDATE jobs SET status = 'running', started = ?, owner = ? WHERE status = 'queued' AND id = (
+                       SELECT id FROM jobs WHERE status = 'queued' ORDER BY priority DESC, created LIMIT 1)
+                   RETURNING id, params, image""",
+                (time.time(), os.getpid())).fetchone()
+
+    def requeue(self, job_id: str):
+        self._execute("UPDATE jobs SET status = 'queued', started = NULL, owner = NULL "
+                      "WHERE id = ? AND status = 'running'", (job_id,))
+
+    def finish(self, job_id: str, status: str, result: Optional[Dict[str, Any]] = None, error: Optional[str] = None):
+        # A job cancelled meanwhile stays cancelled
+        self._execute("""UPDATE jobs SET status = ?, finished = ?, result = ?, error = ?, image = NULL
+                         WHERE id = ? AND status = 'running'""",
+                      (status, time.time(), json.dumps(result) if result is not None else None, error, job_id))
+
+    def cancel(self, job_id: str) -> bool:
+        return self._execute("""UPDATE jobs SET status = 'cancelled', finished = ?, image = NULL
+                                WHERE id = ? AND status IN ('queued', 'running')""",
+                             (time.time(), job_id)).rowcount > 0
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._db.execute("SELECT id, status, priority, created, started, finished, result, error "
+                                   "FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if row is None:
+                return None
+            job = dict(zip(("id", "status", "priority", "created", "started", "finished", "result", "error"), row))
+            if job["status"] == "queued":
+                job["queue_position"] = self._db.execute(
+                    "SELECT COUNT(*) FROM jobs WHERE status = 'queued' AND (priority > ? OR (priority = ? AND created < ?))",
+                    (job["priority"], job["priority"], job["created"])).fetchone()[0]
+        job["result"] = json.loads(job["result"]) if job["result"] else None
+        return job
+
+    def purge(self, finished_before: float) -> int:
+        return self._execute("DELETE FROM jobs WHERE status IN ('done', 'failed', 'cancelled') AND finished < ?",
+                             (finished_before,)).rowcount
+
+    def stats(self) -> Dict[str, int]:
+        rows = self._execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+        return dict(rows)
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+def _process_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class JobQueue:
+    """Runs persisted OCR jobs in the background at a bounded concurrency.
+
+    ``process(image_bytes, params)`` does the work for one job. At most
+    ``workers`` jobs run at once in this process, so a burst of submissions
+    waits in the database rather than as open connections. Finished jobs
+    are deleted ``result_ttl`` seconds after they complete.
+    """
+
+    def __init__(self, path: str, process: Callable[[bytes, Dict[str, Any]], Awaitable[Dict[str, Any]]],
+                 workers: int = 4, max_queued: int = 1000, result_ttl: float = 3600,
+                 is_ready: Callable[[], bool] = lambda: True, on_finished: Optional[Callable[[str], None]] = None):
+        self.path = path
+        self.process = process
+        self.workers = max(1, workers)
+        self.max_queued = max_queued
+        self.result_ttl = result_ttl
+        self.is_ready = is_ready
+        self.on_finished = on_finished
+        self.store: Optional[JobStore] = None
+        self._runners = []
+        self._running: Dict[str, asyncio.Task] = {}
+        self._cancelling = set()
+        self._submitted = asyncio.Event()
+        self._changed = asyncio.Event()
+
+    async def start(self):
+        self.store = await asyncio.to_thread(JobStore, self.path)
+        recovered = await asyncio.to_thread(self.store.recover)
+        if recovered:
+            logger.info(f"Requeued {recovered} jobs interrupted by the last shutdown")
+        self._runners = [asyncio.create_task(self._run_jobs()) for _ in range(self.workers)]
+
+    async def stop(self):
+        for runner in self._runners:
+            runner.cancel()
+        await asyncio.gather(*self._runners, return_exceptions=True)
+        self._runners = []
+        if self.store is not None:
+            self.store.close()
+            self.store = None
+
+    def _notify(self):
+        # Wake everyone waiting for a change, then start a fresh generation
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def submit(self, image_bytes: bytes, params: Dict[str, Any], priority: int = 0) -> Dict[str, Any]:
+        if await asyncio.to_thread(self.store.count, "queued") >= self.max_queued:
+            raise JobQueueFullError(f"Too many queued jobs (limit {self.max_queued})")
+        job_id = uuid.uuid4().hex
+        await asyncio.to_thread(self.store.add, job_id, priority, params, image_bytes)
+        self._submitted.set()
+        return await self.get(job_id)
+
+    async def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        return await asyncio.to_thread(self.store.get, job_id)
+
+    async def wait(self, job_id: str, timeout: float) -> Optional[Dict[str, Any]]:
+        """Return the job once it has finished, or as it is when ``timeout`` expires"""
+        deadline = time.monotonic() + timeout
+        async for job in self.watch(job_id):
+            if job["status"] in TERMINAL_STATUSES or time.monotonic() >= deadline:
+                return job
+        return None
+
+    async def watch(self, job_id: str, heartbeat: Optional[float] = None) -> AsyncIterator[Optional[Dict[str, Any]]]:
+        """Yield the job whenever its status changes until it finishes.
+
+        Yields ``None`` for an unknown job, and with ``heartbeat`` set, the
+        unchanged job again every ``heartbeat`` seconds.
+        """
+        last_status, last_yield = None, 0.0
+        while True:
+            changed = self._changed
+            job = await self.get(job_id)
+            if job is None:
+                yield None
+                return
+            now = time.monotonic()
+            if job["status"] != last_status or (heartbeat and now - last_yield >= heartbeat):
+                last_status, last_yield = job["status"], now
+                yield job
+            if job["status"] in TERMINAL_STATUSES:
+                return
+            try:
+                await asyncio.wait_for(changed.wait(), POLL_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+
+    async def cancel(self, job_id: str) -> Optional[Dict[str, Any]]:
+        if await asyncio.to_thread(self.store.cancel, job_id):
+            task = self._running.get(job_id)
+            if task is not None:
+                self._cancelling.add(job_id)
+                task.cancel()
+            self._notify()
+            if self.on_finished is not None:
+                self.on_finished("cancelled")
+        return await self.get(job_id)
+
+    async def _run_jobs(self):
+        last_purge = 0.0
+        while True:
+            if time.monotonic() - last_purge > 60:
+                last_purge = time.monotonic()
+                purged = await asyncio.to_thread(self.store.purge, time.time() - self.result_ttl)
+                if purged:
+                    logger.info(f"Deleted {purged} expired jobs")
+
+            job = await asyncio.to_thread(self.store.claim) if self.is_ready() else None
+            if job is None:
+                # Also poll, for jobs submitted through other processes
+                self._submitted.clear()
+                try:
+                    await asyncio.wait_for(self._submitted.wait(), 1)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            job_id, params, image_bytes = job
+            self._notify()
+            task = asyncio.ensure_future(self.process(image_bytes, json.loads(params)))
+            self._running[job_id] = task
+            try:
+                result = await task
+                await asyncio.to_thread(self.store.finish, job_id, "done", result)
+            except PoolBusyError as e:
+                await asyncio.to_thread(self.store.requeue, job_id)
+                await asyncio.sleep(min(e.retry_after, 5))
+            except asyncio.CancelledError:
+                if job_id not in self._cancelling:
+                    # The runner itself is stopping; leave the job for the next start
+                    self.store.requeue(job_id)
+                    raise
+            except Exception as e:
+                logger.error(f"Job {job_id} failed: {str(e)}")
+                await asyncio.to_thread(self.store.finish, job_id, "failed", None, str(e))
+            finally:
+                self._running.pop(job_id, None)
+                self._cancelling.discard(job_id)
+            self._notify()
+            if self.on_finished is not None:
+                finished = await self.get(job_id)
+                if finished is not None and finished["status"] in ("done", "failed"):
+                    self.on_finished(finished["status"])
+
+    async def stats(self) -> Dict[str, Any]:
+        counts = await asyncio.to_thread(self.store.stats) if self.store is not None else {}
+        return {"workers": self.workers, "running_here": len(self._running), **counts}
@@ -0,0 +1,177 @@
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import threading
+import time
+import zlib
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from typing import Any, Dict, Optional
+
+# Id of the request being handled, and the time it has spent in each stage
+# so far (seconds, summed over its images); set by the API's middleware
+request_id: ContextVar[Optional[str]] = ContextVar("request_id", default=None)
+request_stages: ContextVar[Optional[Dict[str, float]]] = ContextVar("request_stages", default=None)
+
+# Attributes every LogRecord has; anything else was passed with ``extra=``
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime", "request_id"}
+
+_listener: Optional[logging.handlers.QueueListener] = None
+_queue_handler: Optional["NonBlockingQueueHandler"] = None
+_sampler: Optional["SamplingFilter"] = None
+
+
+def record_stage(stage: str, seconds: float):
+    """Add ``seconds`` to ``stage`` in the current request's timings (no-op outside a request)"""
+    stages = request_stages.get()
+    if stages is not None:
+        stages[stage] = stages.get(stage, 0.0) + seconds
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line: time, level, logger, message, request id, ``extra`` fields and traceback"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        if getattr(record, "request_id", None):
+            entry["request_id"] = record.request_id
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRIBUTES:
+                entry[key] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+class TextFormatter(logging.Formatter):
+    def __init__(self):
+        super().__init__("%(asctime)s - %(name)s - %(levelname)s - [%(request_id)s] %(message)s")
+
+    def format(self, record: logging.LogRecord) -> str:
+        if not getattr(record, "request_id", None):
+            record.request_id = "-"
+        return super().format(record)
+
+
+class SamplingFilter(logging.Filter):
+    """Keeps every warning and error, and INFO and below only for a sample of requests.
+
+    A request is in the sample when the hash of its id falls under
+    ``rate``, so its lines are kept or dropped together. At most
+    ``max_per_second`` INFO records pass per second, whatever the
+    request rate. Runs in the thread that logs, before anything is queued.
+    """
+
+    def __init__(self, rate: float = 1.0, max_per_second: float = 0):
+        super().__init__()
+        self.threshold = int(max(0.0, min(1.0, rate)) * 0xFFFFFFFF)
+        self.max_per_second = max_per_second
+        self._second = 0
+        self._passed = 0
+        self._lock = threading.Lock()
+        self.counters = {"sampled_out": 0, "rate_limited": 0}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.request_id = request_id.get()
+        if record.levelno >= logging.WARNING:
+            return True
+        if record.request_id is not None and zlib.crc32(record.request_id.encode()) > self.threshold:
+            self.counters["sampled_out"] += 1
+            return False
+        if self.max_per_second > 0:
+            with self._lock:
+                second = int(time.monotonic())
+                if second != self._second:
+                    self._second, self._passed = second, 0
+                if self._passed >= self.max_per_second:
+                    self.counters["rate_limited"] += 1
+                    return False
+                self._passed += 1
+        return True
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """Hands records to the listener thread; drops them rather than wait when the queue is full.
+
+    The message is rendered here, where its arguments are still current,
+    but formatting to JSON and writing happen in the listener thread.
+    """
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # This is the only handler, so the record is changed in place rather than copied
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        record.msg, record.args, record.exc_info = record.getMessage(), None, None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def setup_logging(level: str = "INFO", fmt: str = "json", file: Optional[str] = "api_server.log",
+                  max_bytes: int = 50 * 1024 * 1024, backups: int = 5, sample_rate: float = 1.0,
+                  max_per_second: float = 0, queue_size: int = 10000):
+    """Route all logging through a queue to a listener thread that writes to stderr and a rotating file.
+
+    Logging calls only put a record on the queue, so request handlers never
+    wait on disk or console I/O. ``file`` may contain ``{pid}`` to give each
+    process its own file; processes must not rotate the same file.
+    Calling it again has no effect.
+    """
+    global _listener, _queue_handler, _sampler
+    if _listener is not None:
+        return
+    formatter = JsonFormatter() if fmt == "json" else TextFormatter()
+    handlers = [logging.StreamHandler(sys.stderr)]
+    if file:
+        path = file.format(pid=os.getpid())
+        handlers.append(logging.handlers.RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backups, encoding="utf-8"))
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    log_queue: queue.Queue = queue.Queue(maxsize=queue_size)
+    _queue_handler = NonBlockingQueueHandler(log_queue)
+    _sampler = SamplingFilter(sample_rate, max_per_second)
+    _queue_handler.addFilter(_sampler)
+    root = logging.getLogger()
+    root.handlers = [_queue_handler]
+    root.setLevel(level.upper())
+    _listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    _listener.start()
+    atexit.register(stop_logging)
+
+
+def stop_logging():
+    """Write out what is still queued and stop the listener thread"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def logging_stats() -> Dict[str, Any]:
+    if _queue_handler is None:
+        return {}
+    return {
+        "queued": _queue_handler.queue.qsize(),
+        "queue_full": _queue_handler.dropped,
+        **(_sampler.counters if _sampler is not None else {}),
+    }
@@ -1,35 +1,279 @@
-import re
-import numpy as np
-from io import BytesIO
+import json
+import asyncio
+import zipfile
+import tarfile
+from collections import deque
+from contextlib import ExitStack
+from functools import partial
 from fastapi import FastAPI, File, UploadFile, HTTPException, Depends
-from paddleocr import PaddleOCR
-import cv2
 from fastapi.middleware.cors import CORSMiddleware
-import traceback
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 import time
+import math
 import os
 from starlette.requests import Request
-from typing import Dict, Any, Optional
+from typing import Dict, Any, List, Optional, Tuple
 import logging
+import uuid
 from datetime import datetime
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from ocr_pool import OCRWorkerPool, PoolBusyError, RemoteOCRPool
+from ocr_engine import engine_options_from_env
+from model_registry import ModelUsageStats
+from batcher import MicroBatcher
+from admission import AdaptiveLimiter, DeadlineExceededError, PRIORITY_BULK, PRIORITY_INTERACTIVE, parse_deadline
+from ocr_cache import OCRCache
+from archives import Archive, TooManyImagesError, is_archive
+from documents import Document, UnsupportedDocumentError
+from urls import code_urls, find_urls
+from ocr_output import (MEDIA_TYPES, OUTPUTS, STREAM_MEDIA_TYPES, check_format, encode, encode_stream_item,
+                        filter_lines, shape_result)
+from preprocess import PreprocessOptions, decode_image, image_size, parse_rois, reduced_decode_factor
+from tiling import encode_tile, merge_tile_codes, merge_tile_lines, tile_grid
+from delta import Frame, FrameSessions, changed_regions, frame_thumbnail, merge_frame_lines, refresh_thumbnail, region_fraction
+from ingest import FileTooLargeError, content_length_exceeds, open_upload
+from jobs import JobQueue, JobQueueFullError
+from log_setup import logging_stats, record_stage, request_id, request_stages, setup_logging
+from metrics import MetricsRegistry
+from rate_limit import RateLimit, RateLimiter, parse_rate_limits
+from runtime_config import describe, engine_kwargs, load_runtime_config
 
-# Set up logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler("api_server.log"),
-        logging.StreamHandler()
-    ]
+# Set up logging: records go through a queue to a background thread, so
+# requests never wait on disk or console I/O
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO")  # Lowest level written
+LOG_FORMAT = os.environ.get("LOG_FORMAT", "json")  # "json" lines, or "text"
+LOG_FILE = os.environ.get("LOG_FILE", "api_server.log")  # "{pid}" is replaced by the process id, for multi-process setups; empty logs to stderr only
+LOG_MAX_MB = float(os.environ.get("LOG_MAX_MB", "50"))  # Size at which the log file is rotated
+LOG_BACKUPS = int(os.environ.get("LOG_BACKUPS", "5"))  # Rotated log files kept
+LOG_SAMPLE_RATE = float(os.environ.get("LOG_SAMPLE_RATE", "1.0"))  # Share of requests whose INFO lines are written
+LOG_MAX_PER_SECOND = float(os.environ.get("LOG_MAX_PER_SECOND", "200"))  # Most INFO lines written per second (0 for no cap)
+REQUEST_ID_HEADER = "X-Request-Id"  # Taken from the client when sent, otherwise generated; returned on every response
+setup_logging(
+    level=LOG_LEVEL,
+    fmt=LOG_FORMAT,
+    file=LOG_FILE or None,
+    max_bytes=int(LOG_MAX_MB * 1024 * 1024),
+    backups=LOG_BACKUPS,
+    sample_rate=LOG_SAMPLE_RATE,
+    max_per_second=LOG_MAX_PER_SECOND,
 )
 logger = logging.getLogger("paddleocr-api")
 
+PROCESS_START_TIME = time.time()
+
 # Configure API settings
-MAX_FILE_SIZE = 10 * 1024 * 1024  # 10 MB
-RATE_LIMIT_REQUESTS = 10  # Number of requests allowed
-RATE_LIMIT_WINDOW = 60  # Time window in seconds
+MAX_FILE_SIZE = int(float(os.environ.get("MAX_FILE_SIZE_MB", "10")) * 1024 * 1024)  # Largest image upload; tiling keeps large scans' memory bounded
+MAX_ARCHIVE_SIZE = 100 * 1024 * 1024  # 100 MB, for zip/tar uploads to /upload/batch
+MAX_ARCHIVE_IMAGES_SIZE = int(float(os.environ.get("MAX_ARCHIVE_IMAGES_MB", "500")) * 1024 * 1024)  # Largest total of the images in one zip/tar upload, uncompressed
+MAX_BATCH_FILES = 100  # Maximum images per /upload/batch request
+MAX_DOCUMENT_SIZE = 100 * 1024 * 1024  # 100 MB, for PDF/TIFF uploads to /upload/document
+MAX_DOCUMENT_PAGES = int(os.environ.get("MAX_DOCUMENT_PAGES", "500"))  # Maximum pages per /upload/document request
+RATE_LIMIT_REQUESTS = int(os.environ.get("RATE_LIMIT_REQUESTS", "10"))  # Number of requests allowed
+RATE_LIMIT_WINDOW = float(os.environ.get("RATE_LIMIT_WINDOW", "60"))  # Time window in seconds
+RATE_LIMIT_KEYS = os.environ.get("RATE_LIMIT_KEYS", "")  # Per-client limits, "ip:1.2.3.4=100/60,key:<api key>=1000/60"
+RATE_LIMIT_BACKEND = os.environ.get("RATE_LIMIT_BACKEND", "memory")  # "memory", or "sqlite" to share limits between processes
+RATE_LIMIT_DB = os.environ.get("RATE_LIMIT_DB", "rate_limit.sqlite3")  # sqlite file for the shared backend
+RATE_LIMIT_MAX_CLIENTS = int(os.environ.get("RATE_LIMIT_MAX_CLIENTS", "100000"))  # Clients tracked in memory before the oldest are forgotten
+
+# OCR worker pool settings
+OCR_WORKERS = int(os.environ.get("OCR_WORKERS", "2"))  # Number of OCR workers, each with its own PaddleOCR
+OCR_POOL_MODE = os.environ.get("OCR_POOL_MODE", "thread")  # "thread", "process", or "remote" to use an ocr_server.py
+OCR_SERVER_ADDRESS = os.environ.get("OCR_SERVER_ADDRESS", "ocr_server.sock")  # ocr_server.py address (host:port or socket path) in remote mode
+OCR_SERVER_AUTHKEY = os.environ.get("OCR_SERVER_AUTHKEY", "paddleocr")  # Shared secret for the ocr_server.py connection
+# Inference runtime: the OCR_RUNTIME_CONFIG JSON file, overridden by OCR_BACKEND, OCR_THREADS ("auto" splits
+# the CPUs between workers), OCR_MKLDNN, OCR_PRECISION, OCR_VERSION and OCR_*_MODEL_DIR (see runtime_config.py)
+OCR_RUNTIME = load_runtime_config(os.environ, OCR_WORKERS)
+OCR_THREADS = OCR_RUNTIME.threads  # Intra-op threads per OCR worker (0 keeps the library default)
+OCR_CPU_AFFINITY = os.environ.get("OCR_CPU_AFFINITY", "")  # "auto" or "0-7;8-15" to pin each OCR worker to its own CPUs
+OCR_QUEUE_SIZE = int(os.environ.get("OCR_QUEUE_SIZE", "16"))  # Requests allowed to wait for a free worker
+OCR_BATCH_WINDOW_MS = float(os.environ.get("OCR_BATCH_WINDOW_MS", "10"))  # How long to gather requests into one batch
+OCR_BATCH_MAX_SIZE = int(os.environ.get("OCR_BATCH_MAX_SIZE", "8"))  # Maximum images per batch (1 disables batching)
+
+# Adaptive concurrency limit and deadlines for OCR
+OCR_ADAPTIVE_LIMIT = os.environ.get("OCR_ADAPTIVE_LIMIT", "1") == "1"  # Adapt the limit on images in OCR to observed latency (0 keeps it fixed)
+OCR_LIMIT_INITIAL = int(os.environ.get("OCR_LIMIT_INITIAL", "0"))  # Starting limit (0: OCR_WORKERS x OCR_BATCH_MAX_SIZE)
+OCR_LIMIT_MIN = int(os.environ.get("OCR_LIMIT_MIN", "0"))  # Lowest limit (0: OCR_WORKERS)
+OCR_LIMIT_MAX = int(os.environ.get("OCR_LIMIT_MAX", "0"))  # Highest limit (0: OCR_WORKERS + OCR_QUEUE_SIZE, what the pool holds as single-image batches)
+OCR_LIMIT_QUEUE = int(os.environ.get("OCR_LIMIT_QUEUE", "64"))  # Images allowed to wait for the limit before returning 503
+OCR_LIMIT_TOLERANCE = float(os.environ.get("OCR_LIMIT_TOLERANCE", "2.0"))  # Latency over this multiple of the unloaded latency shrinks the limit
+OCR_DEFAULT_DEADLINE_MS = float(os.environ.get("OCR_DEFAULT_DEADLINE_MS", "0"))  # Deadline for requests without the deadline header (0 for none)
+DEADLINE_HEADER = "X-Request-Deadline-Ms"  # Remaining time budget a client gives its request, in milliseconds
+INTERACTIVE_PATHS = {"/upload/", "/upload/detect"}  # Served before bulk work (batches, documents, jobs) when OCR is at its limit
+
+# OCR result cache settings
+OCR_CACHE_SIZE = int(os.environ.get("OCR_CACHE_SIZE", "1024"))  # Maximum cached results in memory (0 disables caching)
+OCR_CACHE_MAX_MB = float(os.environ.get("OCR_CACHE_MAX_MB", "64"))  # Maximum memory used by cached results
+OCR_CACHE_TTL = float(os.environ.get("OCR_CACHE_TTL", "3600"))  # Seconds a cached result stays valid
+OCR_CACHE_DIR = os.environ.get("OCR_CACHE_DIR", "")  # Directory for the persistent sqlite tier (empty disables it)
+
+# OCR engine settings
+OCR_ENGINE = os.environ.get("OCR_ENGINE", "paddle")  # "paddle", or "fake" for load testing without models
+OCR_LANG = os.environ.get("OCR_LANG", "en")  # Default language, 可換 "ch" 以支援中文
+OCR_LANGS = os.environ.get("OCR_LANGS", "en,ch,japan").split(",")  # Languages clients may request with `lang`
+OCR_MODEL_MEMORY_MB = float(os.environ.get("OCR_MODEL_MEMORY_MB", "1024"))  # Per-worker memory budget for loaded language models
+OCR_USE_ANGLE_CLS = True
+OCR_WARMUP_ROUNDS = int(os.environ.get("OCR_WARMUP_ROUNDS", "1"))  # Synthetic OCR passes per worker before reporting ready
+
+# Image preprocessing defaults (can be overridden per request)
+OCR_MAX_SIDE = int(os.environ.get("OCR_MAX_SIDE", "2048"))  # Downscale so the long side is at most this many pixels (0 disables)
+OCR_GRAYSCALE = os.environ.get("OCR_GRAYSCALE", "0") == "1"  # Decode images as grayscale
+OCR_DOCUMENT_DPI = int(os.environ.get("OCR_DOCUMENT_DPI", "200"))  # Resolution PDF pages are rasterized at
+OCR_TILE = os.environ.get("OCR_TILE", "0") == "1"  # Read images larger than both OCR_TILE_SIZE and max_side as tiles by default; otherwise only with tile=true
+OCR_TILE_SIZE = int(os.environ.get("OCR_TILE_SIZE", "1280"))  # Tile side in pixels
+OCR_TILE_MAX_PIXELS = float(os.environ.get("OCR_TILE_MAX_PIXELS", "40")) * 1_000_000  # Largest decode for tiling (megapixels); bigger JPEGs decode at 1/2-1/8
+OCR_TILE_OVERLAP = int(os.environ.get("OCR_TILE_OVERLAP", "256"))  # Overlap between tiles; should exceed the tallest text line
+OCR_SESSION_MAX = int(os.environ.get("OCR_SESSION_MAX", "128"))  # Sessions whose last frame is kept for delta OCR (0 disables sessions)
+OCR_SESSION_TTL = float(os.environ.get("OCR_SESSION_TTL", "300"))  # Seconds of inactivity after which a session is forgotten
+OCR_DELTA_MAX_FRACTION = float(os.environ.get("OCR_DELTA_MAX_FRACTION", "0.5"))  # Frames changed over more than this share are OCR'd in full
+
+# Background job settings
+JOB_DB = os.environ.get("JOB_DB", "jobs.sqlite3")  # sqlite file holding queued jobs and their results
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", "4"))  # Jobs processed at once per API process
+JOB_MAX_QUEUED = int(os.environ.get("JOB_MAX_QUEUED", "1000"))  # Jobs allowed to wait before POST /jobs returns 503
+JOB_RESULT_TTL = float(os.environ.get("JOB_RESULT_TTL", "3600"))  # Seconds finished jobs are kept
+JOB_WAIT_MAX = float(os.environ.get("JOB_WAIT_MAX", "60"))  # Longest long-poll allowed on GET /jobs/{id}
+
+# Model loading progress: starting -> loading -> ready | failed
+startup_state: Dict[str, Any] = {"status": "starting", "first_request_time": None}
+
+async def load_ocr_engines():
+    """Load and warm up the OCR workers in the background"""
+    startup_state["status"] = "loading"
+    if OCR_POOL_MODE != "remote":
+        logger.info(f"OCR inference runtime: {describe(OCR_RUNTIME)}")
+    try:
+        startup_state.update(await asyncio.to_thread(ocr_pool.start))
+    except Exception as e:
+        logger.error(f"Error starting OCR pool: {str(e)}")
+    startup_state["status"] = "ready" if ocr_pool.ready else "failed"
+    startup_state["time_to_ready"] = time.time() - PROCESS_START_TIME
+    logger.info(f"Startup {startup_state['status']} {startup_state['time_to_ready']:.2f} seconds after process start")
 
-app = FastAPI(title="PaddleOCR API", version="1.0.0")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Start OCR workers here rather than at import time so that process
+    # workers (which re-import this module) do not start pools of their own.
+    # Loading runs in the background so liveness checks answer right away.
+    loader = asyncio.create_task(load_ocr_engines())
+    await job_queue.start()
+    yield
+    loader.cancel()
+    await job_queue.stop()
+    ocr_pool.shutdown()
+    rate_limiter.close()
+    if ocr_cache is not None:
+        ocr_cache.close()
+
+app = FastAPI(title="PaddleOCR API", version="1.0.0", lifespan=lifespan)
+
+# Prometheus metrics, served by /metrics
+metrics = MetricsRegistry()
+HTTP_REQUESTS = metrics.counter("http_requests_total", "HTTP requests by route and status code", ("path", "method", "status"))
+HTTP_DURATION = metrics.histogram("http_request_duration_seconds", "Total request latency by route", ("path",))
+HTTP_IN_FLIGHT = metrics.gauge("http_requests_in_flight", "HTTP requests being handled")
+OCR_STAGE_DURATION = metrics.histogram("ocr_stage_duration_seconds", "Time spent in each OCR pipeline stage", ("stage",))
+OCR_ERRORS = metrics.counter("ocr_errors_total", "Images that could not be processed", ("reason",))
+OCR_CACHE_LOOKUPS = metrics.counter("ocr_cache_lookups_total", "OCR cache lookups by result", ("result",))
+OCR_JOBS = metrics.counter("ocr_jobs_total", "Background jobs submitted and finished, by status", ("status",))
+metrics.gauge("ocr_pool_in_flight", "OCR jobs running on a worker", callback=lambda: ocr_pool.stats()["in_flight"])
+metrics.gauge("ocr_pool_queued", "OCR jobs waiting for a free worker", callback=lambda: ocr_pool.queued)
+metrics.gauge("ocr_batch_pending_images", "Images waiting for their batch to be flushed", callback=lambda: ocr_batcher.pending)
+metrics.gauge("ocr_concurrency_limit", "Images allowed in OCR at once, as adapted to latency", callback=lambda: ocr_limiter.limit)
+metrics.gauge("ocr_concurrency_queued", "Images waiting for the OCR concurrency limit", callback=lambda: ocr_limiter.queued)
+
+def observe_stage(stage: str, seconds: float):
+    """Record a stage timed in the API process, in the metrics and in the request's log line"""
+    OCR_STAGE_DURATION.observe(seconds, stage=stage)
+    record_stage(stage, seconds)
+
+def observe_stage_timings(timings: Dict[str, List[float]]):
+    """Record the stage timings an OCR worker reports with each batch"""
+    for stage, durations in timings.items():
+        for duration in durations:
+            OCR_STAGE_DURATION.observe(duration, stage=stage)
+
+# Largest request body accepted per upload endpoint, checked from Content-Length
+# before the multipart body is read
+UPLOAD_BODY_LIMITS = {
+    "/upload/": MAX_FILE_SIZE,
+    "/upload/batch": MAX_ARCHIVE_SIZE,
+    "/upload/document": MAX_DOCUMENT_SIZE,
+    "/upload/detect": MAX_FILE_SIZE,
+    "/upload/recognize": MAX_ARCHIVE_SIZE,
+    "/jobs": MAX_FILE_SIZE,
+}
+
+@app.middleware("http")
+async def reject_oversized_uploads(request: Request, call_next):
+    max_size = UPLOAD_BODY_LIMITS.get(request.url.path)
+    if max_size is not None and request.method == "POST" and content_length_exceeds(request.headers, max_size):
+        logger.warning(f"Request body too large: {request.headers['content-length']} bytes, from {request.client.host}")
+        return JSONResponse(
+            status_code=413,
+            content={"detail": f"File too large. Maximum size allowed is {max_size / (1024 * 1024):.1f} MB"}
+        )
+    return await call_next(request)
+
+# Deadline (time.monotonic()) and priority of the request being handled, read where its OCR is admitted
+request_deadline: ContextVar[Optional[float]] = ContextVar("request_deadline", default=None)
+request_priority: ContextVar[int] = ContextVar("request_priority", default=PRIORITY_BULK)
+
+@app.middleware("http")
+async def apply_request_deadline(request: Request, call_next):
+    try:
+        deadline = parse_deadline(request.headers.get(DEADLINE_HEADER), OCR_DEFAULT_DEADLINE_MS)
+    except ValueError as e:
+        return JSONResponse(status_code=400, content={"detail": f"{DEADLINE_HEADER}: {str(e)}"})
+    request_deadline.set(deadline)
+    request_priority.set(PRIORITY_INTERACTIVE if request.url.path in INTERACTIVE_PATHS else PRIORITY_BULK)
+    return await call_next(request)
+
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    # Registered after reject_oversized_uploads so its 413s are counted too
+    start = time.perf_counter()
+    HTTP_IN_FLIGHT.inc()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        HTTP_IN_FLIGHT.dec()
+        # Label by route template, not raw URL, to keep the number of series bounded
+        route = request.scope.get("route")
+        if route is not None:
+            path = route.path
+        else:
+            path = request.url.path if request.url.path in UPLOAD_BODY_LIMITS else "unmatched"
+        HTTP_REQUESTS.inc(path=path, method=request.method, status=str(status))
+        HTTP_DURATION.observe(time.perf_counter() - start, path=path)
+
+@app.middleware("http")
+async def log_requests(request: Request, call_next):
+    # Registered last so it runs outermost: every response, 413s included,
+    # carries a request id, and every log line written for it too
+    rid = (request.headers.get(REQUEST_ID_HEADER) or uuid.uuid4().hex[:16])[:64]
+    request_id.set(rid)
+    stages: Dict[str, float] = {}
+    request_stages.set(stages)
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        response.headers[REQUEST_ID_HEADER] = rid
+        return response
+    finally:
+        logger.info(f"{request.method} {request.url.path} {status}", extra={
+            "method": request.method,
+            "path": request.url.path,
+            "status": status,
+            "client": request.client.host if request.client else None,
+            "duration_ms": round((time.perf_counter() - start) * 1000, 1),
+            "stages_ms": {stage: round(seconds * 1000, 1) for stage, seconds in stages.items()},
+        })
 
 # Add CORS middleware to allow requests from the frontend
 app.add_middleware(
@@ -40,163 +284,939 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Simple in-memory rate limiter
-class RateLimiter:
-    def __init__(self, requests_limit: int, window_seconds: int):
-        self.requests_limit = requests_limit
-        self.window_seconds = window_seconds
-        self.clients: Dict[str, list] = {}
-
-    def is_rate_limited(self, client_id: str) -> bool:
-        current_time = time.time()
-        
-        # Initialize client's request history if not exists
-        if client_id not in self.clients:
-            self.clients[client_id] = []
-        
-        # Filter out old requests
-        self.clients[client_id] = [
-            timestamp for timestamp in self.clients[client_id]
-            if current_time - timestamp < self.window_seconds
-        ]
-        
-        # Check if rate limit exceeded
-        if len(self.clients[client_id]) >= self.requests_limit:
-            return True
-        
-        # Add current request timestamp
-        self.clients[client_id].append(current_time)
-        return False
-
 # Create rate limiter instance
-rate_limiter = RateLimiter(RATE_LIMIT_REQUESTS, RATE_LIMIT_WINDOW)
+rate_limiter = RateLimiter(
+    RateLimit(RATE_LIMIT_REQUESTS, RATE_LIMIT_WINDOW),
+    overrides=parse_rate_limits(RATE_LIMIT_KEYS),
+    backend=RATE_LIMIT_BACKEND,
+    db_path=RATE_LIMIT_DB,
+    max_clients=RATE_LIMIT_MAX_CLIENTS,
+)
+
+def rate_limit_key(request: Request) -> str:
+    """Clients are limited per API key when they send a configured one, otherwise per IP"""
+    api_key = request.headers.get("x-api-key")
+    if api_key and f"key:{api_key}" in rate_limiter.overrides:
+        return f"key:{api_key}"
+    return f"ip:{request.client.host}"
 
 # Rate limiter dependency
 async def check_rate_limit(request: Request):
-    client_id = request.client.host
-    if rate_limiter.is_rate_limited(client_id):
+    client_id = rate_limit_key(request)
+    retry_after = await rate_limiter.check_async(client_id)
+    if retry_after > 0:
+        limit = rate_limiter.limit_for(client_id)
         logger.warning(f"Rate limit exceeded for client {client_id}")
         raise HTTPException(
             status_code=429,
-            detail=f"Rate limit exceeded. Maximum {RATE_LIMIT_REQUESTS} requests per {RATE_LIMIT_WINDOW} seconds allowed."
+            detail=f"Rate limit exceeded. Maximum {limit.requests} requests per {limit.window:g} seconds allowed.",
+            headers={"Retry-After": str(math.ceil(retry_after))}
         )
 
-# 初始化 PaddleOCR 讀取器
-try:
-    ocr = PaddleOCR(use_angle_cls=True, lang="en")  # 可換 "ch" 以支援中文
-    logger.info("PaddleOCR initialized successfully!")
-except Exception as e:
-    logger.error(f"Error initializing PaddleOCR: {str(e)}")
-    logger.error(traceback.format_exc())
-    ocr = None
+# Readiness dependency
+async def require_ready():
+    if ocr_pool.ready:
+        return
+    if startup_state["status"] == "failed":
+        raise HTTPException(status_code=500, detail="PaddleOCR not initialized properly")
+    raise HTTPException(
+        status_code=503,
+        detail="OCR engine is still starting. Please retry later.",
+        headers={"Retry-After": "5"}
+    )
+
+# 初始化 OCR 工作池 (每個 worker 各自載入一個 OCR engine)
+engine_options = {"lang": OCR_LANG, "use_angle_cls": OCR_USE_ANGLE_CLS}
+if OCR_ENGINE == "fake":
+    engine_options.update(engine_options_from_env(os.environ))
+else:
+    engine_options.update(engine_kwargs(OCR_RUNTIME))
+if OCR_POOL_MODE == "remote":
+    # Models live in a separate ocr_server.py shared by all API processes
+    ocr_pool = RemoteOCRPool(OCR_SERVER_ADDRESS, OCR_SERVER_AUTHKEY)
+else:
+    ocr_pool = OCRWorkerPool(
+        workers=OCR_WORKERS,
+        mode=OCR_POOL_MODE,
+        max_queue=OCR_QUEUE_SIZE,
+        engine=OCR_ENGINE,
+        engine_options=engine_options,
+        warmup_rounds=OCR_WARMUP_ROUNDS,
+        memory_budget_mb=OCR_MODEL_MEMORY_MB,
+        threads=OCR_THREADS,
+        cpu_affinity=OCR_CPU_AFFINITY,
+    )
+model_stats = ModelUsageStats()
+ocr_batcher = MicroBatcher(
+    ocr_pool,
+    window_ms=OCR_BATCH_WINDOW_MS,
+    max_batch=OCR_BATCH_MAX_SIZE,
+    on_model_event=model_stats.record,
+    on_timings=observe_stage_timings,
+)
+ocr_limiter = AdaptiveLimiter(
+    initial=OCR_LIMIT_INITIAL or OCR_WORKERS * OCR_BATCH_MAX_SIZE,
+    min_limit=OCR_LIMIT_MIN or OCR_WORKERS,
+    max_limit=OCR_LIMIT_MAX or OCR_WORKERS + OCR_QUEUE_SIZE,
+    max_queue=OCR_LIMIT_QUEUE,
+    adaptive=OCR_ADAPTIVE_LIMIT,
+    tolerance=OCR_LIMIT_TOLERANCE,
+)
+ocr_cache = OCRCache(
+    max_entries=OCR_CACHE_SIZE,
+    max_bytes=int(OCR_CACHE_MAX_MB * 1024 * 1024),
+    ttl_seconds=OCR_CACHE_TTL,
+    disk_dir=OCR_CACHE_DIR or None,
+) if OCR_CACHE_SIZE > 0 else None
+frame_sessions = FrameSessions(OCR_SESSION_MAX, OCR_SESSION_TTL) if OCR_SESSION_MAX > 0 else None
 
-# URL 正則表達式
-URL_REGEX = r"https?://[a-zA-Z0-9./?=_-]+"
+def resolve_model(lang: Optional[str], use_angle_cls: Optional[bool]) -> Tuple[str, bool]:
+    """Per-request language and angle classification, defaulting to the server settings"""
+    lang = lang or OCR_LANG
+    if lang not in OCR_LANGS and lang != OCR_LANG:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unsupported language '{lang}'. Supported: {', '.join(sorted(set(OCR_LANGS) | {OCR_LANG}))}"
+        )
+    return lang, OCR_USE_ANGLE_CLS if use_angle_cls is None else use_angle_cls
 
-def extract_text(image_bytes):
-    """使用 PaddleOCR 辨識文字"""
+def build_preprocess_options(max_side: Optional[int], grayscale: Optional[bool], roi: Optional[str],
+                             mode: str = "text", tile: Optional[bool] = None) -> PreprocessOptions:
+    """Combine per-request preprocessing parameters with the server defaults"""
+    if mode not in ("text", "urls"):
+        raise HTTPException(status_code=400, detail=f"Unsupported mode '{mode}'. Supported: text, urls")
     try:
-        if ocr is None:
-            raise Exception("PaddleOCR not initialized properly")
-            
-        image = np.array(cv2.imdecode(np.frombuffer(image_bytes, np.uint8), cv2.IMREAD_COLOR))
-        result = ocr.ocr(image, cls=True)
+        rois = parse_rois(roi)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return PreprocessOptions(
+        max_side=OCR_MAX_SIDE if max_side is None else max(0, max_side),
+        grayscale=OCR_GRAYSCALE if grayscale is None else grayscale,
+        rois=rois,
+        urls_only=mode == "urls",
+        tile=OCR_TILE if tile is None else tile,
+    )
 
-        texts = []
-        for line in result:
-            if line:
-                for word_info in line:
-                    texts.append(word_info[1][0])  # 取得辨識文字
+def check_session(session: str, options: PreprocessOptions):
+    """Validate a delta OCR session key against the other request parameters"""
+    if not 0 < len(session) <= 128:
+        raise HTTPException(status_code=400, detail="session must be 1 to 128 characters")
+    if options.rois or options.urls_only:
+        raise HTTPException(status_code=400, detail="session cannot be combined with roi or mode=urls")
 
-        return " ".join(texts)
+def check_output_options(output: str, min_confidence: float, format: str):
+    """Validate the per-request output shape, confidence filter and response format"""
+    if output not in OUTPUTS:
+        raise HTTPException(status_code=400, detail=f"Unsupported output '{output}'. Supported: {', '.join(OUTPUTS)}")
+    if not 0 <= min_confidence <= 1:
+        raise HTTPException(status_code=400, detail="min_confidence must be between 0 and 1")
+    try:
+        check_format(format)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+def render_result(payload: Dict[str, Any], format: str):
+    """JSON responses go through FastAPI as usual; msgpack is encoded here"""
+    if format == "json":
+        return payload
+    return Response(content=encode(payload, format), media_type=MEDIA_TYPES[format])
+
+async def run_ocr(image_bytes, options: PreprocessOptions, lang: str, use_angle_cls: bool):
+    """Send one image to the micro-batcher once the concurrency limit lets it in
+
+    Waiting work is dropped when the request's deadline passes, before any
+    inference is spent on it.
+    """
+    start = time.perf_counter()
+    async with ocr_limiter.slot(request_priority.get(), request_deadline.get()):
+        admitted = time.perf_counter()
+        record_stage("admission_wait", admitted - start)
+        try:
+            return await ocr_batcher.submit(image_bytes, use_angle_cls, options, lang)
+        finally:
+            record_stage("ocr", time.perf_counter() - admitted)
+
+async def cached_ocr(image_bytes, options: PreprocessOptions, lang: str, use_angle_cls: bool,
+                     ocr=run_ocr) -> Tuple[Dict[str, Any], str]:
+    """``ocr`` through the result cache; returns ``(result, cache_status)``"""
+    if ocr_cache is None:
+        return await ocr(image_bytes, options, lang, use_angle_cls), "miss"
+    # `lines` keeps results cached before they carried boxes from being served
+    key = OCRCache.make_key(image_bytes, engine=OCR_ENGINE, lang=lang, cls=use_angle_cls, preprocess=options, lines=True)
+    result, cache_status = await ocr_cache.get_or_compute(key, lambda: ocr(image_bytes, options, lang, use_angle_cls))
+    OCR_CACHE_LOOKUPS.inc(result=cache_status)
+    return result, cache_status
+
+def needs_tiling(image_bytes, options: PreprocessOptions) -> bool:
+    """Whether an upload is read as tiles rather than downscaled to ``max_side``.
+
+    Decided on the original dimensions, from the header (JPEG, PNG and BMP;
+    others are never tiled): the long side must exceed both OCR_TILE_SIZE
+    and ``max_side``, and the image must decode within OCR_TILE_MAX_PIXELS,
+    at reduced size for JPEGs.
+    """
+    if not options.tile or options.rois:
+        return False
+    size = image_size(image_bytes)
+    if size is None:
+        return False
+    long_side = max(size)
+    if long_side <= OCR_TILE_SIZE or (options.max_side > 0 and long_side <= options.max_side):
+        return False
+    return reduced_decode_factor(image_bytes, OCR_TILE_MAX_PIXELS) is not None
+
+async def run_tiled_ocr(image_bytes, options: PreprocessOptions, lang: str, use_angle_cls: bool) -> Dict[str, Any]:
+    """OCR a large image as overlapping tiles spread over the workers, merged back into one result
+
+    The image is decoded once here, at full resolution or at the JPEG
+    reduction that fits OCR_TILE_MAX_PIXELS, so the decode is bounded
+    whatever the upload's pixel count; detection then runs on tile-sized
+    inputs. Only a few encoded tiles exist at a time.
+    """
+    factor = reduced_decode_factor(image_bytes, OCR_TILE_MAX_PIXELS)
+    decode_options = PreprocessOptions(max_side=-(-max(image_size(image_bytes)) // factor) if factor > 1 else 0,
+                                       grayscale=options.grayscale)
+    decoded, transforms, origins = await asyncio.to_thread(decode_image, image_bytes, decode_options)
+    image, (_, _, scale) = decoded[0], origins[0]
+    height, width = image.shape[:2]
+    tiles = tile_grid(width, height, OCR_TILE_SIZE, OCR_TILE_OVERLAP)
+    # The image is already decoded at its final size and has three channels
+    tile_options = PreprocessOptions(urls_only=options.urls_only)
+    semaphore = asyncio.Semaphore(ocr_pool.workers * 2)
+
+    async def run_tile(tile):
+        async with semaphore:
+            tile_bytes = await asyncio.to_thread(encode_tile, image, tile)
+            return await run_ocr(tile_bytes, tile_options, lang, use_angle_cls)
+
+    tile_results = await asyncio.gather(*(run_tile(tile) for tile in tiles))
+    lines = merge_tile_lines(tiles, [result["lines"] for result in tile_results], width, height, scale)
+    merged = {"text": " ".join(line[1] for line in lines), "lines": lines, "transforms": transforms + [f"tiles:{len(tiles)}"]}
+    if options.urls_only:
+        merged["codes"] = merge_tile_codes(tiles, [result.get("codes", []) for result in tile_results], scale)
+    return merged
+
+async def run_delta_ocr(image_bytes, options: PreprocessOptions, lang: str, use_angle_cls: bool,
+                        session: str) -> Tuple[Dict[str, Any], str]:
+    """OCR only the parts of a frame that changed since the session's previous one
+
+    Lines outside the changed regions are taken from the previous result.
+    The result carries ``reprocessed``, the share of the image that went
+    through OCR again: 1.0 for a first frame, one of another size or one
+    changed over more than OCR_DELTA_MAX_FRACTION, 0.0 for an unchanged one.
+    """
+    config = (lang, use_angle_cls, options)
+    async with frame_sessions.serialized(session):
+        thumbnail, scale = await asyncio.to_thread(frame_thumbnail, image_bytes)
+        previous = frame_sessions.get(session, config)
+        regions = None
+        if previous is not None:
+            regions = await asyncio.to_thread(changed_regions, previous, thumbnail, previous.result["lines"])
+        reprocessed = 1.0 if regions is None else region_fraction(regions, thumbnail, scale)
+        if regions is None or reprocessed > OCR_DELTA_MAX_FRACTION:
+            ocr = run_tiled_ocr if needs_tiling(image_bytes, options) else run_ocr
+            result = await ocr(image_bytes, options, lang, use_angle_cls)
+            frame_sessions.put(session, Frame(config, thumbnail, scale, result), "full")
+            return {**result, "reprocessed": 1.0}, "miss"
+        if not regions:
+            frame_sessions.put(session, previous, "unchanged")
+            return {**previous.result, "transforms": ["delta:0"], "reprocessed": 0.0}, "delta"
+        partial = await run_ocr(image_bytes, options._replace(rois=tuple(regions)), lang, use_angle_cls)
+        lines = merge_frame_lines(previous.result["lines"], partial["lines"], regions)
+        result = {"text": " ".join(line[1] for line in lines), "lines": lines,
+                  "transforms": partial["transforms"] + [f"delta:{len(regions)}"]}
+        frame_sessions.put(session, Frame(config, refresh_thumbnail(previous, thumbnail, regions), scale, result), "partial")
+    return {**result, "reprocessed": round(reprocessed, 4)}, "delta"
+
+async def extract_text(image_bytes, options: PreprocessOptions = PreprocessOptions(),
+                       lang: str = OCR_LANG, use_angle_cls: bool = OCR_USE_ANGLE_CLS, session: Optional[str] = None):
+    """使用 PaddleOCR 辨識文字 (在工作池中執行，不阻塞 event loop)
+
+    Returns ``(result, cache_status)`` where result holds the text, the
+    recognized lines and the applied transforms; cache_status is "memory", "disk" or "shared" when
+    the result came from the cache, "delta" when it was updated from the
+    ``session``'s previous frame, otherwise "miss". Session frames skip the cache.
+    When OCR fails, the text reads "Error: ..." and ``error`` holds the reason.
+    """
+    ocr = run_tiled_ocr if needs_tiling(image_bytes, options) else run_ocr
+    try:
+        if session is not None and frame_sessions is not None:
+            return await run_delta_ocr(image_bytes, options, lang, use_angle_cls, session)
+        return await cached_ocr(image_bytes, options, lang, use_angle_cls, ocr)
+    except DeadlineExceededError:
+        OCR_ERRORS.inc(reason="deadline")
+        raise
+    except PoolBusyError:
+        OCR_ERRORS.inc(reason="busy")
+        raise
     except Exception as e:
-        logger.error(f"Error in OCR processing: {str(e)}")
-        logger.error(traceback.format_exc())
-        return f"Error: {str(e)}"
+        OCR_ERRORS.inc(reason="ocr")
+        logger.exception(f"Error in OCR processing: {str(e)}")
+        return {"text": f"Error: {str(e)}", "lines": [], "transforms": [], "error": str(e)}, "miss"
+
+def extract_urls(text: str, lines, codes=None) -> List[str]:
+    """從 OCR 輸出的文字中提取網址, plus those held by QR codes and barcodes
 
-def extract_urls(text):
-    """從 OCR 輸出的文字中提取網址"""
-    return re.findall(URL_REGEX, text)
+    Working line by line lets URLs broken across two lines be rejoined.
+    """
+    urls = find_urls([line[1] for line in lines] if lines else [text])
+    return [url for url in code_urls(codes or []) if url not in urls] + urls
 
-@app.post("/upload/")
+async def process_image(image_bytes, client_ip: str, options: PreprocessOptions = PreprocessOptions(),
+                        lang: str = OCR_LANG, use_angle_cls: bool = OCR_USE_ANGLE_CLS,
+                        min_confidence: float = 0.0, session: Optional[str] = None) -> Dict[str, Any]:
+    """Run OCR and URL extraction on one image
+
+    Lines recognized with less than ``min_confidence`` are left out of the
+    text and of the ``lines`` returned alongside it. ``error`` is set when
+    OCR failed.
+    """
+    ocr_result, cache_status = await extract_text(image_bytes, options, lang, use_angle_cls, session)
+    lines = ocr_result["lines"]
+    text = ocr_result["text"]
+    if min_confidence > 0 and lines:
+        lines = filter_lines(lines, min_confidence)
+        text = " ".join(line[1] for line in lines)
+    
+    # Extract URLs if any
+    start = time.perf_counter()
+    urls = extract_urls(text, lines, ocr_result.get("codes"))
+    observe_stage("url_extraction", time.perf_counter() - start)
+    logger.info(f"OCR Text length: {len(text)}, found {len(urls)} URLs, cache: {cache_status}, from {client_ip}")
+    
+    if startup_state["first_request_time"] is None:
+        startup_state["first_request_time"] = time.time() - PROCESS_START_TIME
+        logger.info(f"First request served {startup_state['first_request_time']:.2f} seconds after process start")
+    
+    result = {"text": text, "urls": urls, "cache": cache_status, "transforms": ocr_result["transforms"], "lines": lines}
+    for key in ("codes", "reprocessed", "error"):
+        if key in ocr_result:
+            result[key] = ocr_result[key]
+    return result
+
+@app.post("/upload/", dependencies=[Depends(require_ready)])
 async def upload_image(
     request: Request,
     file: UploadFile = File(...),
+    max_side: Optional[int] = None,
+    grayscale: Optional[bool] = None,
+    roi: Optional[str] = None,
+    lang: Optional[str] = None,
+    use_angle_cls: Optional[bool] = None,
+    mode: str = "text",
+    tile: Optional[bool] = None,
+    session: Optional[str] = None,
+    output: str = "text",
+    min_confidence: float = 0.0,
+    format: str = "json",
     rate_limit: Any = Depends(check_rate_limit)
 ):
-    """API 端點，接收圖片並回傳識別出的文字"""
+    """API 端點，接收圖片並回傳識別出的文字
+
+    Optional query parameters: ``max_side`` (downscale target, 0 keeps full
+    resolution), ``grayscale``, ``roi`` ("x,y,w,h;..." regions to read),
+    ``lang`` (one of OCR_LANGS) and ``use_angle_cls``. ``output=structured``
+    adds the recognized ``lines`` with their boxes and confidences,
+    ``min_confidence`` drops lines below it and ``format=msgpack`` returns
+    the response as msgpack with the boxes packed into bytes.
+    ``mode=urls`` is a fast path for clients that only want ``urls``: QR
+    codes and barcodes are read first (returned as ``codes``), and text is
+    recognized only when none holds a URL, and then only in URL-shaped boxes.
+    With ``tile=true``, images larger than both OCR_TILE_SIZE and ``max_side``
+    are read as overlapping tiles spread over the workers instead of being
+    downscaled. Uploads sharing a ``session``
+    key are compared with the session's previous frame and only the regions
+    that changed are read again; ``reprocessed`` gives their share of the image.
+    """
     start_time = time.time()
     client_ip = request.client.host
+    options = build_preprocess_options(max_side, grayscale, roi, mode, tile)
+    if session is not None:
+        check_session(session, options)
+    lang, use_angle_cls = resolve_model(lang, use_angle_cls)
+    check_output_options(output, min_confidence, format)
     
-    logger.info(f"Received request from {client_ip}, file: {file.filename}")
+    logger.debug(f"Received request from {client_ip}, file: {file.filename}")
     
     try:
-        # Check file size
-        file_size = 0
-        contents = BytesIO()
-        
-        # Read file in chunks to check size
-        chunk_size = 1024 * 1024  # 1MB chunks
-        chunk = await file.read(chunk_size)
-        while chunk:
-            file_size += len(chunk)
-            contents.write(chunk)
-            
-            # Check if file is too large
-            if file_size > MAX_FILE_SIZE:
-                logger.warning(f"File too large: {file_size} bytes, from {client_ip}")
-                raise HTTPException(
-                    status_code=413,
-                    detail=f"File too large. Maximum size allowed is {MAX_FILE_SIZE / (1024 * 1024):.1f} MB"
-                )
+        # The upload is used in place (shared spool buffer or mmap), not copied
+        read_start = time.perf_counter()
+        with open_upload(file, MAX_FILE_SIZE) as image_bytes:
+            observe_stage("upload_read", time.perf_counter() - read_start)
+            file_size = len(image_bytes)
             
-            chunk = await file.read(chunk_size)
-        
-        # Reset BytesIO position to start
-        contents.seek(0)
-        image_bytes = contents.read()
-        
-        # Process image
-        text = extract_text(image_bytes)
-        logger.info(f"OCR Text length: {len(text)}, from {client_ip}")
-        
-        # Extract URLs if any
-        urls = extract_urls(text)
-        logger.info(f"Found {len(urls)} URLs, from {client_ip}")
+            # Process image
+            result = await process_image(image_bytes, client_ip, options, lang, use_angle_cls, min_confidence, session)
         
         # Calculate processing time
         process_time = time.time() - start_time
-        logger.info(f"Request processed in {process_time:.2f} seconds, from {client_ip}")
+        logger.debug(f"Request processed in {process_time:.2f} seconds, from {client_ip}")
         
-        return {
-            "text": text, 
-            "urls": urls,
+        return render_result(shape_result({
+            "text": result["text"], 
+            "urls": result["urls"],
             "file_size": file_size,
-            "process_time": process_time
-        }
+            "process_time": process_time,
+            "cache": result["cache"],
+            "transforms": result["transforms"],
+            "lang": lang,
+            "lines": result["lines"],
+            **{key: result[key] for key in ("codes", "reprocessed") if key in result}
+        }, output, format), format)
         
     except HTTPException as e:
         # Re-raise HTTP exceptions
         raise
+    except FileTooLargeError as e:
+        logger.warning(f"File too large: {e.file_size} bytes, from {client_ip}")
+        raise HTTPException(status_code=413, detail=str(e))
+    except DeadlineExceededError as e:
+        logger.warning(f"{str(e)}, rejecting request from {client_ip}")
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+    except PoolBusyError as e:
+        logger.warning(f"OCR queue full, rejecting request from {client_ip}")
+        raise HTTPException(
+            status_code=503,
+            detail="Server is busy. Please retry later.",
+            headers={"Retry-After": str(e.retry_after)}
+        )
     except Exception as e:
-        error_detail = traceback.format_exc()
-        logger.error(f"Error in upload: {str(e)}, from {client_ip}")
-        logger.error(error_detail)
+        logger.exception(f"Error in upload: {str(e)}, from {client_ip}")
         raise HTTPException(status_code=500, detail=f"Error processing image: {str(e)}")
 
+async def _collect_batch_items(files: List[UploadFile], client_ip: str, stack: ExitStack) -> List[Dict[str, Any]]:
+    """Open uploaded files, listing the images inside zip/tar archives
+
+    Plain images are used in place; their buffers stay valid until ``stack``
+    is closed. Archives are opened off the event loop and their images are
+    only decompressed when ``load_item`` is called for them.
+    """
+    items = []
+
+    def add(filename, image_bytes=None, error=None, read=None):
+        if len(items) >= MAX_BATCH_FILES:
+            raise HTTPException(status_code=413, detail=f"Too many images. Maximum {MAX_BATCH_FILES} images per batch allowed.")
+        if error:
+            OCR_ERRORS.inc(reason="invalid_upload")
+        items.append({"index": len(items), "filename": filename, "image_bytes": image_bytes, "error": error, "read": read})
+
+    for file in files:
+        read_start = time.perf_counter()
+        if is_archive(file.filename):
+            try:
+                file.file.seek(0, os.SEEK_END)
+                archive_size = file.file.tell()
+                if archive_size > MAX_ARCHIVE_SIZE:
+                    raise FileTooLargeError(archive_size, MAX_ARCHIVE_SIZE)
+                archive = await asyncio.to_thread(
+                    Archive, file.file, MAX_FILE_SIZE, MAX_BATCH_FILES - len(items), MAX_ARCHIVE_IMAGES_SIZE
+                )
+                stack.callback(archive.close)
+                for member in archive.members:
+                    add(member.name, error=member.error, read=partial(archive.read, member))
+            except FileTooLargeError as e:
+                logger.warning(f"Archive too large: {e.file_size} bytes, from {client_ip}")
+                raise HTTPException(
+                    status_code=413,
+                    detail=f"Archive too large. Maximum size allowed is {MAX_ARCHIVE_SIZE / (1024 * 1024):.1f} MB"
+                )
+            except TooManyImagesError:
+                raise HTTPException(status_code=413, detail=f"Too many images. Maximum {MAX_BATCH_FILES} images per batch allowed.")
+            except (ValueError, zipfile.BadZipFile, tarfile.TarError) as e:
+                add(file.filename, error=f"Invalid archive: {str(e)}")
+        else:
+            try:
+                add(file.filename, stack.enter_context(open_upload(file, MAX_FILE_SIZE)))
+            except FileTooLargeError as e:
+                add(file.filename, error=str(e))
+        observe_stage("upload_read", time.perf_counter() - read_start)
+    return items
+
+async def load_item(item: Dict[str, Any]):
+    """The image of a batch item, decompressing it from its archive on a worker thread"""
+    image_bytes = item.pop("image_bytes")
+    read = item.pop("read")
+    if image_bytes is None:
+        read_start = time.perf_counter()
+        image_bytes = await asyncio.to_thread(read)
+        observe_stage("upload_read", time.perf_counter() - read_start)
+    return image_bytes
+
+@app.post("/upload/batch", dependencies=[Depends(require_ready)])
+async def upload_batch(
+    request: Request,
+    files: List[UploadFile] = File(...),
+    stream: bool = False,
+    max_side: Optional[int] = None,
+    grayscale: Optional[bool] = None,
+    lang: Optional[str] = None,
+    use_angle_cls: Optional[bool] = None,
+    mode: str = "text",
+    tile: Optional[bool] = None,
+    output: str = "text",
+    min_confidence: float = 0.0,
+    format: str = "json",
+    rate_limit: Any = Depends(check_rate_limit)
+):
+    """Batch endpoint: OCR many images (or zip/tar archives of images) in one request
+
+    With ``stream=true`` the results are returned as NDJSON, one line per
+    image in completion order; otherwise a single JSON document with the
+    results in upload order is returned. ``mode``, ``output``,
+    ``min_confidence`` and ``format`` work as for ``/upload/``; streamed msgpack is a sequence of
+    msgpack objects.
+    """
+    start_time = time.time()
+    client_ip = request.client.host
+    options = build_preprocess_options(max_side, grayscale, None, mode, tile)
+    lang, use_angle_cls = resolve_model(lang, use_angle_cls)
+    check_output_options(output, min_confidence, format)
+    
+    stack = ExitStack()
+    try:
+        items = await _collect_batch_items(files, client_ip, stack)
+    except BaseException:
+        stack.close()
+        raise
+    logger.info(f"Received batch of {len(items)} images from {client_ip}")
+    
+    # Bound how many images of this request wait on the OCR pool at once
+    semaphore = asyncio.Semaphore(max(1, ocr_pool.workers * OCR_BATCH_MAX_SIZE))
+
+    async def run_item(item):
+        item_start = time.time()
+        result = {"index": item["index"], "filename": item["filename"]}
+        if item["error"]:
+            result["error"] = item["error"]
+            return result
+        try:
+            async with semaphore:
+                image_bytes = await load_item(item)
+                result["file_size"] = len(image_bytes)
+                processed = await process_image(image_bytes, client_ip, options, lang, use_angle_cls, min_confidence)
+            if "error" in processed:
+                result["error"] = f"Error processing image: {processed['error']}"
+            else:
+                result.update(processed)
+        except PoolBusyError:
+            result["error"] = "Server is busy. Please retry later."
+        except Exception as e:
+            logger.error(f"Error in batch item {item['filename']}: {str(e)}, from {client_ip}")
+            result["error"] = f"Error processing image: {str(e)}"
+        result["process_time"] = time.time() - item_start
+        return shape_result(result, output, format)
+
+    if stream:
+        async def ndjson():
+            tasks = [asyncio.ensure_future(run_item(item)) for item in items]
+            try:
+                for next_done in asyncio.as_completed(tasks):
+                    yield encode_stream_item(await next_done, format)
+            finally:
+                # Client disconnected or finished, drop any remaining work
+                for task in tasks:
+                    task.cancel()
+                stack.close()
+        return StreamingResponse(ndjson(), media_type=STREAM_MEDIA_TYPES[format])
+
+    with stack:
+        results = await asyncio.gather(*(run_item(item) for item in items))
+    process_time = time.time() - start_time
+    logger.info(f"Batch of {len(results)} images processed in {process_time:.2f} seconds, from {client_ip}")
+    return render_result({
+        "results": results,
+        "count": len(results),
+        "errors": sum(1 for r in results if "error" in r),
+        "process_time": process_time
+    }, format)
+
+@app.post("/upload/document", dependencies=[Depends(require_ready)])
+async def upload_document(
+    request: Request,
+    file: UploadFile = File(...),
+    dpi: Optional[int] = None,
+    max_side: Optional[int] = None,
+    grayscale: Optional[bool] = None,
+    lang: Optional[str] = None,
+    use_angle_cls: Optional[bool] = None,
+    mode: str = "text",
+    tile: Optional[bool] = None,
+    output: str = "text",
+    min_confidence: float = 0.0,
+    format: str = "json",
+    rate_limit: Any = Depends(check_rate_limit)
+):
+    """OCR every page of a multi-page PDF or TIFF, streamed back as NDJSON
+
+    Pages are rasterized one at a time at ``dpi`` (default OCR_DOCUMENT_DPI)
+    and OCR'd in parallel across the worker pool, with a bounded number in
+    flight so memory stays flat however long the document is. One line is
+    written per page, in page order, followed by a summary line with
+    ``"done": true``. The page count is also sent in ``X-Page-Count``.
+    ``mode``, ``output``, ``min_confidence`` and ``format`` work as for
+    ``/upload/``.
+    """
+    start_time = time.time()
+    client_ip = request.client.host
+    dpi = OCR_DOCUMENT_DPI if dpi is None else dpi
+    if not 50 <= dpi <= 600:
+        raise HTTPException(status_code=400, detail="dpi must be between 50 and 600")
+    options = build_preprocess_options(max_side, grayscale, None, mode, tile)
+    lang, use_angle_cls = resolve_model(lang, use_angle_cls)
+    check_output_options(output, min_confidence, format)
+
+    file.file.seek(0, os.SEEK_END)
+    document_size = file.file.tell()
+    if document_size > MAX_DOCUMENT_SIZE:
+        logger.warning(f"Document too large: {document_size} bytes, from {client_ip}")
+        raise HTTPException(
+            status_code=413,
+            detail=f"Document too large. Maximum size allowed is {MAX_DOCUMENT_SIZE / (1024 * 1024):.1f} MB"
+        )
+    try:
+        document = await asyncio.to_thread(Document, file.file, dpi, options.grayscale)
+    except UnsupportedDocumentError as e:
+        OCR_ERRORS.inc(reason="invalid_upload")
+        raise HTTPException(status_code=415, detail=str(e))
+    if document.page_count > MAX_DOCUMENT_PAGES:
+        document.close()
+        raise HTTPException(status_code=413, detail=f"Too many pages. Maximum {MAX_DOCUMENT_PAGES} pages per document allowed.")
+    logger.info(f"Received {document.kind} document of {document.page_count} pages from {client_ip}, file: {file.filename}")
+
+    async def run_page(number, page_bytes):
+        page_start = time.time()
+        result = {"page": number}
+        try:
+            processed = await process_image(page_bytes, client_ip, options, lang, use_angle_cls, min_confidence)
+            if "error" in processed:
+                result["error"] = f"Error processing page: {processed['error']}"
+            else:
+                result.update(processed)
+        except PoolBusyError:
+            result["error"] = "Server is busy. Please retry later."
+        except Exception as e:
+            logger.error(f"Error in page {number} of {file.filename}: {str(e)}, from {client_ip}")
+            result["error"] = f"Error processing page: {str(e)}"
+        result["process_time"] = time.time() - page_start
+        return shape_result(result, output, format)
+
+    async def ndjson():
+        # Pages being OCR'd, oldest first; a page is rasterized only once
+        # there is room, so at most `window` pages are held at a time
+        window = max(1, ocr_pool.workers * OCR_BATCH_MAX_SIZE)
+        pending = deque()
+        errors = 0
+        try:
+            for index in range(document.page_count):
+                render_start = time.perf_counter()
+                try:
+                    page_bytes = await asyncio.to_thread(document.render, index)
+                    observe_stage("rasterize", time.perf_counter() - render_start)
+                    pending.append(asyncio.ensure_future(run_page(index + 1, page_bytes)))
+                except Exception as e:
+                    OCR_ERRORS.inc(reason="invalid_upload")
+                    failed = asyncio.get_running_loop().create_future()
+                    failed.set_result({"page": index + 1, "error": f"Could not render page: {str(e)}"})
+                    pending.append(failed)
+                while len(pending) >= window or (pending and pending[0].done()):
+                    result = await pending.popleft()
+                    errors += "error" in result
+                    yield encode_stream_item(result, format)
+            while pending:
+                result = await pending.popleft()
+                errors += "error" in result
+                yield encode_stream_item(result, format)
+            process_time = time.time() - start_time
+            logger.info(f"Document of {document.page_count} pages processed in {process_time:.2f} seconds, from {client_ip}")
+            yield encode_stream_item({"done": True, "pages": document.page_count, "errors": errors,
+                                      "process_time": process_time, "dpi": dpi, "lang": lang}, format)
+        finally:
+            # Client disconnected or finished, drop any remaining work
+            for task in pending:
+                task.cancel()
+            await asyncio.to_thread(document.close)
+
+    return StreamingResponse(ndjson(), media_type=STREAM_MEDIA_TYPES[format],
+                             headers={"X-Page-Count": str(document.page_count)})
+
+@app.post("/upload/detect", dependencies=[Depends(require_ready)])
+async def detect_text(
+    request: Request,
+    file: UploadFile = File(...),
+    max_side: Optional[int] = None,
+    grayscale: Optional[bool] = None,
+    roi: Optional[str] = None,
+    lang: Optional[str] = None,
+    format: str = "json",
+    rate_limit: Any = Depends(check_rate_limit)
+):
+    """Detection only: where the image has text, without reading it
+
+    Returns ``has_text`` and the text ``boxes`` (four corners each, in
+    original image pixels). Neither angle classification nor recognition
+    runs, so this costs a fraction of ``/upload/``. ``max_side``,
+    ``grayscale``, ``roi`` and ``format`` work as for ``/upload/``.
+    """
+    start_time = time.time()
+    client_ip = request.client.host
+    options = build_preprocess_options(max_side, grayscale, roi, tile=False)._replace(task="detect")
+    lang, _ = resolve_model(lang, False)
+    check_output_options("text", 0.0, format)
+
+    try:
+        read_start = time.perf_counter()
+        with open_upload(file, MAX_FILE_SIZE) as image_bytes:
+            observe_stage("upload_read", time.perf_counter() - read_start)
+            file_size = len(image_bytes)
+            result, cache_status = await cached_ocr(image_bytes, options, lang, False)
+    except FileTooLargeError as e:
+        logger.warning(f"File too large: {e.file_size} bytes, from {client_ip}")
+        raise HTTPException(status_code=413, detail=str(e))
+    except PoolBusyError as e:
+        OCR_ERRORS.inc(reason="deadline" if isinstance(e, DeadlineExceededError) else "busy")
+        logger.warning(f"{str(e)}, rejecting detection request from {client_ip}")
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+    except ValueError as e:
+        OCR_ERRORS.inc(reason="invalid_upload")
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        OCR_ERRORS.inc(reason="ocr")
+        logger.exception(f"Error in detection: {str(e)}, from {client_ip}")
+        raise HTTPException(status_code=500, detail=f"Error processing image: {str(e)}")
+
+    logger.info(f"Detected {len(result['boxes'])} text boxes, cache: {cache_status}, from {client_ip}")
+    return render_result({
+        "has_text": bool(result["boxes"]),
+        "boxes": result["boxes"],
+        "count": len(result["boxes"]),
+        "file_size": file_size,
+        "process_time": time.time() - start_time,
+        "cache": cache_status,
+        "transforms": result["transforms"],
+    }, format)
+
+@app.post("/upload/recognize", dependencies=[Depends(require_ready)])
+async def recognize_lines(
+    request: Request,
+    files: List[UploadFile] = File(...),
+    grayscale: Optional[bool] = None,
+    lang: Optional[str] = None,
+    use_angle_cls: Optional[bool] = None,
+    format: str = "json",
+    rate_limit: Any = Depends(check_rate_limit)
+):
+    """Recognition only, for callers that already cropped their text lines
+
+    Each file (repeat the ``files`` field, or send zip/tar archives) is read
+    whole as one line of text; detection is skipped. The line images of a
+    request, and of concurrent ones, reach the workers in micro-batches and
+    are recognized together. ``use_angle_cls=false`` also skips angle
+    classification. Returns ``text`` and ``confidence`` per line, in upload order.
+    """
+    start_time = time.time()
+    client_ip = request.client.host
+    options = build_preprocess_options(0, grayscale, None, tile=False)._replace(task="recognize")
+    lang, use_angle_cls = resolve_model(lang, use_angle_cls)
+    check_output_options("text", 0.0, format)
+
+    with ExitStack() as stack:
+        items = await _collect_batch_items(files, client_ip, stack)
+        # As for /upload/batch, bound how many line images wait on the OCR pool at once
+        semaphore = asyncio.Semaphore(max(1, ocr_pool.workers * OCR_BATCH_MAX_SIZE))
+
+        async def run_item(item):
+            result = {"index": item["index"], "filename": item["filename"]}
+            if item["error"]:
+                result["error"] = item["error"]
+                return result
+            try:
+                async with semaphore:
+                    image_bytes = await load_item(item)
+                    line, result["cache"] = await cached_ocr(image_bytes, options, lang, use_angle_cls)
+                result.update(text=line["text"], confidence=line["confidence"])
+            except PoolBusyError as e:
+                OCR_ERRORS.inc(reason="deadline" if isinstance(e, DeadlineExceededError) else "busy")
+                result["error"] = "Server is busy. Please retry later."
+            except ValueError as e:
+                OCR_ERRORS.inc(reason="invalid_upload")
+                result["error"] = str(e)
+            except Exception as e:
+                OCR_ERRORS.inc(reason="ocr")
+                logger.error(f"Error in line image {item['filename']}: {str(e)}, from {client_ip}")
+                result["error"] = f"Error processing image: {str(e)}"
+            return result
+
+        results = await asyncio.gather(*(run_item(item) for item in items))
+    process_time = time.time() - start_time
+    logger.info(f"Recognized {len(results)} line images in {process_time:.2f} seconds, from {client_ip}")
+    return render_result({
+        "results": results,
+        "count": len(results),
+        "errors": sum(1 for r in results if "error" in r),
+        "process_time": process_time
+    }, format)
+
+async def run_job(image_bytes, params: Dict[str, Any]) -> Dict[str, Any]:
+    """Process the image of a background job with the settings it was submitted with"""
+    start_time = time.time()
+    options = PreprocessOptions(
+        max_side=params["max_side"],
+        grayscale=params["grayscale"],
+        rois=tuple(tuple(roi) for roi in params["rois"]),
+        urls_only=params.get("urls_only", False),
+        tile=params.get("tile", False),
+    )
+    result = await process_image(image_bytes, "job", options, params["lang"], params["use_angle_cls"],
+                                 params.get("min_confidence", 0.0))
+    if "error" in result:
+        raise RuntimeError(f"Error processing image: {result['error']}")
+    result.update(file_size=len(image_bytes), process_time=time.time() - start_time, lang=params["lang"])
+    return shape_result(result, params.get("output", "text"), "json")
+
+job_queue = JobQueue(
+    JOB_DB,
+    run_job,
+    workers=JOB_WORKERS,
+    max_queued=JOB_MAX_QUEUED,
+    result_ttl=JOB_RESULT_TTL,
+    is_ready=lambda: ocr_pool.ready,
+    on_finished=lambda status: OCR_JOBS.inc(status=status),
+)
+
+@app.post("/jobs", status_code=202)
+async def create_job(
+    request: Request,
+    file: UploadFile = File(...),
+    priority: int = 0,
+    max_side: Optional[int] = None,
+    grayscale: Optional[bool] = None,
+    roi: Optional[str] = None,
+    lang: Optional[str] = None,
+    use_angle_cls: Optional[bool] = None,
+    mode: str = "text",
+    tile: Optional[bool] = None,
+    output: str = "text",
+    min_confidence: float = 0.0,
+    rate_limit: Any = Depends(check_rate_limit)
+):
+    """Queue an image for OCR and return its job id right away
+
+    Takes the same query parameters as ``/upload/`` (results are always
+    JSON) plus ``priority`` (-10 to 10, higher runs first). Jobs are
+    accepted while the OCR engines are still loading and run once they are
+    ready.
+    """
+    client_ip = request.client.host
+    if startup_state["status"] == "failed":
+        raise HTTPException(status_code=500, detail="PaddleOCR not initialized properly")
+    if not -10 <= priority <= 10:
+        raise HTTPException(status_code=400, detail="priority must be between -10 and 10")
+    options = build_preprocess_options(max_side, grayscale, roi, mode, tile)
+    lang, use_angle_cls = resolve_model(lang, use_angle_cls)
+    check_output_options(output, min_confidence, "json")
+    params = {**options._asdict(), "lang": lang, "use_angle_cls": use_angle_cls,
+              "output": output, "min_confidence": min_confidence}
+
+    try:
+        with open_upload(file, MAX_FILE_SIZE) as image_bytes:
+            job = await job_queue.submit(image_bytes, params, priority)
+    except FileTooLargeError as e:
+        logger.warning(f"File too large: {e.file_size} bytes, from {client_ip}")
+        raise HTTPException(status_code=413, detail=str(e))
+    except JobQueueFullError as e:
+        logger.warning(f"Job queue full, rejecting job from {client_ip}")
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "5"})
+
+    OCR_JOBS.inc(status="submitted")
+    logger.info(f"Queued job {job['id']} (priority {priority}) from {client_ip}, file: {file.filename}")
+    return JSONResponse(status_code=202, content=job, headers={"Location": f"/jobs/{job['id']}"})
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str, wait: float = 0):
+    """Job status and, once done, its result
+
+    With ``wait`` (seconds, up to JOB_WAIT_MAX) the request is held open
+    until the job finishes or the time runs out.
+    """
+    wait = min(max(0.0, wait), JOB_WAIT_MAX)
+    job = await job_queue.wait(job_id, wait) if wait > 0 else await job_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+@app.get("/jobs/{job_id}/events")
+async def job_events(job_id: str):
+    """Server-sent events: one event per status change until the job finishes"""
+    if await job_queue.get(job_id) is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+
+    async def events():
+        async for job in job_queue.watch(job_id, heartbeat=15):
+            if job is None:
+                return
+            yield f"event: {job['status']}\ndata: {json.dumps(job)}\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+@app.delete("/jobs/{job_id}")
+async def cancel_job(job_id: str):
+    """Cancel a queued or running job"""
+    job = await job_queue.cancel(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if job["status"] != "cancelled":
+        raise HTTPException(status_code=409, detail=f"Job already {job['status']}")
+    return job
+
+@app.get("/health/live")
+async def liveness_check():
+    """Liveness: the server process is up and its event loop is responsive"""
+    return {"status": "alive", "timestamp": datetime.now().isoformat()}
+
+@app.get("/health/ready")
+async def readiness_check():
+    """Readiness: every OCR worker has loaded and warmed up its engine"""
+    await require_ready()
+    return {"status": "ready", "timestamp": datetime.now().isoformat(), "startup": startup_state}
+
 @app.get("/health")
 async def health_check():
     """Health check endpoint"""
-    if ocr is None:
-        raise HTTPException(status_code=500, detail="PaddleOCR not initialized properly")
+    await require_ready()
     return {
         "status": "healthy", 
         "timestamp": datetime.now().isoformat(),
         "max_file_size_mb": MAX_FILE_SIZE / (1024 * 1024),
         "rate_limit_requests": RATE_LIMIT_REQUESTS,
-        "rate_limit_window_seconds": RATE_LIMIT_WINDOW
+        "rate_limit_window_seconds": RATE_LIMIT_WINDOW,
+        "rate_limiter": rate_limiter.stats(),
+        "ocr_pool": ocr_pool.stats(),
+        "runtime": OCR_RUNTIME._asdict() if OCR_POOL_MODE != "remote" else None,
+        "batching": ocr_batcher.stats(),
+        "admission": ocr_limiter.stats(),
+        "cache": ocr_cache.stats() if ocr_cache is not None else None,
+        "logging": logging_stats(),
+        "sessions": frame_sessions.stats() if frame_sessions is not None else None,
+        "models": model_stats.stats(),
+        "jobs": await job_queue.stats(),
+        "startup": startup_state
     }
 
+@app.get("/models")
+async def model_stats_endpoint():
+    """Per-language model load and hit statistics"""
+    return {
+        "default_lang": OCR_LANG,
+        "supported_langs": OCR_LANGS,
+        "memory_budget_mb_per_worker": OCR_MODEL_MEMORY_MB,
+        "languages": model_stats.stats()
+    }
+
+@app.get("/metrics")
+async def metrics_endpoint():
+    """Request, stage latency, error and queue metrics in the Prometheus text format"""
+    return Response(content=metrics.render(), media_type=metrics.content_type)
+
 @app.get("/")
 async def root():
     """Root endpoint with API information"""
@@ -206,7 +1226,19 @@ async def root():
         "endpoints": [
             {"path": "/", "method": "GET", "description": "API information"},
             {"path": "/health", "method": "GET", "description": "Health check endpoint"},
-            {"path": "/upload/", "method": "POST", "description": "Upload and process image"}
+            {"path": "/health/live", "method": "GET", "description": "Liveness probe"},
+            {"path": "/health/ready", "method": "GET", "description": "Readiness probe, ready once the OCR engines are warmed up"},
+            {"path": "/upload/", "method": "POST", "description": "Upload and process image"},
+            {"path": "/upload/batch", "method": "POST", "description": "Upload and process many images or a zip/tar archive"},
+            {"path": "/upload/document", "method": "POST", "description": "OCR a multi-page PDF or TIFF, streaming one NDJSON line per page"},
+            {"path": "/upload/detect", "method": "POST", "description": "Find the text boxes in an image without recognizing them"},
+            {"path": "/upload/recognize", "method": "POST", "description": "Recognize cropped text-line images, each read as one line"},
+            {"path": "/models", "method": "GET", "description": "Per-language model load and hit statistics"},
+            {"path": "/metrics", "method": "GET", "description": "Prometheus metrics"},
+            {"path": "/jobs", "method": "POST", "description": "Queue an image for OCR and get a job id"},
+            {"path": "/jobs/{job_id}", "method": "GET", "description": "Job status and result, optionally long-polling with ?wait="},
+            {"path": "/jobs/{job_id}/events", "method": "GET", "description": "Server-sent events for a job"},
+            {"path": "/jobs/{job_id}", "method": "DELETE", "description": "Cancel a job"}
         ]
     }
 
@@ -0,0 +1,113 @@
+import gc
+import logging
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Tuple
+
+from ocr_engine import OCREngine, create_engine
+
+logger = logging.getLogger("paddleocr-api")
+
+
+def _rss_mb() -> float:
+    """Resident memory of this process in MB (0 where /proc is unavailable)"""
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except (OSError, ValueError, IndexError):
+        return 0.0
+
+
+class ModelRegistry:
+    """Per-worker set of OCR engines, one per language, loaded on demand.
+
+    Engines whose detection model is already resident reuse that detector
+    instead of keeping a second copy. When the measured memory of the
+    loaded engines exceeds ``memory_budget_mb``, the least recently used
+    languages are unloaded (never the one just requested).
+    """
+
+    def __init__(self, engine: str, engine_options: Dict[str, Any], memory_budget_mb: float = 1024,
+                 default_model_mb: float = 200):
+        self.engine = engine
+        self.engine_options = engine_options
+        self.memory_budget_mb = memory_budget_mb
+        self.default_model_mb = default_model_mb
+        self._engines: "OrderedDict[str, Tuple[OCREngine, float]]" = OrderedDict()
+
+    def get(self, lang: str) -> Tuple[OCREngine, Dict[str, Any]]:
+        """Return the engine for ``lang`` and what the registry had to do to provide it"""
+        if lang in self._engines:
+            self._engines.move_to_end(lang)
+            return self._engines[lang][0], {"lang": lang, "loaded": False}
+
+        rss_before = _rss_mb()
+        start = time.perf_counter()
+        engine = create_engine(self.engine, **{**self.engine_options, "lang": lang})
+        shared = self._share_detector(engine)
+        load_time = time.perf_counter() - start
+        # RSS is process wide, so fall back to an estimate when the delta is not usable
+        memory_mb = _rss_mb() - rss_before
+        if memory_mb <= 0:
+            memory_mb = self.default_model_mb
+
+        self._engines[lang] = (engine, memory_mb)
+        evicted = self._evict(keep=lang)
+        logger.info(f"Loaded OCR model for '{lang}' in {load_time:.2f}s (~{memory_mb:.0f} MB, "
+                    f"shared detector: {shared}, evicted: {evicted or 'none'})")
+        return engine, {"lang": lang, "loaded": True, "load_time": load_time, "evicted": evicted}
+
+    def _share_detector(self, engine: OCREngine) -> bool:
+        key = engine.detector_key
+        if key is None:
+            return False
+        for other, _ in self._engines.values():
+            if other.detector_key == key:
+                engine.share_detector(other)
+                return True
+        return False
+
+    def _evict(self, keep: str) -> List[str]:
+        evicted = []
+        while sum(size for _, size in self._engines.values()) > self.memory_budget_mb and len(self._engines) > 1:
+            lang = next(lang for lang in self._engines if lang != keep)
+            del self._engines[lang]
+            evicted.append(lang)
+        if evicted:
+            gc.collect()
+        return evicted
+
+    def loaded(self) -> List[str]:
+        return list(self._engines)
+
+
+class ModelUsageStats:
+    """Per-language load and hit statistics, aggregated in the API process
+    from the model events that workers return with their results."""
+
+    def __init__(self):
+        self._langs: Dict[str, Dict[str, Any]] = {}
+
+    def _entry(self, lang: str) -> Dict[str, Any]:
+        return self._langs.setdefault(lang, {
+            "requests": 0, "hits": 0, "loads": 0, "evictions": 0, "load_time_total": 0.0,
+        })
+
+    def record(self, event: Dict[str, Any], images: int = 1):
+        stats = self._entry(event["lang"])
+        stats["requests"] += images
+        if event.get("loaded"):
+            stats["loads"] += 1
+            stats["load_time_total"] += event.get("load_time", 0.0)
+            stats["hits"] += images - 1
+        else:
+            stats["hits"] += images
+        for lang in event.get("evicted", ()):
+            self._entry(lang)["evictions"] += 1
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        return {
+            lang: {**stats, "hit_ratio": round(stats["hits"] / stats["requests"], 3) if stats["requests"] else 0}
+            for lang, stats in self._langs.items()
+        }
@@ -1,119 +1,414 @@
-import time
-import requests
-import datetime
 import argparse
-import os
+import asyncio
 import csv
+import datetime
+import itertools
+import json
+import math
+import os
+import re
 import signal
-import sys
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import urljoin
+
+import httpx
 
 # API endpoint
 API_URL = "http://localhost:8000/upload/"
 
-# Global flag for stopping the monitor
-running = True
+IMAGE_PATTERNS = ("*.jpg", "*.jpeg", "*.png", "*.bmp", "*.webp")
+PERCENTILES = (50, 90, 99, 99.9)
 
-def signal_handler(sig, frame):
-    """Handle ctrl+c to gracefully stop monitoring"""
-    global running
-    print("\nStopping monitoring...")
-    running = False
+# Random bytes appended to every probe, so each one misses the server's
+# result cache and measures OCR (decoders ignore data after the image)
+NONCE_BYTES = 16
 
-def monitor_api(image_path, interval=60, output_file="monitoring_results.csv", duration_hours=None):
-    """Monitor the API by sending requests at regular intervals"""
-    start_time = time.time()
-    
-    # Check if the file exists to determine if we need to write the header
-    file_exists = os.path.isfile(output_file)
-    
-    with open(output_file, 'a', newline='') as csv_file:
-        fieldnames = ['timestamp', 'response_time', 'status', 'status_code', 'error_message']
-        writer = csv.DictWriter(csv_file, fieldnames=fieldnames)
-        
-        # Write header if the file is new
-        if not file_exists:
-            writer.writeheader()
-        
-        print(f"Starting API monitoring, sending requests every {interval} seconds")
-        print(f"Press Ctrl+C to stop monitoring")
-        print(f"Results are being saved to {output_file}")
-        
-        if duration_hours:
-            end_time = start_time + (duration_hours * 3600)
-            print(f"Monitoring will automatically stop after {duration_hours} hours")
+# Sums and counts of the server's latency histograms, read from /metrics
+SERVER_METRIC = re.compile(
+    r'^(ocr_stage_duration_seconds|http_request_duration_seconds)_(sum|count)\{(?:stage|path)="([^"]*)"\} (\S+)$',
+    re.MULTILINE)
+
+
+class LatencyHistogram:
+    """Latencies in logarithmic buckets 2% wide: fixed memory, mergeable, percentiles within ~1%"""
+
+    GROWTH = 1.02
+    SMALLEST = 1e-4  # seconds; anything faster shares the first bucket
+
+    def __init__(self):
+        self.counts: Dict[int, int] = {}
+        self.count = 0
+
+    def add(self, seconds: float):
+        bucket = max(0, int(math.log(max(seconds, self.SMALLEST) / self.SMALLEST, self.GROWTH)))
+        self.counts[bucket] = self.counts.get(bucket, 0) + 1
+        self.count += 1
+
+    def merge(self, other: "LatencyHistogram"):
+        for bucket, count in other.counts.items():
+            self.counts[bucket] = self.counts.get(bucket, 0) + count
+        self.count += other.count
+
+    def percentile(self, pct: float) -> Optional[float]:
+        """Middle of the bucket holding the nearest-rank percentile, in seconds"""
+        if not self.count:
+            return None
+        rank = max(1, math.ceil(pct / 100 * self.count))
+        seen = 0
+        for bucket in sorted(self.counts):
+            seen += self.counts[bucket]
+            if seen >= rank:
+                return self.SMALLEST * self.GROWTH ** (bucket + 0.5)
+        return None
+
+
+class WindowSlot:
+    __slots__ = ("start", "latency", "server", "overhead", "requests", "errors", "cached", "slow", "error_kinds")
+
+    def __init__(self, start: float):
+        self.start = start
+        self.latency = LatencyHistogram()
+        self.server = LatencyHistogram()
+        self.overhead = LatencyHistogram()
+        self.requests = 0
+        self.errors = 0
+        self.cached = 0
+        self.slow = 0
+        self.error_kinds: Dict[str, int] = {}
+
+    def add(self, sample: Dict[str, Any], latency_slo: float):
+        self.requests += 1
+        if sample.get("error"):
+            self.errors += 1
+            self.error_kinds[sample["error"]] = self.error_kinds.get(sample["error"], 0) + 1
+            return
+        if sample.get("cache") not in (None, "miss"):
+            # Answered without OCR: it counts for availability, not for latency
+            self.cached += 1
+            return
+        self.latency.add(sample["latency"])
+        if sample["latency"] > latency_slo:
+            self.slow += 1
+        if sample.get("server_time") is not None:
+            self.server.add(sample["server_time"])
+            self.overhead.add(max(0.0, sample["latency"] - sample["server_time"]))
+
+    def merge(self, other: "WindowSlot"):
+        self.latency.merge(other.latency)
+        self.server.merge(other.server)
+        self.overhead.merge(other.overhead)
+        self.requests += other.requests
+        self.errors += other.errors
+        self.cached += other.cached
+        self.slow += other.slow
+        for kind, count in other.error_kinds.items():
+            self.error_kinds[kind] = self.error_kinds.get(kind, 0) + count
+
+
+class RollingWindow:
+    """Probe statistics over the last ``seconds``, kept in slots of ``slot_seconds`` that expire whole"""
+
+    def __init__(self, seconds: float, slot_seconds: float, latency_slo: float):
+        self.seconds = seconds
+        self.slot_seconds = slot_seconds
+        self.latency_slo = latency_slo
+        self.slots: List[WindowSlot] = []
+
+    def add(self, sample: Dict[str, Any], now: float):
+        start = now - now % self.slot_seconds
+        if not self.slots or self.slots[-1].start != start:
+            self.slots.append(WindowSlot(start))
+        self.slots[-1].add(sample, self.latency_slo)
+
+    def snapshot(self, now: float) -> WindowSlot:
+        self.slots = [slot for slot in self.slots if slot.start + self.slot_seconds > now - self.seconds]
+        merged = WindowSlot(now - self.seconds)
+        for slot in self.slots:
+            merged.merge(slot)
+        return merged
+
+
+def load_images(images: List[str], image_dir: Optional[str]) -> List[Tuple[str, bytes]]:
+    """The probe images, read once; probes rotate through them"""
+    paths = [Path(image) for image in images]
+    if image_dir:
+        paths += sorted(path for pattern in IMAGE_PATTERNS for path in Path(image_dir).glob(pattern))
+    if not paths:
+        raise SystemExit("No probe images: pass --image and/or --image-dir")
+    return [(path.name, path.read_bytes()) for path in paths]
+
+
+async def probe(client: httpx.AsyncClient, url: str, name: str, data: bytes) -> Dict[str, Any]:
+    """POST one image, made unique so it runs OCR; ``server_time`` is the ``process_time`` the API reports for it"""
+    sample = {"timestamp": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"), "image": name,
+              "server_time": None, "cache": None, "status_code": 0, "error": "", "error_message": ""}
+    data = data + os.urandom(NONCE_BYTES)
+    start = time.perf_counter()
+    try:
+        response = await client.post(url, files={"file": (name, data, "application/octet-stream")})
+        sample["status_code"] = response.status_code
+        if response.status_code != 200:
+            sample["error"] = f"status_{response.status_code}"
+            sample["error_message"] = response.text[:100]
         else:
-            end_time = float('inf')
-        
-        # Monitor loop
-        while running and time.time() < end_time:
-            timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            
-            try:
-                with open(image_path, "rb") as image_file:
-                    files = {"file": (os.path.basename(image_path), image_file, "image/jpeg")}
-                    
-                    # Measure response time
-                    request_start = time.time()
-                    response = requests.post(API_URL, files=files, timeout=30)
-                    request_end = time.time()
-                    response_time = request_end - request_start
-                    
-                    # Prepare results
-                    result = {
-                        'timestamp': timestamp,
-                        'response_time': response_time,
-                        'status': 'success' if response.status_code == 200 else 'error',
-                        'status_code': response.status_code,
-                        'error_message': ''
-                    }
-                    
-                    if response.status_code != 200:
-                        result['error_message'] = response.text[:100]
-                    
-                    # Write results
-                    writer.writerow(result)
-                    csv_file.flush()  # Ensure data is written immediately
-                    
-                    # Print status
-                    status_emoji = "✅" if response.status_code == 200 else "❌"
-                    print(f"{timestamp} - {status_emoji} Response time: {response_time:.2f}s, Status: {response.status_code}")
-                    
-            except Exception as e:
-                # Handle request errors
-                result = {
-                    'timestamp': timestamp,
-                    'response_time': -1,
-                    'status': 'exception',
-                    'status_code': 0,
-                    'error_message': str(e)[:100]
-                }
-                
-                writer.writerow(result)
-                csv_file.flush()
-                print(f"{timestamp} - ❌ Error: {str(e)}")
-            
-            # Wait for the next interval if we're still supposed to be monitoring
-            if running and time.time() < end_time:
-                remaining_sleep = max(0, interval - (time.time() - request_start))
-                time.sleep(remaining_sleep)
-        
-        # Final summary
-        elapsed = time.time() - start_time
-        print(f"\nMonitoring completed after {elapsed/60:.1f} minutes")
+            body = response.json()
+            sample["server_time"] = body.get("process_time")
+            sample["cache"] = body.get("cache")
+            # The API answers 200 with an "Error: ..." text when OCR itself fails
+            if str(body.get("text", "")).startswith("Error:"):
+                sample["error"] = "ocr_error"
+                sample["error_message"] = body["text"][:100]
+    except (httpx.HTTPError, ValueError) as e:
+        sample["error"] = type(e).__name__
+        sample["error_message"] = str(e)[:100]
+    sample["latency"] = time.perf_counter() - start
+    return sample
+
+
+class ServerMetrics:
+    """Server-side stage and request latencies between two scrapes of /metrics.
+
+    These cover all of the server's traffic, not only the probes.
+    """
+
+    def __init__(self, client: httpx.AsyncClient, url: str):
+        self.client = client
+        self.url = url
+        self.previous: Dict[Tuple[str, str], List[float]] = {}
+
+    async def _scrape(self) -> Dict[Tuple[str, str], List[float]]:
+        response = await self.client.get(self.url)
+        response.raise_for_status()
+        totals: Dict[Tuple[str, str], List[float]] = {}
+        for metric, kind, label, value in SERVER_METRIC.findall(response.text):
+            name = label if metric.startswith("ocr_stage") else f"http {label}"
+            totals.setdefault((metric, name), [0.0, 0.0])[0 if kind == "sum" else 1] = float(value)
+        return totals
+
+    async def interval_means(self) -> Dict[str, float]:
+        """Mean milliseconds per stage (and per HTTP route) since the previous call"""
+        try:
+            current = await self._scrape()
+        except (httpx.HTTPError, ValueError):
+            return {}
+        means = {}
+        for key, (total, count) in current.items():
+            before_total, before_count = self.previous.get(key, (0.0, 0.0))
+            # A drop means the server restarted; its counters began again from zero
+            if count < before_count:
+                before_total, before_count = 0.0, 0.0
+            if count > before_count:
+                means[key[1]] = (total - before_total) / (count - before_count) * 1000
+        self.previous = current
+        return means
+
+
+def _ms(seconds: Optional[float]) -> str:
+    return "-" if seconds is None else f"{seconds * 1000:.0f}"
+
+
+def window_summary(stats: WindowSlot, args) -> Dict[str, Any]:
+    """Counts, percentiles (ms) and SLO burn rates of one window"""
+    summary: Dict[str, Any] = {"requests": stats.requests, "errors": stats.errors, "cached": stats.cached,
+                               "error_kinds": stats.error_kinds}
+    for label, histogram in (("latency", stats.latency), ("server", stats.server), ("overhead", stats.overhead)):
+        summary[label] = {f"p{pct:g}": histogram.percentile(pct) for pct in PERCENTILES}
+    error_rate = stats.errors / stats.requests if stats.requests else 0.0
+    slow_rate = stats.slow / stats.latency.count if stats.latency.count else 0.0
+    summary["error_rate"] = error_rate
+    # How many times faster than allowed the error budget is being spent
+    summary["burn"] = {"errors": error_rate / (1 - args.availability_target),
+                       "latency": slow_rate / (1 - args.latency_target)}
+    return summary
+
+
+def print_window(title: str, summary: Dict[str, Any]):
+    latency, server, overhead = summary["latency"], summary["server"], summary["overhead"]
+    print(f"  {title}: {summary['requests']} probes, errors {summary['error_rate'] * 100:.2f}% | "
+          f"client p50 {_ms(latency['p50'])} p90 {_ms(latency['p90'])} p99 {_ms(latency['p99'])} "
+          f"p99.9 {_ms(latency['p99.9'])} ms | server p50 {_ms(server['p50'])} p99 {_ms(server['p99'])} ms | "
+          f"overhead p50 {_ms(overhead['p50'])} p99 {_ms(overhead['p99'])} ms | "
+          f"burn errors {summary['burn']['errors']:.1f}x latency {summary['burn']['latency']:.1f}x")
+    if summary["error_kinds"]:
+        print(f"    errors: {summary['error_kinds']}")
+    if summary["cached"]:
+        print(f"    {summary['cached']} probes were answered from the result cache and left out of the latencies")
+
+
+def evaluate_alerts(short: Dict[str, Any], long: Dict[str, Any], args) -> Dict[str, str]:
+    """Alerts that are firing, by name.
+
+    A burn-rate alert needs both windows over the threshold: the long one
+    shows the budget is really being spent, the short one that it still is,
+    so alerts stop soon after the problem does.
+    """
+    if short["requests"] < args.min_samples:
+        return {}
+    firing = {}
+    p99 = short["latency"]["p99"]
+    if p99 is not None and p99 > args.latency_slo:
+        firing["p99"] = f"p99 {p99 * 1000:.0f} ms over the {args.latency_slo * 1000:.0f} ms SLO (last {args.short_window:g} min)"
+    for budget in ("errors", "latency"):
+        if short["burn"][budget] > args.burn_rate and long["burn"][budget] > args.burn_rate:
+            firing[f"{budget}_burn"] = (f"{budget} budget burning at {short['burn'][budget]:.1f}x "
+                                        f"({args.short_window:g} min) / {long['burn'][budget]:.1f}x "
+                                        f"({args.long_window:g} min), threshold {args.burn_rate:g}x")
+    return firing
+
+
+async def monitor_api(args):
+    """Probe the API from ``args.concurrency`` loops and report rolling statistics and SLO alerts"""
+    images = load_images(args.image, args.image_dir)
+    rotation = itertools.cycle(images)
+    slot_seconds = max(1.0, args.summary_interval)
+    short = RollingWindow(args.short_window * 60, slot_seconds, args.latency_slo)
+    long = RollingWindow(args.long_window * 60, slot_seconds, args.latency_slo)
+    total = RollingWindow(math.inf, math.inf, args.latency_slo)
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    # signal.signal rather than loop.add_signal_handler, which Windows lacks
+    signal.signal(signal.SIGINT, lambda sig, frame: loop.call_soon_threadsafe(stop.set))
+
+    start_time = time.time()
+    end_time = start_time + args.duration * 3600 if args.duration else math.inf
+    fieldnames = ["timestamp", "image", "response_time", "server_time", "cache", "status", "status_code", "error_message"]
+    csv_exists = os.path.isfile(args.output)
+    if csv_exists:
+        # Keep appending in the layout the file was started with
+        with open(args.output, newline="") as f:
+            fieldnames = next(csv.reader(f), None) or fieldnames
+    csv_file = open(args.output, "a", newline="")
+    writer = csv.DictWriter(csv_file, fieldnames=fieldnames, extrasaction="ignore")
+    if not csv_exists:
+        writer.writeheader()
+    summaries = open(args.summary_output, "a") if args.summary_output else None
+    alerts_file = open(args.alerts_output, "a") if args.alerts_output else None
+    firing: Dict[str, str] = {}
+
+    async def wait(seconds: float) -> bool:
+        """Sleep, returning False if monitoring was stopped meanwhile"""
+        try:
+            await asyncio.wait_for(stop.wait(), timeout=max(0.0, min(seconds, end_time - time.time())))
+        except asyncio.TimeoutError:
+            pass
+        return not stop.is_set() and time.time() < end_time
+
+    async def prober(client: httpx.AsyncClient, index: int):
+        # Spread the loops over the interval instead of probing in bursts
+        if not await wait(args.interval * index / args.concurrency):
+            return
+        while True:
+            started = time.time()
+            name, data = next(rotation)
+            sample = await probe(client, args.url, name, data)
+            now = time.time()
+            for window in (short, long, total):
+                window.add(sample, now)
+            writer.writerow({"timestamp": sample["timestamp"], "image": name, "response_time": sample["latency"],
+                             "server_time": sample["server_time"], "cache": sample["cache"],
+                             "status": "error" if sample["error"] else "success",
+                             "status_code": sample["status_code"], "error_message": sample["error_message"]})
+            if args.verbose:
+                status_emoji = "❌" if sample["error"] else "✅"
+                print(f"{sample['timestamp']} - {status_emoji} {name}: {sample['latency']:.2f}s, Status: {sample['status_code']}")
+            if not await wait(args.interval - (time.time() - started)):
+                return
+
+    async def reporter(server: ServerMetrics):
+        await server.interval_means()
+        while await wait(args.summary_interval):
+            now = time.time()
+            stages = await server.interval_means()
+            short_summary = window_summary(short.snapshot(now), args)
+            long_summary = window_summary(long.snapshot(now), args)
+            csv_file.flush()
+            print(f"\n[{datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}]")
+            print_window(f"last {args.short_window:g} min", short_summary)
+            print_window(f"last {args.long_window:g} min", long_summary)
+            if stages:
+                print(f"  server means over the last {args.summary_interval:g}s (all traffic, ms): "
+                      + ", ".join(f"{name} {value:.1f}" for name, value in sorted(stages.items())))
+
+            alerts = evaluate_alerts(short_summary, long_summary, args)
+            events = [{"alert": name, "state": "firing", "message": message}
+                      for name, message in alerts.items() if name not in firing]
+            events += [{"alert": name, "state": "resolved", "message": message}
+                       for name, message in firing.items() if name not in alerts]
+            firing.clear()
+            firing.update(alerts)
+            for event in events:
+                print(f"  {'🚨' if event['state'] == 'firing' else '✅'} {event['state'].upper()} "
+                      f"{event['alert']}: {event['message']}")
+                if alerts_file:
+                    alerts_file.write(json.dumps({"time": datetime.datetime.now().isoformat(timespec="seconds"),
+                                                  **event}) + "\n")
+                    alerts_file.flush()
+            if summaries:
+                summaries.write(json.dumps({"time": datetime.datetime.now().isoformat(timespec="seconds"),
+                                            "short": short_summary, "long": long_summary,
+                                            "server_stages_ms": stages, "firing": sorted(firing)}) + "\n")
+                summaries.flush()
+
+    print(f"Starting API monitoring: {args.concurrency} probe loop(s), each sending a request every "
+          f"{args.interval:g} seconds, rotating through {len(images)} image(s)")
+    print(f"SLOs: {args.latency_target * 100:g}% of probes under {args.latency_slo * 1000:.0f} ms, "
+          f"{args.availability_target * 100:g}% successful; summaries every {args.summary_interval:g}s")
+    print("Press Ctrl+C to stop monitoring")
+    print(f"Results are being saved to {args.output}")
+    if args.duration:
+        print(f"Monitoring will automatically stop after {args.duration} hours")
+
+    limits = httpx.Limits(max_connections=args.concurrency + 1, max_keepalive_connections=args.concurrency + 1)
+    try:
+        async with httpx.AsyncClient(timeout=args.timeout, limits=limits) as client:
+            server = ServerMetrics(client, args.metrics_url or urljoin(args.url, "/metrics"))
+            await asyncio.gather(reporter(server), *(prober(client, index) for index in range(args.concurrency)))
+    finally:
+        csv_file.close()
+        for f in (summaries, alerts_file):
+            if f:
+                f.close()
+
+    # Final summary
+    elapsed = time.time() - start_time
+    print(f"\nMonitoring completed after {elapsed / 60:.1f} minutes")
+    print_window("whole run", window_summary(total.snapshot(time.time()), args))
+
 
 def main():
     parser = argparse.ArgumentParser(description="Monitor PaddleOCR API over time")
-    parser.add_argument("--image", type=str, required=True, help="Path to test image")
-    parser.add_argument("--interval", type=int, default=60, help="Seconds between requests")
-    parser.add_argument("--output", type=str, default="monitoring_results.csv", help="Output CSV file")
+    parser.add_argument("--image", action="append", default=[], help="Path to a test image (repeatable)")
+    parser.add_argument("--image-dir", help="Probe with every image in this directory as well")
+    parser.add_argument("--url", default=API_URL, help="Upload endpoint to probe")
+    parser.add_argument("--metrics-url", help="Server metrics to read stage timings from (default: /metrics of --url)")
+    parser.add_argument("--concurrency", type=int, default=1, help="Probe loops running in parallel")
+    parser.add_argument("--interval", type=float, default=60, help="Seconds between requests of each probe loop")
+    parser.add_argument("--timeout", type=float, default=30, help="Request timeout in seconds")
+    parser.add_argument("--output", type=str, default="monitoring_results.csv", help="Output CSV file, one row per probe")
+    parser.add_argument("--summary-interval", type=float, default=60, help="Seconds between summaries")
+    parser.add_argument("--summary-output", help="Append each summary as a JSON line to this file")
+    parser.add_argument("--alerts-output", help="Append alerts firing and resolving as JSON lines to this file")
+    parser.add_argument("--short-window", type=float, default=5, help="Short rolling window in minutes")
+    parser.add_argument("--long-window", type=float, default=60, help="Long rolling window in minutes")
+    parser.add_argument("--latency-slo", type=float, default=2.0, help="Latency objective in seconds")
+    parser.add_argument("--latency-target", type=float, default=0.99,
+                        help="Share of probes that should be faster than --latency-slo (0.99: p99 under it)")
+    parser.add_argument("--availability-target", type=float, default=0.995, help="Share of probes that should succeed")
+    parser.add_argument("--burn-rate", type=float, default=6.0,
+                        help="Alert when an error budget burns this many times too fast in both windows")
+    parser.add_argument("--min-samples", type=int, default=20, help="Probes the short window needs before alerting")
     parser.add_argument("--duration", type=float, help="Duration in hours (optional)")
-    
+    parser.add_argument("--verbose", action="store_true", help="Print every probe")
+
     args = parser.parse_args()
-    
-    # Set up signal handling for graceful termination
-    signal.signal(signal.SIGINT, signal_handler)
-    
-    monitor_api(args.image, args.interval, args.output, args.duration)
+    if args.concurrency < 1:
+        parser.error("--concurrency must be at least 1")
+    if not 0 < args.latency_target < 1 or not 0 < args.availability_target < 1:
+        parser.error("--latency-target and --availability-target must be between 0 and 1")
+
+    asyncio.run(monitor_api(args))
 
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    main()
@@ -0,0 +1,185 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+logger = logging.getLogger("paddleocr-api")
+
+
+class _OwnerCancelled(Exception):
+    """The request computing a shared result was cancelled; waiters compute it themselves"""
+
+
+class OCRCache:
+    """Content-addressed cache for OCR results.
+
+    Results are keyed by a hash of the uploaded bytes plus the OCR config.
+    The in-memory tier is an LRU bounded by entry count, total size and TTL.
+    If ``disk_dir`` is given, results are also written to a sqlite database
+    there so they survive restarts. Concurrent lookups of the same key share
+    a single in-flight computation.
+    """
+
+    def __init__(self, max_entries: int = 1024, max_bytes: int = 64 * 1024 * 1024,
+                 ttl_seconds: float = 3600, disk_dir: Optional[str] = None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl_seconds
+        self._entries: "OrderedDict[str, Tuple[float, int, Any]]" = OrderedDict()
+        self._size = 0
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self._counters = {"memory_hits": 0, "disk_hits": 0, "shared": 0, "misses": 0, "evictions": 0}
+
+        self._db = None
+        self._db_lock = threading.Lock()
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+            self._db = sqlite3.connect(os.path.join(disk_dir, "ocr_cache.sqlite3"), check_same_thread=False)
+            self._db.execute("CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, value TEXT, created REAL)")
+            self._db.execute("DELETE FROM results WHERE created < ?", (time.time() - self.ttl,))
+            self._db.commit()
+            logger.info(f"OCR result cache persisted to {disk_dir}")
+
+    @staticmethod
+    def make_key(image_bytes, **config) -> str:
+        """Hash of the image contents and the OCR settings that affect the result"""
+        digest = hashlib.sha256(image_bytes)
+        digest.update(json.dumps(config, sort_keys=True).encode())
+        return digest.hexdigest()
+
+    def _get_memory(self, key: str) -> Optional[Any]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        created, size, value = entry
+        if time.time() - created > self.ttl:
+            self._remove(key)
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def _set_memory(self, key: str, value: Any, created: float):
+        size = len(json.dumps(value))
+        if size > self.max_bytes:
+            return
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = (created, size, value)
+        self._size += size
+        while len(self._entries) > self.max_entries or self._size > self.max_bytes:
+            self._remove(next(iter(self._entries)))
+            self._counters["evictions"] += 1
+
+    def _remove(self, key: str):
+        _, size, _ = self._entries.pop(key)
+        self._size -= size
+
+    def _get_disk(self, key: str) -> Optional[Tuple[float, Any]]:
+        with self._db_lock:
+            row = self._db.execute("SELECT value, created FROM results WHERE key = ?", (key,)).fetchone()
+        if row is None or time.time() - row[1] > self.ttl:
+            return None
+        return row[1], json.loads(row[0])
+
+    def _set_disk(self, key: str, value: Any, created: float):
+        with self._db_lock:
+            self._db.execute("INSERT OR REPLACE INTO results VALUES (?, ?, ?)", (key, json.dumps(value), created))
+            self._db.commit()
+
+    async def get_or_compute(self, key: str, compute: Callable[[], Awaitable[Any]]) -> Tuple[Any, str]:
+        """Return ``(value, source)`` where source is memory, disk, shared or miss
+
+        When the request computing a key is cancelled, requests waiting for it
+        take the computation over instead of failing:
+
+        >>> async def demo():
+        ...     cache, started = OCRCache(), asyncio.Event()
+        ...     async def slow():
+        ...         started.set()
+        ...         await asyncio.sleep(10)
+        ...     async def fast():
+        ...         return "text"
+        ...     owner = asyncio.create_task(cache.get_or_compute("k", slow))
+        ...     await started.wait()
+        ...     waiter = asyncio.create_task(cache.get_or_compute("k", fast))
+        ...     await asyncio.sleep(0)
+        ...     owner.cancel()
+        ...     return await waiter, owner.cancelled(), cache.stats()["misses"]
+        >>> asyncio.run(demo())
+        (('text', 'miss'), True, 2)
+        """
+        while True:
+            value = self._get_memory(key)
+            if value is not None:
+                self._counters["memory_hits"] += 1
+                return value, "memory"
+
+            inflight = self._inflight.get(key)
+            if inflight is None:
+                return await self._compute(key, compute)
+            try:
+                value = await asyncio.shield(inflight)
+            except _OwnerCancelled:
+                continue
+            self._counters["shared"] += 1
+            return value, "shared"
+
+    async def _compute(self, key: str, compute: Callable[[], Awaitable[Any]]) -> Tuple[Any, str]:
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            if self._db is not None:
+                row = await asyncio.to_thread(self._get_disk, key)
+                if row is not None:
+                    created, value = row
+                    self._set_memory(key, value, created)
+                    self._counters["disk_hits"] += 1
+                    future.set_result(value)
+                    return value, "disk"
+
+            self._counters["misses"] += 1
+            value = await compute()
+            created = time.time()
+            self._set_memory(key, value, created)
+            if self._db is not None:
+                await asyncio.to_thread(self._set_disk, key, value, created)
+            future.set_result(value)
+            return value, "miss"
+        except asyncio.CancelledError:
+            # Never cancel the shared future: that would cancel every waiter with it
+            if not future.done():
+                future.set_exception(_OwnerCancelled())
+                future.exception()
+            raise
+        except Exception as e:
+            # Waiters sharing this computation see the same error; nothing is cached
+            if not future.done():
+                future.set_exception(e)
+                future.exception()  # Mark retrieved when nobody else is waiting
+            raise
+        finally:
+            if self._inflight.get(key) is future:
+                del self._inflight[key]
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = sum(self._counters[k] for k in ("memory_hits", "disk_hits", "shared", "misses"))
+        hits = lookups - self._counters["misses"]
+        return {
+            "entries": len(self._entries),
+            "size_bytes": self._size,
+            "disk": self._db is not None,
+            **self._counters,
+            "hit_ratio": round(hits / lookups, 3) if lookups else 0,
+        }
+
+    def close(self):
+        if self._db is not None:
+            with self._db_lock:
+                self._db.close()
+            self._db = None
@@ -0,0 +1,254 @@
+import copy
+import logging
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+from runtime_config import onnx_session_options
+
+logger = logging.getLogger("paddleocr-api")
+
+# One recognized line: (box as four [x, y] points, text, confidence)
+OCRLine = Tuple[List[List[float]], str, float]
+
+
+class OCREngine:
+    """Interface between the serving layer and an OCR implementation.
+
+    Engines expose the three pipeline stages separately (detection, angle
+    classification, recognition) plus the full pipeline built from them,
+    so the serving layer can batch, cache and time each stage.
+    """
+
+    name = "base"
+    drop_score = 0.5
+    # Identifies the detection model; engines with the same key can share one detector
+    detector_key = None
+
+    def share_detector(self, other: "OCREngine"):
+        """Use ``other``'s detector instead of this engine's own copy"""
+
+    def detect(self, image: np.ndarray) -> List[np.ndarray]:
+        """Return text boxes (4x2 arrays) in reading order"""
+        raise NotImplementedError
+
+    def crop(self, image: np.ndarray, box: np.ndarray) -> np.ndarray:
+        """Cut a detected box out of the image, straightened"""
+        points = box.astype(np.float32)
+        width = int(max(np.linalg.norm(points[0] - points[1]), np.linalg.norm(points[2] - points[3])))
+        height = int(max(np.linalg.norm(points[0] - points[3]), np.linalg.norm(points[1] - points[2])))
+        target = np.float32([[0, 0], [width, 0], [width, height], [0, height]])
+        matrix = cv2.getPerspectiveTransform(points, target)
+        crop = cv2.warpPerspective(image, matrix, (max(1, width), max(1, height)), borderMode=cv2.BORDER_REPLICATE)
+        if crop.shape[0] / max(1, crop.shape[1]) >= 1.5:
+            crop = np.rot90(crop)
+        return crop
+
+    def classify(self, crops: List[np.ndarray]) -> List[np.ndarray]:
+        """Rotate upside-down crops; engines without a classifier return them unchanged"""
+        return crops
+
+    def recognize(self, crops: List[np.ndarray]) -> List[Tuple[str, float]]:
+        """Return ``(text, confidence)`` for each crop"""
+        raise NotImplementedError
+
+    def warmup(self, rounds: int = 1) -> float:
+        """Run the full pipeline on a synthetic page so the first real request
+        does not pay for graph and kernel initialization. Returns the time spent.
+        """
+        image = np.full((480, 640, 3), 255, np.uint8)
+        for idx, line in enumerate(("Warmup 0123456789", "https://example.com/warmup", "PaddleOCR API")):
+            cv2.putText(image, line, (20, 80 + idx * 120), cv2.FONT_HERSHEY_SIMPLEX, 1.2, (0, 0, 0), 2)
+        start = time.perf_counter()
+        for _ in range(rounds):
+            self.ocr([image], cls=True)
+        return time.perf_counter() - start
+
+    def detect_boxes(self, images: List[np.ndarray],
+                     timings: Optional[Dict[str, List[float]]] = None) -> List[List[np.ndarray]]:
+        """Detection only: the text boxes of each image, for callers that need no text"""
+        boxes = []
+        for image in images:
+            start = time.perf_counter()
+            boxes.append(self.detect(image))
+            _record(timings, "detection", start)
+        return boxes
+
+    def recognize_crops(self, crops: List[np.ndarray], cls: bool = True,
+                        timings: Optional[Dict[str, List[float]]] = None) -> List[Tuple[str, float]]:
+        """Recognition only, of images that each hold one text line (cropped by the caller).
+
+        All crops go through classification and recognition together, so
+        they fill the models' mini-batches. Vertical crops are turned as
+        :meth:`crop` turns detected ones.
+        """
+        if not crops:
+            return []
+        crops = [np.rot90(crop) if crop.shape[0] / max(1, crop.shape[1]) >= 1.5 else crop for crop in crops]
+        if cls:
+            start = time.perf_counter()
+            crops = self.classify(crops)
+            _record(timings, "classification", start)
+        start = time.perf_counter()
+        recognized = self.recognize(crops)
+        _record(timings, "recognition", start)
+        return [(text, float(score)) for text, score in recognized]
+
+    def ocr(self, images: List[np.ndarray], cls: bool = True,
+            timings: Optional[Dict[str, List[float]]] = None,
+            keep_box: Optional[Callable[[np.ndarray], bool]] = None) -> List[List[OCRLine]]:
+        """Full pipeline over several images.
+
+        Detection runs per image, while angle classification and recognition
+        run once over the crops of all images so they fill their internal
+        mini-batches. When ``timings`` is given, the seconds spent in each
+        stage call are appended to ``timings["detection"]``,
+        ``["classification"]`` and ``["recognition"]``. ``keep_box`` limits
+        classification and recognition to the detected boxes it accepts.
+        """
+        crops, owners, boxes = [], [], []
+        for idx, image in enumerate(images):
+            start = time.perf_counter()
+            image_boxes = self.detect(image)
+            _record(timings, "detection", start)
+            if keep_box is not None:
+                image_boxes = [box for box in image_boxes if keep_box(box)]
+            for box in image_boxes:
+                crops.append(self.crop(image, box))
+                owners.append(idx)
+                boxes.append(box)
+
+        lines: List[List[OCRLine]] = [[] for _ in images]
+        if not crops:
+            return lines
+        if cls:
+            start = time.perf_counter()
+            crops = self.classify(crops)
+            _record(timings, "classification", start)
+        start = time.perf_counter()
+        recognized = self.recognize(crops)
+        _record(timings, "recognition", start)
+        for owner, box, (text, score) in zip(owners, boxes, recognized):
+            if score >= self.drop_score:
+                lines[owner].append((np.asarray(box).tolist(), text, float(score)))
+        return lines
+
+
+def _record(timings: Optional[Dict[str, List[float]]], stage: str, start: float):
+    if timings is not None:
+        timings.setdefault(stage, []).append(time.perf_counter() - start)
+
+
+class PaddleEngine(OCREngine):
+    """PaddleOCR's detector, angle classifier and recognizer"""
+
+    name = "paddle"
+
+    def __init__(self, lang: str = "en", use_angle_cls: bool = True, **kwargs):
+        from paddleocr import PaddleOCR
+        if kwargs.get("use_onnx"):
+            # ONNX Runtime keeps its own thread pool; OMP_NUM_THREADS does not reach it
+            kwargs["onnx_sess_options"] = onnx_session_options(kwargs.get("cpu_threads", 0))
+        self._ocr = PaddleOCR(use_angle_cls=use_angle_cls, lang=lang, **kwargs)
+        self.use_angle_cls = use_angle_cls
+        self.drop_score = self._ocr.drop_score
+        self.detector_key = getattr(self._ocr.args, "det_model_dir", None)
+
+    def share_detector(self, other: "OCREngine"):
+        self._ocr.text_detector = other._ocr.text_detector
+
+    def detect(self, image: np.ndarray) -> List[np.ndarray]:
+        from paddleocr.tools.infer.predict_system import sorted_boxes
+        dt_boxes, _ = self._ocr.text_detector(image)
+        if dt_boxes is None:
+            return []
+        return sorted_boxes(dt_boxes)
+
+    def crop(self, image: np.ndarray, box: np.ndarray) -> np.ndarray:
+        from paddleocr.tools.infer.utility import get_minarea_rect_crop, get_rotate_crop_image
+        if self._ocr.args.det_box_type == "quad":
+            return get_rotate_crop_image(image, copy.deepcopy(box))
+        return get_minarea_rect_crop(image, copy.deepcopy(box))
+
+    def classify(self, crops: List[np.ndarray]) -> List[np.ndarray]:
+        if not self.use_angle_cls:
+            return crops
+        crops, _, _ = self._ocr.text_classifier(crops)
+        return crops
+
+    def recognize(self, crops: List[np.ndarray]) -> List[Tuple[str, float]]:
+        rec_res, _ = self._ocr.text_recognizer(crops)
+        return rec_res
+
+
+def _burn_cpu(milliseconds: float):
+    """Busy-loop in Python (holding the GIL) for roughly the given time"""
+    deadline = time.perf_counter() + milliseconds / 1000
+    while time.perf_counter() < deadline:
+        pass
+
+
+class FakeEngine(OCREngine):
+    """Deterministic stand-in for load testing without models or downloads.
+
+    Every image gets one box per line of ``text``, stacked from the top, and
+    each box is "recognized" as its line. ``latency_ms`` is spent sleeping
+    (like native inference, which releases the GIL) and ``cpu_ms`` busy-looping
+    in Python, both split between detection and recognition.
+    """
+
+    name = "fake"
+
+    def __init__(self, text: str = "PaddleOCR fake engine\nhttps://example.com",
+                 latency_ms: float = 50, cpu_ms: float = 0, **kwargs):
+        self.lines = [line for line in text.split("\n") if line] or [""]
+        self.latency_ms = latency_ms
+        self.cpu_ms = cpu_ms
+        self.drop_score = 0.0
+
+    def _spend(self, fraction: float):
+        if self.latency_ms > 0:
+            time.sleep(self.latency_ms * fraction / 1000)
+        if self.cpu_ms > 0:
+            _burn_cpu(self.cpu_ms * fraction)
+
+    def detect(self, image: np.ndarray) -> List[np.ndarray]:
+        self._spend(0.5)
+        height, width = image.shape[:2]
+        line_height = max(1, height // (len(self.lines) + 1))
+        boxes = []
+        for idx in range(len(self.lines)):
+            top, bottom = idx * line_height, min(height, (idx + 1) * line_height)
+            boxes.append(np.float32([[0, top], [width, top], [width, bottom], [0, bottom]]))
+        return boxes
+
+    def recognize(self, crops: List[np.ndarray]) -> List[Tuple[str, float]]:
+        self._spend(0.5)
+        return [(self.lines[idx % len(self.lines)], 0.99) for idx in range(len(crops))]
+
+
+ENGINES = {
+    PaddleEngine.name: PaddleEngine,
+    FakeEngine.name: FakeEngine,
+}
+
+
+def create_engine(name: str = "paddle", **options: Any) -> OCREngine:
+    """Instantiate an engine by name (``paddle`` or ``fake``)"""
+    if name not in ENGINES:
+        raise ValueError(f"Unknown OCR engine: {name}")
+    return ENGINES[name](**options)
+
+
+def engine_options_from_env(environ: Dict[str, str]) -> Dict[str, Any]:
+    """Settings for the fake engine taken from OCR_FAKE_* environment variables"""
+    options = {}
+    if "OCR_FAKE_TEXT" in environ:
+        options["text"] = environ["OCR_FAKE_TEXT"].replace("\\n", "\n")
+    if "OCR_FAKE_LATENCY_MS" in environ:
+        options["latency_ms"] = float(environ["OCR_FAKE_LATENCY_MS"])
+    if "OCR_FAKE_CPU_MS" in environ:
+        options["cpu_ms"] = float(environ["OCR_FAKE_CPU_MS"])
+    return options
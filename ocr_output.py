@@ -0,0 +1,74 @@
+import json
+from typing import Any, Dict, List, Sequence
+
+import numpy as np
+
+OUTPUTS = ("text", "structured")
+FORMATS = ("json", "msgpack")
+MEDIA_TYPES = {"json": "application/json", "msgpack": "application/x-msgpack"}
+STREAM_MEDIA_TYPES = {"json": "application/x-ndjson", "msgpack": "application/x-msgpack"}
+
+
+def filter_lines(lines: Sequence[Sequence[Any]], min_confidence: float) -> List[Sequence[Any]]:
+    """Drop ``[box, text, confidence]`` lines recognized with less than ``min_confidence``"""
+    if min_confidence <= 0:
+        return list(lines)
+    return [line for line in lines if line[2] >= min_confidence]
+
+
+def lines_as_objects(lines: Sequence[Sequence[Any]]) -> List[Dict[str, Any]]:
+    """One ``{"box", "text", "confidence"}`` object per line, for JSON responses"""
+    return [{"box": box, "text": text, "confidence": confidence} for box, text, confidence in lines]
+
+
+def lines_as_arrays(lines: Sequence[Sequence[Any]]) -> Dict[str, Any]:
+    """Lines by column, with every box packed into a single byte string.
+
+    ``boxes`` holds ``len(text)`` quadrilaterals as little-endian int32
+    ``(x, y)`` corners, i.e. ``numpy.frombuffer(boxes, "<i4").reshape(-1, 4, 2)``,
+    instead of thousands of nested lists to build and parse.
+    """
+    boxes = np.asarray([box for box, _, _ in lines], dtype="<i4").reshape(-1, 4, 2)
+    return {
+        "text": [text for _, text, _ in lines],
+        "confidence": [confidence for _, _, confidence in lines],
+        "boxes": boxes.tobytes(),
+    }
+
+
+def _msgpack():
+    try:
+        import msgpack
+    except ImportError:
+        raise ValueError("format=msgpack requires the msgpack package (pip install msgpack)")
+    return msgpack
+
+
+def check_format(fmt: str):
+    """Raise ``ValueError`` for an unknown format, or one this server cannot produce"""
+    if fmt not in FORMATS:
+        raise ValueError(f"Unsupported format '{fmt}'. Supported: {', '.join(FORMATS)}")
+    if fmt == "msgpack":
+        _msgpack()
+
+
+def shape_result(result: Dict[str, Any], output: str, fmt: str) -> Dict[str, Any]:
+    """Drop the internal ``lines`` of a result, or with ``structured`` output put them in their form for ``fmt``"""
+    result = dict(result)
+    lines = result.pop("lines", None) or []
+    if output == "structured":
+        result["lines"] = lines_as_arrays(lines) if fmt == "msgpack" else lines_as_objects(lines)
+    return result
+
+
+def encode(payload: Any, fmt: str) -> bytes:
+    if fmt == "msgpack":
+        return _msgpack().packb(payload, use_bin_type=True)
+    return json.dumps(payload).encode()
+
+
+def encode_stream_item(payload: Any, fmt: str) -> bytes:
+    """One item of a streamed response: an NDJSON line, or one of a sequence of msgpack objects"""
+    if fmt == "msgpack":
+        return _msgpack().packb(payload, use_bin_type=True)
+    return json.dumps(payload).encode() + b"\n"
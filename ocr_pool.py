@@ -0,0 +1,542 @@
+import asyncio
+import logging
+import math
+import multiprocessing
+import os
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from multiprocessing.managers import BaseManager
+from typing import Any, Callable, Dict, List, Optional, Sequence, Set, Tuple, Union
+
+import numpy as np
+
+from model_registry import ModelRegistry
+from ocr_engine import OCREngine
+from preprocess import PreprocessOptions, decode_image
+from shared_images import SharedImages, SharedImagesRef, open_shared_images
+from urls import code_urls, read_codes, url_shaped
+
+logger = logging.getLogger("paddleocr-api")
+
+# Each worker (thread or process) keeps its own model registry here
+_local = threading.local()
+
+
+def _worker_name() -> str:
+    return f"{os.getpid()}/{threading.current_thread().name}"
+
+
+def parse_cpu_sets(spec: str, workers: int) -> Optional[List[Set[int]]]:
+    """CPU set for each worker from ``OCR_CPU_AFFINITY``.
+
+    ``auto`` splits the CPUs this process may use evenly between the
+    workers; ``"0-7;8-15"`` lists one set per worker (reused round robin
+    when there are more workers than sets). Empty means no pinning.
+    """
+    spec = (spec or "").strip()
+    if not spec:
+        return None
+    if spec == "auto":
+        cpus = sorted(os.sched_getaffinity(0))
+        per_worker = max(1, len(cpus) // workers)
+        return [set(cpus[(idx * per_worker) % len(cpus):][:per_worker]) for idx in range(workers)]
+    cpu_sets = []
+    for part in spec.split(";"):
+        cpus = set()
+        for item in part.split(","):
+            try:
+                if "-" in item:
+                    first, last = item.split("-")
+                    cpus.update(range(int(first), int(last) + 1))
+                elif item.strip():
+                    cpus.add(int(item))
+            except ValueError:
+                raise ValueError(f"Invalid CPU list '{part}', expected e.g. 0-3,8")
+        if cpus:
+            cpu_sets.append(cpus)
+    return cpu_sets or None
+
+
+def _configure_worker(index: int, threads: int = 0, cpu_sets: Optional[Sequence[Set[int]]] = None):
+    """Pin this worker to its CPU set and cap the threads each inference may use"""
+    if cpu_sets:
+        cpus = cpu_sets[index % len(cpu_sets)]
+        # pid 0 is the calling thread, so thread workers are pinned individually too
+        os.sched_setaffinity(0, cpus)
+        logger.info(f"OCR worker {_worker_name()} pinned to CPUs {sorted(cpus)}")
+    if threads > 0:
+        # Read by the inference libraries when they are first imported in this process
+        for name in ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS"):
+            os.environ[name] = str(threads)
+        import cv2
+        cv2.setNumThreads(threads)
+
+
+def _init_worker(engine: str, engine_options: Dict[str, Any], warmup_rounds: int = 0,
+                 memory_budget_mb: float = 1024, threads: int = 0,
+                 cpu_sets: Optional[Sequence[Set[int]]] = None, counter=None, barrier=None):
+    """Worker initializer: load a private OCR engine for the default language and warm it up.
+
+    Workers run this concurrently as they are spawned, so several engines
+    load in parallel. Other languages are loaded on demand later.
+    ``counter`` is a shared integer that hands each worker its index for
+    CPU pinning; ``barrier`` is the one :func:`startup_ping` waits on.
+    """
+    _local.load_time = _local.warmup_time = 0.0
+    _local.registry = None
+    _local.barrier = barrier
+    try:
+        index = 0
+        if counter is not None:
+            with counter.get_lock():
+                index = counter.value
+                counter.value += 1
+        _configure_worker(index, threads, cpu_sets)
+        registry = ModelRegistry(engine, engine_options, memory_budget_mb)
+        _local.default_lang = engine_options.get("lang", "en")
+        start = time.perf_counter()
+        default_engine, _ = registry.get(_local.default_lang)
+        _local.load_time = time.perf_counter() - start
+        if warmup_rounds > 0:
+            _local.warmup_time = default_engine.warmup(warmup_rounds)
+        _local.registry = registry
+        logger.info(f"OCR engine '{engine}' initialized in worker {_worker_name()}: "
+                    f"load {_local.load_time:.2f}s, warmup {_local.warmup_time:.2f}s")
+    except Exception as e:
+        logger.error(f"Error initializing OCR engine '{engine}': {str(e)}")
+        logger.error(traceback.format_exc())
+        _local.registry = None
+
+
+def _get_engine(lang: Optional[str] = None) -> Tuple[OCREngine, Dict[str, Any]]:
+    """Engine for ``lang`` (the worker's default when None) plus the registry event"""
+    if getattr(_local, "registry", None) is None:
+        raise Exception("OCR engine not initialized properly")
+    return _local.registry.get(lang or _local.default_lang)
+
+
+def ping() -> Dict[str, Any]:
+    """Report whether this worker has a usable OCR engine and how long it took to load"""
+    return {
+        "worker": _worker_name(),
+        "ready": getattr(_local, "registry", None) is not None,
+        "load_time": getattr(_local, "load_time", 0.0),
+        "warmup_time": getattr(_local, "warmup_time", 0.0),
+    }
+
+
+def startup_ping() -> Dict[str, Any]:
+    """:func:`ping`, once every worker sharing this worker's barrier has initialized.
+
+    A worker waiting on the barrier cannot take another task, so of one
+    ``startup_ping`` per worker each worker answers exactly one, however
+    fast it loaded: the reports then cover the whole pool.
+    """
+    barrier = getattr(_local, "barrier", None)
+    if barrier is not None:
+        barrier.wait()
+    return ping()
+
+
+def start_workers(executor, workers: int) -> List[Dict[str, Any]]:
+    """Spawn all ``workers`` of an executor made with a ``barrier`` for as many parties, and collect their :func:`ping` reports"""
+    # Submitting one task per worker while none are idle spawns all of
+    # them at once, so their engines load and warm up in parallel
+    futures = [executor.submit(startup_ping) for _ in range(workers)]
+    return [f.result() for f in futures]
+
+
+def run_ocr(image_bytes: bytes, cls: bool = True, options: PreprocessOptions = PreprocessOptions(),
+            lang: Optional[str] = None) -> Dict[str, Any]:
+    """Decode the image and run the OCR engine on it (executed inside a worker)"""
+    result = run_ocr_batch([image_bytes], cls, [options], lang)["results"][0]
+    if isinstance(result, Exception):
+        raise result
+    return result
+
+
+def _to_original(box, x: float, y: float, scale: float) -> List[List[int]]:
+    """Corners found in a decoded image, in pixels of the original upload"""
+    return np.rint((np.asarray(box, dtype=np.float64) + (x, y)) / scale).astype(int).tolist()
+
+
+def run_ocr_batch(images_bytes: List[bytes], cls: bool = True,
+                  options: Optional[List[PreprocessOptions]] = None,
+                  lang: Optional[str] = None) -> Dict[str, Any]:
+    """OCR several uploads of the same language in one pass (executed inside a worker).
+
+    Returns ``{"results": [...], "model": event, "timings": {stage: [seconds]}}``.
+    Each result is either ``{"text", "lines", "transforms"}`` or the
+    exception raised for that image, so one bad upload does not fail the
+    whole batch. ``lines`` are ``[box, text, confidence]`` with the box's
+    four corners in original image pixels. Uploads with ``urls_only`` also
+    get the QR codes and barcodes found in them as ``codes``, and are not
+    recognized at all when a code holds a URL. Uploads whose ``task`` is
+    ``detect`` get ``{"boxes", "transforms"}`` instead, and ``recognize``
+    ones ``{"text", "confidence", "transforms"}``; the line images of a
+    batch are all recognized in one pass.
+    ``model`` tells whether the language had to be loaded (or others
+    evicted) to serve the batch, and ``timings`` holds the duration of every
+    decode and engine stage call.
+    """
+    engine, model_event = _get_engine(lang)
+    options = options or [PreprocessOptions()] * len(images_bytes)
+    results: List[Union[Dict[str, Any], Exception]] = [None] * len(images_bytes)
+    timings: Dict[str, List[float]] = {"decode": []}
+    # (images, owners, origins) to recognize in full, and in URL-shaped boxes only
+    groups = {False: ([], [], []), True: ([], [], [])}
+    detect_only = ([], [], [])
+    recognize_only = ([], [])  # (line images, owners)
+    for idx, (image_bytes, image_options) in enumerate(zip(images_bytes, options)):
+        start = time.perf_counter()
+        try:
+            # One upload may become several images when ROIs are requested
+            decoded, transforms, image_origins = decode_image(image_bytes, image_options)
+        except Exception as e:
+            results[idx] = e
+            continue
+        finally:
+            timings["decode"].append(time.perf_counter() - start)
+        if image_options.task == "detect":
+            results[idx] = {"boxes": [], "transforms": transforms}
+            detect_only[0].extend(decoded)
+            detect_only[1].extend([idx] * len(decoded))
+            detect_only[2].extend(image_origins)
+            continue
+        if image_options.task == "recognize":
+            results[idx] = {"text": "", "confidence": 0.0, "transforms": transforms}
+            recognize_only[0].extend(decoded[:1])
+            recognize_only[1].extend([idx] * len(decoded[:1]))
+            continue
+        results[idx] = {"text": [], "lines": [], "transforms": transforms}
+        if image_options.urls_only:
+            start = time.perf_counter()
+            codes = []
+            for image, (x, y, scale) in zip(decoded, image_origins):
+                for code in read_codes(image):
+                    code["box"] = _to_original(code["box"], x, y, scale)
+                    codes.append(code)
+            timings.setdefault("codes", []).append(time.perf_counter() - start)
+            results[idx]["codes"] = codes
+            if code_urls(codes):
+                continue
+        images, owners, origins = groups[image_options.urls_only]
+        images.extend(decoded)
+        owners.extend([idx] * len(decoded))
+        origins.extend(image_origins)
+
+    for urls_only, (images, owners, origins) in groups.items():
+        if not images:
+            continue
+        recognized = engine.ocr(images, cls, timings, url_shaped if urls_only else None)
+        for idx, (x, y, scale), lines in zip(owners, origins, recognized):
+            for box, text, score in lines:
+                results[idx]["lines"].append([_to_original(box, x, y, scale), text, round(score, 4)])
+                results[idx]["text"].append(text)  # 取得辨識文字
+    images, owners, origins = detect_only
+    if images:
+        for idx, (x, y, scale), boxes in zip(owners, origins, engine.detect_boxes(images, timings)):
+            results[idx]["boxes"].extend(_to_original(box, x, y, scale) for box in boxes)
+    crops, owners = recognize_only
+    if crops:
+        for idx, (text, score) in zip(owners, engine.recognize_crops(crops, cls, timings)):
+            results[idx].update(text=text, confidence=round(score, 4))
+    for result in results:
+        if isinstance(result, dict) and "lines" in result:
+            result["text"] = " ".join(result["text"])
+    return {"results": results, "model": model_event, "timings": timings}
+
+
+def run_ocr_batch_shared(ref: SharedImagesRef, cls: bool = True,
+                         options: Optional[List[PreprocessOptions]] = None,
+                         lang: Optional[str] = None, foreign: bool = False) -> Dict[str, Any]:
+    """:func:`run_ocr_batch` on uploads handed over in shared memory (executed inside a worker)"""
+    with open_shared_images(ref, foreign) as images_bytes:
+        output = run_ocr_batch(images_bytes, cls, options, lang)
+        for result in output["results"]:
+            if isinstance(result, Exception):
+                # The traceback's frames still reference the shared buffers
+                result.__traceback__ = None
+        return output
+
+
+class PoolBusyError(Exception):
+    """Raised when the admission queue of the worker pool is full"""
+
+    def __init__(self, retry_after: int):
+        super().__init__(f"OCR queue is full, retry after {retry_after} seconds")
+        self.retry_after = retry_after
+
+    def __reduce__(self):
+        # Raised across processes by the OCR server
+        return PoolBusyError, (self.retry_after,)
+
+
+class OCRWorkerPool:
+    """Bounded pool of OCR workers with an admission queue.
+
+    At most ``workers`` jobs run at once and at most ``max_queue`` more may
+    wait for a free worker; anything beyond that is rejected immediately
+    with :class:`PoolBusyError` instead of piling up on the event loop.
+    In process mode uploads reach the workers through shared memory.
+    """
+
+    def __init__(self, workers: int = 2, mode: str = "thread", max_queue: int = 16,
+                 engine: str = "paddle", engine_options: Optional[Dict[str, Any]] = None,
+                 warmup_rounds: int = 1, memory_budget_mb: float = 1024,
+                 threads: int = 0, cpu_affinity: str = ""):
+        if mode not in ("thread", "process"):
+            raise ValueError(f"Unknown pool mode: {mode}")
+        self.workers = max(1, workers)
+        self.mode = mode
+        self.max_queue = max(0, max_queue)
+        self.engine = engine
+        self.engine_options = engine_options or {}
+        self.warmup_rounds = warmup_rounds
+        self.memory_budget_mb = memory_budget_mb
+        self.threads = threads
+        self.cpu_sets = parse_cpu_sets(cpu_affinity, self.workers)
+        self.ready = False
+        self.startup: Dict[str, Any] = {}
+        self._executor = None
+        self._lock = threading.Lock()
+        self._pending = 0  # running + queued
+        self._avg_service_time = 1.0  # seconds, exponentially weighted
+        self._completed = 0
+        self._rejected = 0
+
+    @property
+    def capacity(self) -> int:
+        return self.workers + self.max_queue
+
+    @property
+    def queued(self) -> int:
+        return max(0, self._pending - self.workers)
+
+    @property
+    def idle(self) -> int:
+        """Workers with nothing to run"""
+        return max(0, self.workers - self._pending)
+
+    def start(self) -> Dict[str, Any]:
+        """Create the executor and eagerly load (and warm up) one engine per worker.
+
+        Blocks until every worker has reported back and returns startup
+        timings; ``ready`` is only set once all workers are usable.
+        """
+        start = time.perf_counter()
+        context = multiprocessing.get_context("spawn")
+        barrier = context.Barrier(self.workers) if self.mode == "process" else threading.Barrier(self.workers)
+        init_args = (self.engine, self.engine_options, self.warmup_rounds, self.memory_budget_mb,
+                     self.threads, self.cpu_sets, context.Value("i", 0), barrier)
+        if self.mode == "process":
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=context,
+                initializer=_init_worker,
+                initargs=init_args,
+            )
+        else:
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.workers,
+                thread_name_prefix="ocr-worker",
+                initializer=_init_worker,
+                initargs=init_args,
+            )
+        reports = []
+        try:
+            reports = start_workers(self._executor, self.workers)
+            self.ready = all(report["ready"] for report in reports)
+        except Exception as e:
+            logger.error(f"Error starting OCR workers: {str(e)}")
+            self.ready = False
+
+        self.startup = {
+            "startup_time": time.perf_counter() - start,
+            "max_load_time": max((r["load_time"] for r in reports), default=0.0),
+            "max_warmup_time": max((r["warmup_time"] for r in reports), default=0.0),
+        }
+        logger.info(f"OCR pool started: {self.workers} {self.mode} workers, queue size {self.max_queue}, "
+                    f"ready={self.ready}, startup {self.startup['startup_time']:.2f}s "
+                    f"(engine load {self.startup['max_load_time']:.2f}s, warmup {self.startup['max_warmup_time']:.2f}s)")
+        return self.startup
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+        self.ready = False
+
+    def retry_after(self) -> int:
+        """Rough number of seconds until a queue slot frees up"""
+        waves = (self.queued + 1) / self.workers
+        return max(1, math.ceil(self._avg_service_time * waves))
+
+    def _admit(self):
+        if self._executor is None:
+            raise Exception("OCR worker pool is not running")
+        with self._lock:
+            if self._pending >= self.capacity:
+                self._rejected += 1
+                raise PoolBusyError(self.retry_after())
+            self._pending += 1
+
+    def _release(self, elapsed: float):
+        with self._lock:
+            self._pending -= 1
+            self._completed += 1
+            self._avg_service_time = 0.8 * self._avg_service_time + 0.2 * elapsed
+
+    async def submit(self, fn: Callable, *args) -> Any:
+        """Run ``fn(*args)`` on a worker, or raise PoolBusyError if the queue is full"""
+        self._admit()
+        start = time.perf_counter()
+        try:
+            return await asyncio.wrap_future(self._executor.submit(fn, *args))
+        finally:
+            self._release(time.perf_counter() - start)
+
+    def run(self, fn: Callable, *args) -> Any:
+        """Blocking :meth:`submit` for callers outside an event loop (the OCR server)"""
+        self._admit()
+        start = time.perf_counter()
+        try:
+            return self._executor.submit(fn, *args).result()
+        finally:
+            self._release(time.perf_counter() - start)
+
+    async def run_batch(self, images: List[Any], cls: bool, options: List[PreprocessOptions],
+                        lang: Optional[str] = None) -> Dict[str, Any]:
+        """Run :func:`run_ocr_batch` on a worker, moving the uploads to it the cheapest way"""
+        if self.mode != "process":
+            return await self.submit(run_ocr_batch, images, cls, options, lang)
+        # Upload buffers (memoryview/mmap) cannot be pickled to another process, and
+        # pickling copies them several times; one copy into shared memory is enough
+        with SharedImages(images) as shared:
+            return await self.submit(run_ocr_batch_shared, shared.ref, cls, options, lang)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "engine": self.engine,
+            "mode": self.mode,
+            "workers": self.workers,
+            "max_queue": self.max_queue,
+            "in_flight": min(self._pending, self.workers),
+            "queued": self.queued,
+            "completed": self._completed,
+            "rejected": self._rejected,
+        }
+
+
+class OCRServerManager(BaseManager):
+    """Connection to an ``ocr_server.py`` process (see :class:`RemoteOCRPool`)"""
+
+
+OCRServerManager.register("get_service")
+
+
+def parse_address(address: str) -> Union[str, Tuple[str, int]]:
+    """``host:port`` for TCP, anything else is a Unix socket path"""
+    host, _, port = address.rpartition(":")
+    if host and port.isdigit():
+        return host, int(port)
+    return address
+
+
+class RemoteOCRPool:
+    """OCR worker pool owned by a separate ``ocr_server.py`` process.
+
+    Several HTTP front-end processes (``uvicorn --workers N``) share one set
+    of OCR processes, so the models are loaded once per OCR process instead
+    of once per front-end. Uploads go to the OCR processes through shared
+    memory; only their location is sent over the connection. Admission
+    control (queue size, Retry-After) is enforced by the server for all
+    front-ends together.
+    """
+
+    mode = "remote"
+
+    def __init__(self, address: str, authkey: str, connect_timeout: float = 300):
+        self.address = address
+        self.authkey = authkey
+        self.connect_timeout = connect_timeout
+        self.engine = "remote"
+        self.workers = 1
+        self.ready = False
+        self.startup: Dict[str, Any] = {}
+        self._service = None
+        self._pending = 0  # this front-end's calls in progress, only touched from the event loop
+        self._completed = 0
+        self._rejected = 0
+
+    @property
+    def queued(self) -> int:
+        return max(0, self._pending - self.workers)
+
+    @property
+    def idle(self) -> int:
+        """The server's workers this front-end is not using; other front-ends may share them"""
+        return max(0, self.workers - self._pending)
+
+    def start(self) -> Dict[str, Any]:
+        """Connect to the OCR server, waiting for it to come up and finish loading models"""
+        start = time.perf_counter()
+        deadline = time.monotonic() + self.connect_timeout
+        while True:
+            try:
+                manager = OCRServerManager(address=parse_address(self.address), authkey=self.authkey.encode())
+                manager.connect()
+                self._service = manager.get_service()
+                info = self._service.info()
+                if info["ready"] or time.monotonic() > deadline:
+                    break
+            except (ConnectionError, FileNotFoundError, EOFError) as e:
+                if time.monotonic() > deadline:
+                    logger.error(f"Could not reach OCR server at {self.address}: {str(e)}")
+                    return self.startup
+            time.sleep(1)
+
+        self.engine = info["engine"]
+        self.workers = info["workers"]
+        self.ready = info["ready"]
+        self.startup = {**info["startup"], "connect_time": time.perf_counter() - start}
+        logger.info(f"Connected to OCR server at {self.address}: {self.workers} workers, ready={self.ready}")
+        return self.startup
+
+    def shutdown(self):
+        self._service = None
+        self.ready = False
+
+    def retry_after(self) -> int:
+        return 1
+
+    async def run_batch(self, images: List[Any], cls: bool, options: List[PreprocessOptions],
+                        lang: Optional[str] = None) -> Dict[str, Any]:
+        """Run :func:`run_ocr_batch` on one of the server's OCR processes"""
+        if self._service is None:
+            raise Exception("OCR server is not connected")
+        self._pending += 1
+        try:
+            with SharedImages(images) as shared:
+                # Proxies open one connection per thread, so calls run concurrently
+                return await asyncio.to_thread(self._service.run_batch, shared.ref, cls, options, lang)
+        except PoolBusyError:
+            self._rejected += 1
+            raise
+        finally:
+            self._pending -= 1
+            self._completed += 1
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "engine": self.engine,
+            "mode": self.mode,
+            "address": self.address,
+            "workers": self.workers,
+            "in_flight": min(self._pending, self.workers),
+            "queued": self.queued,
+            "completed": self._completed,
+            "rejected": self._rejected,
+        }
@@ -0,0 +1,113 @@
+import argparse
+import logging
+import os
+import signal
+import stat
+import sys
+import threading
+from typing import Any, Dict, List, Optional
+
+from log_setup import setup_logging
+from ocr_engine import engine_options_from_env
+from ocr_pool import OCRServerManager, OCRWorkerPool, parse_address, run_ocr_batch_shared
+from preprocess import PreprocessOptions
+from runtime_config import describe, engine_kwargs, load_runtime_config, parse_threads
+from shared_images import SharedImagesRef
+
+setup_logging(level=os.environ.get("LOG_LEVEL", "INFO"), fmt=os.environ.get("LOG_FORMAT", "json"), file=None)
+logger = logging.getLogger("paddleocr-api")
+
+DEFAULT_AUTHKEY = "paddleocr"
+
+
+class OCRService:
+    """What front-ends call through their :class:`ocr_pool.RemoteOCRPool`.
+
+    Each front-end connection is served on its own thread; the process pool
+    behind it bounds how many batches run and wait at once.
+    """
+
+    def __init__(self, pool: OCRWorkerPool):
+        self.pool = pool
+
+    def info(self) -> Dict[str, Any]:
+        return {
+            "engine": self.pool.engine,
+            "workers": self.pool.workers,
+            "ready": self.pool.ready,
+            "startup": self.pool.startup,
+            "stats": self.pool.stats(),
+        }
+
+    def run_batch(self, ref: SharedImagesRef, cls: bool, options: List[PreprocessOptions],
+                  lang: Optional[str] = None) -> Dict[str, Any]:
+        if not self.pool.ready:
+            raise Exception("OCR server is still starting")
+        # The segment belongs to the calling API process, not to this process tree
+        return self.pool.run(run_ocr_batch_shared, ref, cls, options, lang, True)
+
+
+def main():
+    env = os.environ
+    parser = argparse.ArgumentParser(description="Pool of OCR processes shared by several API front-end processes")
+    parser.add_argument("--address", default=env.get("OCR_SERVER_ADDRESS", "ocr_server.sock"),
+                        help="host:port, or a Unix socket path")
+    parser.add_argument("--workers", type=int, default=int(env.get("OCR_WORKERS", "2")), help="OCR processes")
+    parser.add_argument("--queue-size", type=int, default=int(env.get("OCR_QUEUE_SIZE", "16")),
+                        help="Batches allowed to wait for a free OCR process, across all front-ends")
+    parser.add_argument("--engine", default=env.get("OCR_ENGINE", "paddle"), help="paddle or fake")
+    parser.add_argument("--lang", default=env.get("OCR_LANG", "en"), help="Language every OCR process loads at startup")
+    parser.add_argument("--model-memory-mb", type=float, default=float(env.get("OCR_MODEL_MEMORY_MB", "1024")),
+                        help="Per-process memory budget for loaded language models")
+    parser.add_argument("--warmup-rounds", type=int, default=int(env.get("OCR_WARMUP_ROUNDS", "1")))
+    parser.add_argument("--threads", default=None,
+                        help="Intra-op threads per OCR process, or auto (default: OCR_THREADS; 0 keeps the library default)")
+    parser.add_argument("--cpu-affinity", default=env.get("OCR_CPU_AFFINITY", ""),
+                        help='"auto" to split the CPUs between OCR processes, or one list per process: "0-7;8-15"')
+    args = parser.parse_args()
+
+    authkey = env.get("OCR_SERVER_AUTHKEY", DEFAULT_AUTHKEY)
+    if authkey == DEFAULT_AUTHKEY:
+        logger.warning("OCR_SERVER_AUTHKEY is not set; anyone who can reach the server address can use it")
+
+    runtime = load_runtime_config(env, args.workers)
+    if args.threads is not None:
+        runtime = runtime._replace(threads=parse_threads(args.threads, args.workers))
+    engine_options = {"lang": args.lang, "use_angle_cls": True}
+    if args.engine == "fake":
+        engine_options.update(engine_options_from_env(env))
+    else:
+        engine_options.update(engine_kwargs(runtime))
+        logger.info(f"OCR inference runtime: {describe(runtime)}")
+    pool = OCRWorkerPool(
+        workers=args.workers,
+        mode="process",
+        max_queue=args.queue_size,
+        engine=args.engine,
+        engine_options=engine_options,
+        warmup_rounds=args.warmup_rounds,
+        memory_budget_mb=args.model_memory_mb,
+        threads=runtime.threads,
+        cpu_affinity=args.cpu_affinity,
+    )
+    service = OCRService(pool)
+
+    address = parse_address(args.address)
+    if isinstance(address, str) and os.path.exists(address) and stat.S_ISSOCK(os.stat(address).st_mode):
+        os.unlink(address)  # Left behind by a previous run
+    OCRServerManager.register("get_service", callable=lambda: service)
+    server = OCRServerManager(address=address, authkey=authkey.encode()).get_server()
+
+    # Accept connections right away; front-ends wait until the models are loaded
+    threading.Thread(target=pool.start, name="ocr-pool-start", daemon=True).start()
+    logger.info(f"OCR server listening on {args.address}")
+    # Stop the OCR processes (and free their semaphores) on SIGTERM as on Ctrl+C
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    try:
+        server.serve_forever()
+    finally:
+        pool.shutdown()
+
+
+if __name__ == "__main__":
+    main()
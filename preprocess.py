@@ -0,0 +1,163 @@
+import struct
+from typing import List, NamedTuple, Optional, Tuple
+
+import cv2
+import numpy as np
+
+# cv2 flags for decoding a JPEG directly at 1/2, 1/4 or 1/8 resolution
+REDUCED_COLOR_FLAGS = {2: cv2.IMREAD_REDUCED_COLOR_2, 4: cv2.IMREAD_REDUCED_COLOR_4, 8: cv2.IMREAD_REDUCED_COLOR_8}
+REDUCED_GRAY_FLAGS = {2: cv2.IMREAD_REDUCED_GRAYSCALE_2, 4: cv2.IMREAD_REDUCED_GRAYSCALE_4, 8: cv2.IMREAD_REDUCED_GRAYSCALE_8}
+
+# JPEG start-of-frame markers, which carry the image dimensions
+_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+
+class PreprocessOptions(NamedTuple):
+    """How an upload is prepared before inference.
+
+    ``max_side`` of 0 keeps the full resolution. ``rois`` are
+    ``(x, y, width, height)`` rectangles in original image pixels; when
+    given, only those regions are recognized. ``urls_only`` reads QR codes
+    and barcodes first and recognizes only text boxes shaped like a URL.
+    ``tile`` lets the API split an image larger than its tile size into
+    overlapping tiles, OCR'd separately (see tiling.py); workers ignore it.
+    ``task`` is ``ocr`` for the full pipeline, ``detect`` to only find the
+    text boxes, or ``recognize`` to read the whole image as one text line.
+    """
+    max_side: int = 0
+    grayscale: bool = False
+    rois: Tuple[Tuple[int, int, int, int], ...] = ()
+    urls_only: bool = False
+    tile: bool = False
+    task: str = "ocr"
+
+
+def parse_rois(value: Optional[str]) -> Tuple[Tuple[int, int, int, int], ...]:
+    """Parse ``"x,y,w,h;x,y,w,h"`` into ROI tuples"""
+    if not value:
+        return ()
+    rois = []
+    for part in value.split(";"):
+        if not part.strip():
+            continue
+        try:
+            numbers = [int(float(n)) for n in part.split(",")]
+        except ValueError:
+            numbers = []
+        if len(numbers) != 4 or numbers[2] <= 0 or numbers[3] <= 0 or min(numbers) < 0:
+            raise ValueError(f"Invalid ROI '{part}', expected x,y,width,height")
+        rois.append(tuple(numbers))
+    return tuple(rois)
+
+
+def jpeg_size(data) -> Optional[Tuple[int, int]]:
+    """Read ``(width, height)`` from a JPEG header without decoding it"""
+    view = memoryview(data)
+    if len(view) < 4 or view[0] != 0xFF or view[1] != 0xD8:
+        return None
+    pos = 2
+    while pos + 9 < len(view):
+        if view[pos] != 0xFF:
+            return None
+        marker = view[pos + 1]
+        if marker == 0xFF:  # Fill byte
+            pos += 1
+            continue
+        length = struct.unpack(">H", view[pos + 2:pos + 4])[0]
+        if marker in _SOF_MARKERS:
+            height, width = struct.unpack(">HH", view[pos + 5:pos + 9])
+            return width, height
+        pos += 2 + length
+    return None
+
+
+def image_size(data) -> Optional[Tuple[int, int]]:
+    """``(width, height)`` of a JPEG, PNG or BMP upload from its header, None for other formats"""
+    view = memoryview(data)
+    if len(view) >= 24 and view[:8] == b"\x89PNG\r\n\x1a\n":
+        return struct.unpack(">II", view[16:24])
+    if len(view) >= 26 and view[:2] == b"BM":
+        width, height = struct.unpack("<ii", view[18:26])
+        return width, abs(height)
+    return jpeg_size(view)
+
+
+def _reduction_factor(size: Optional[Tuple[int, int]], max_side: int) -> int:
+    """Largest JPEG reduction that still leaves the long side at or above max_side"""
+    if not size or max_side <= 0:
+        return 1
+    long_side = max(size)
+    for factor in (8, 4, 2):
+        # A reduced decode rounds up
+        if -(-long_side // factor) >= max_side:
+            return factor
+    return 1
+
+
+def reduced_decode_factor(image_bytes, max_pixels: float) -> Optional[int]:
+    """Smallest reduction that decodes an upload within ``max_pixels``.
+
+    Only JPEGs can be decoded at 1/2, 1/4 or 1/8 resolution; other formats
+    decode whole, so for them it is 1 or nothing. None also when the size
+    cannot be read from the header.
+    """
+    size = image_size(image_bytes)
+    if size is None:
+        return None
+    width, height = size
+    for factor in ((1, 2, 4, 8) if jpeg_size(image_bytes) else (1,)):
+        if -(-width // factor) * -(-height // factor) <= max_pixels:
+            return factor
+    return None
+
+
+# Where a decoded image sits in the upload: (x, y, scale), so that a point p
+# of the image is at (p + (x, y)) / scale in original pixels
+ImageOrigin = Tuple[float, float, float]
+
+
+def decode_image(image_bytes, options: PreprocessOptions = PreprocessOptions()) -> Tuple[List[np.ndarray], List[str], List[ImageOrigin]]:
+    """Decode an upload and apply the preprocessing steps.
+
+    Returns the images to run OCR on (the whole page, or one per ROI), the
+    list of transforms that were applied and the origin of each image, to
+    map boxes found in it back to original image pixels.
+    """
+    transforms = []
+    factor = _reduction_factor(jpeg_size(image_bytes), options.max_side)
+    if factor > 1:
+        flag = (REDUCED_GRAY_FLAGS if options.grayscale else REDUCED_COLOR_FLAGS)[factor]
+        transforms.append(f"reduced_decode:1/{factor}")
+    else:
+        flag = cv2.IMREAD_GRAYSCALE if options.grayscale else cv2.IMREAD_COLOR
+
+    image = cv2.imdecode(np.frombuffer(image_bytes, np.uint8), flag)
+    if image is None:
+        raise ValueError("Could not decode image")
+    scale = 1.0 / factor
+
+    height, width = image.shape[:2]
+    if options.max_side > 0 and max(height, width) > options.max_side:
+        ratio = options.max_side / max(height, width)
+        image = cv2.resize(image, (max(1, round(width * ratio)), max(1, round(height * ratio))), interpolation=cv2.INTER_AREA)
+        scale *= ratio
+        transforms.append(f"downscale:{image.shape[1]}x{image.shape[0]}")
+
+    if options.grayscale:
+        # PaddleOCR models expect three channels
+        image = cv2.cvtColor(image, cv2.COLOR_GRAY2BGR)
+        transforms.append("grayscale")
+
+    if not options.rois:
+        return [image], transforms, [(0.0, 0.0, scale)]
+
+    crops, origins = [], []
+    height, width = image.shape[:2]
+    for x, y, w, h in options.rois:
+        x0, y0 = min(width, int(x * scale)), min(height, int(y * scale))
+        x1, y1 = min(width, int((x + w) * scale)), min(height, int((y + h) * scale))
+        if x1 > x0 and y1 > y0:
+            crops.append(image[y0:y1, x0:x1])
+            origins.append((float(x0), float(y0), scale))
+            transforms.append(f"crop:{x},{y},{w},{h}")
+    return crops, transforms, origins
@@ -0,0 +1,211 @@
+import asyncio
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, NamedTuple, Optional
+
+logger = logging.getLogger("paddleocr-api")
+
+
+class RateLimit(NamedTuple):
+    """``requests`` per ``window`` seconds, enforced as a token bucket.
+
+    The bucket holds up to ``requests`` tokens and refills continuously at
+    ``requests / window`` tokens per second, so a client may burst the full
+    allowance and then continues at the average rate.
+    """
+    requests: int
+    window: float
+
+    @property
+    def rate(self) -> float:
+        return self.requests / self.window
+
+
+def parse_rate_limits(value: Optional[str]) -> Dict[str, RateLimit]:
+    """Parse ``"key=requests/window,key2=requests/window"`` into per-key limits"""
+    limits = {}
+    for part in (value or "").split(","):
+        if not part.strip():
+            continue
+        try:
+            key, spec = part.rsplit("=", 1)
+            requests, window = spec.split("/")
+            limit = RateLimit(int(requests), float(window))
+        except ValueError:
+            limit = None
+        if limit is None or not key.strip() or limit.requests <= 0 or limit.window <= 0:
+            raise ValueError(f"Invalid rate limit '{part}', expected key=requests/window")
+        limits[key.strip()] = limit
+    return limits
+
+
+def _refill(tokens: float, updated: float, now: float, limit: RateLimit) -> float:
+    return min(float(limit.requests), tokens + max(0.0, now - updated) * limit.rate)
+
+
+class MemoryRateLimitBackend:
+    """Token buckets in a dict, private to this process.
+
+    Buckets are kept in least-recently-used order. A bucket that has not
+    been touched for ``idle_after`` seconds has refilled completely, which
+    is the same as not tracking the client at all, so it is dropped from
+    the front of the order. ``max_clients`` caps memory under a flood of
+    distinct keys; beyond it the least recently seen clients are forgotten
+    (and get a fresh bucket if they come back).
+    """
+
+    blocking = False
+
+    def __init__(self, idle_after: float, max_clients: int = 100_000):
+        self.idle_after = idle_after
+        self.max_clients = max(1, max_clients)
+        self._buckets: "OrderedDict[str, List[float]]" = OrderedDict()  # key -> [tokens, updated]
+        self._evicted = 0
+
+    def take(self, key: str, limit: RateLimit) -> float:
+        """Consume one token; returns 0 if allowed, else seconds until a token is available"""
+        now = time.monotonic()
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = [float(limit.requests), now]
+            self._evict(now)
+        else:
+            self._buckets.move_to_end(key)
+            bucket[0] = _refill(bucket[0], bucket[1], now, limit)
+            bucket[1] = now
+
+        if bucket[0] >= 1:
+            bucket[0] -= 1
+            return 0.0
+        return (1 - bucket[0]) / limit.rate
+
+    def _evict(self, now: float):
+        buckets = self._buckets
+        while buckets:
+            key, (_, updated) = next(iter(buckets.items()))
+            if len(buckets) <= self.max_clients and now - updated < self.idle_after:
+                break
+            del buckets[key]
+            self._evicted += 1
+
+    def stats(self) -> Dict[str, Any]:
+        return {"backend": "memory", "clients": len(self._buckets), "evicted": self._evicted}
+
+    def close(self):
+        pass
+
+
+class SqliteRateLimitBackend:
+    """Token buckets in a sqlite database shared by every process that opens it.
+
+    Each check is one short write transaction, so several uvicorn workers
+    on the same host enforce a single limit per client. Put the file on a
+    tmpfs (e.g. /dev/shm) to keep it off disk. If the database stays locked
+    longer than ``busy_timeout`` the request is allowed rather than stalled.
+    A check can wait that long for the lock and costs a write transaction
+    either way, so ``blocking`` tells callers to run it off the event loop.
+    """
+
+    blocking = True
+
+    def __init__(self, path: str, idle_after: float, busy_timeout: float = 0.05,
+                 cleanup_every: int = 1000):
+        self.path = path
+        self.idle_after = idle_after
+        self.cleanup_every = cleanup_every
+        self._calls = 0
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, timeout=busy_timeout, isolation_level=None, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute("CREATE TABLE IF NOT EXISTS buckets "
+                         "(key TEXT PRIMARY KEY, tokens REAL, updated REAL) WITHOUT ROWID")
+        logger.info(f"Rate limits shared through {path}")
+
+    def take(self, key: str, limit: RateLimit) -> float:
+        """Consume one token; returns 0 if allowed, else seconds until a token is available"""
+        # Wall clock, since monotonic clocks are not comparable across processes
+        now = time.time()
+        with self._lock:
+            try:
+                self._db.execute("BEGIN IMMEDIATE")
+                try:
+                    row = self._db.execute("SELECT tokens, updated FROM buckets WHERE key = ?", (key,)).fetchone()
+                    tokens = float(limit.requests) if row is None else _refill(row[0], row[1], now, limit)
+                    allowed = tokens >= 1
+                    if allowed:
+                        tokens -= 1
+                    self._db.execute("INSERT OR REPLACE INTO buckets VALUES (?, ?, ?)", (key, tokens, now))
+                    self._calls += 1
+                    if self._calls % self.cleanup_every == 0:
+                        self._db.execute("DELETE FROM buckets WHERE updated < ?", (now - self.idle_after,))
+                    self._db.execute("COMMIT")
+                except BaseException:
+                    self._db.execute("ROLLBACK")
+                    raise
+            except sqlite3.OperationalError as e:
+                logger.warning(f"Rate limit database busy, allowing request: {str(e)}")
+                return 0.0
+        return 0.0 if allowed else (1 - tokens) / limit.rate
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            clients = self._db.execute("SELECT COUNT(*) FROM buckets").fetchone()[0]
+        return {"backend": "sqlite", "path": self.path, "clients": clients}
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+class RateLimiter:
+    """Constant-time per-client rate limiter.
+
+    Clients are identified by an opaque key (an IP address or API key);
+    keys listed in ``overrides`` get their own limit, everything else
+    ``default``. State lives in a pluggable backend: in-process memory, or
+    sqlite to share limits between worker processes.
+    """
+
+    def __init__(self, default: RateLimit, overrides: Optional[Dict[str, RateLimit]] = None,
+                 backend: str = "memory", db_path: str = "rate_limit.sqlite3", max_clients: int = 100_000):
+        self.default = default
+        self.overrides = overrides or {}
+        # A bucket left alone this long is full again and can be forgotten
+        idle_after = max(limit.window for limit in [default, *self.overrides.values()])
+        if backend == "memory":
+            self.backend = MemoryRateLimitBackend(idle_after, max_clients)
+        elif backend == "sqlite":
+            self.backend = SqliteRateLimitBackend(db_path, idle_after)
+        else:
+            raise ValueError(f"Unknown rate limit backend: {backend}")
+
+    def limit_for(self, key: str) -> RateLimit:
+        return self.overrides.get(key, self.default)
+
+    def check(self, key: str) -> float:
+        """Count a request; returns 0 if allowed, else the seconds to wait before retrying"""
+        return self.backend.take(key, self.limit_for(key))
+
+    async def check_async(self, key: str) -> float:
+        """:meth:`check` for the event loop; a backend that may block runs on a worker thread"""
+        if self.backend.blocking:
+            return await asyncio.to_thread(self.check, key)
+        return self.check(key)
+
+    def is_rate_limited(self, client_id: str) -> bool:
+        return self.check(client_id) > 0
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "requests": self.default.requests,
+            "window_seconds": self.default.window,
+            "overrides": len(self.overrides),
+            **self.backend.stats(),
+        }
+
+    def close(self):
+        self.backend.close()
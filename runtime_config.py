@@ -0,0 +1,152 @@
+import json
+import os
+from typing import Any, Dict, Mapping, NamedTuple, Optional
+
+BACKENDS = ("paddle", "onnx")
+PRECISIONS = ("fp32", "fp16", "int8")
+
+
+class RuntimeConfig(NamedTuple):
+    """How each OCR worker runs inference.
+
+    ``threads`` is the intra-op thread count of one worker (0 keeps the
+    library default) and ``mkldnn`` turns oneDNN kernels on or off (None
+    keeps the default). ``ocr_version`` picks the PP-OCR generation, and the
+    ``*_model_dir`` fields a model variant: server or mobile models, or int8
+    quantized ("slim") ones. With ``backend="onnx"`` the same detection and
+    recognition models, exported to ONNX, run on ONNX Runtime; the model
+    dirs then name the ``.onnx`` files.
+    """
+    backend: str = "paddle"
+    threads: int = 0
+    mkldnn: Optional[bool] = None
+    precision: str = "fp32"
+    ocr_version: str = ""
+    det_model_dir: str = ""
+    rec_model_dir: str = ""
+    cls_model_dir: str = ""
+    rec_batch_num: int = 0
+    det_limit_side_len: int = 0
+
+
+# Environment variable for each field; they override the config file
+ENV_VARS = {
+    "backend": "OCR_BACKEND",
+    "threads": "OCR_THREADS",
+    "mkldnn": "OCR_MKLDNN",
+    "precision": "OCR_PRECISION",
+    "ocr_version": "OCR_VERSION",
+    "det_model_dir": "OCR_DET_MODEL_DIR",
+    "rec_model_dir": "OCR_REC_MODEL_DIR",
+    "cls_model_dir": "OCR_CLS_MODEL_DIR",
+    "rec_batch_num": "OCR_REC_BATCH_NUM",
+    "det_limit_side_len": "OCR_DET_LIMIT_SIDE_LEN",
+}
+
+
+def available_cpus() -> int:
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def parse_threads(value: Any, workers: int = 1) -> int:
+    """Thread count per worker; ``auto`` shares the CPUs this process may use between ``workers``"""
+    if isinstance(value, str) and value.strip().lower() == "auto":
+        return max(1, available_cpus() // max(1, workers))
+    try:
+        threads = int(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"Invalid thread count '{value}', expected a number or auto")
+    if threads < 0:
+        raise ValueError(f"Invalid thread count '{value}', expected a number or auto")
+    return threads
+
+
+def _parse_bool(value: Any) -> Optional[bool]:
+    if value is None or isinstance(value, bool):
+        return value
+    text = str(value).strip().lower()
+    if text in ("", "default"):
+        return None
+    if text in ("1", "true", "on", "yes"):
+        return True
+    if text in ("0", "false", "off", "no"):
+        return False
+    raise ValueError(f"Invalid switch '{value}', expected 1/0, on/off or default")
+
+
+def make_runtime_config(values: Mapping[str, Any], workers: int = 1) -> RuntimeConfig:
+    """Build and validate a config from raw values (strings from the environment, or JSON values)"""
+    unknown = set(values) - set(RuntimeConfig._fields)
+    if unknown:
+        raise ValueError(f"Unknown runtime settings: {', '.join(sorted(unknown))}")
+    config = RuntimeConfig()._replace(**values)
+    config = config._replace(
+        backend=str(config.backend).lower(),
+        threads=parse_threads(config.threads, workers),
+        mkldnn=_parse_bool(config.mkldnn),
+        precision=str(config.precision).lower(),
+        rec_batch_num=int(config.rec_batch_num or 0),
+        det_limit_side_len=int(config.det_limit_side_len or 0),
+    )
+    if config.backend not in BACKENDS:
+        raise ValueError(f"Unsupported backend '{config.backend}'. Supported: {', '.join(BACKENDS)}")
+    if config.precision not in PRECISIONS:
+        raise ValueError(f"Unsupported precision '{config.precision}'. Supported: {', '.join(PRECISIONS)}")
+    if config.backend == "onnx" and not (config.det_model_dir and config.rec_model_dir):
+        raise ValueError("The onnx backend needs the exported models: set det_model_dir and rec_model_dir "
+                         "(and cls_model_dir unless angle classification is off)")
+    return config
+
+
+def load_runtime_config(environ: Mapping[str, str] = os.environ, workers: int = 1) -> RuntimeConfig:
+    """Runtime settings from the JSON file named by ``OCR_RUNTIME_CONFIG``, overridden by ``OCR_*`` variables"""
+    values: Dict[str, Any] = {}
+    path = environ.get("OCR_RUNTIME_CONFIG", "")
+    if path:
+        with open(path) as f:
+            values.update(json.load(f))
+    for field, name in ENV_VARS.items():
+        if environ.get(name, "") != "":
+            values[field] = environ[name]
+    return make_runtime_config(values, workers)
+
+
+def engine_kwargs(config: RuntimeConfig) -> Dict[str, Any]:
+    """PaddleOCR constructor arguments for ``config``; settings left at their default are not passed"""
+    kwargs: Dict[str, Any] = {}
+    if config.threads > 0:
+        kwargs["cpu_threads"] = config.threads
+    if config.mkldnn is not None:
+        kwargs["enable_mkldnn"] = config.mkldnn
+    if config.precision != "fp32":
+        kwargs["precision"] = config.precision
+    for field in ("ocr_version", "det_model_dir", "rec_model_dir", "cls_model_dir", "rec_batch_num", "det_limit_side_len"):
+        value = getattr(config, field)
+        if value:
+            kwargs[field] = value
+    if config.backend == "onnx":
+        kwargs["use_onnx"] = True
+    return kwargs
+
+
+def onnx_session_options(threads: int = 0):
+    """ONNX Runtime session options with ``threads`` intra-op threads (built in the worker, they do not pickle)"""
+    try:
+        import onnxruntime
+    except ImportError:
+        raise ValueError("The onnx backend requires the onnxruntime package (pip install onnxruntime)")
+    options = onnxruntime.SessionOptions()
+    if threads > 0:
+        options.intra_op_num_threads = threads
+        options.inter_op_num_threads = 1
+    return options
+
+
+def describe(config: RuntimeConfig) -> str:
+    """Short label listing the settings that differ from the defaults"""
+    default = RuntimeConfig()
+    parts = [f"{field}={value}" for field, value in config._asdict().items() if value != getattr(default, field)]
+    return " ".join(parts) or "defaults"
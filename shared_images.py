@@ -0,0 +1,75 @@
+import sys
+from contextlib import contextmanager
+from multiprocessing import resource_tracker, shared_memory
+from typing import Iterator, List, Sequence, Tuple
+
+# What crosses the process boundary instead of the image data:
+# the segment name and each image's (offset, length) inside it
+SharedImagesRef = Tuple[str, List[Tuple[int, int]]]
+
+
+class SharedImages:
+    """Upload buffers copied into one shared memory segment for an OCR process.
+
+    Only the small ``ref`` is pickled to the worker, which reads the images
+    in place with :func:`open_shared_images`. The creating side owns the
+    segment and removes it on ``close()`` once the worker has answered.
+    """
+
+    def __init__(self, buffers: Sequence):
+        sizes = [len(buffer) for buffer in buffers]
+        self._shm = shared_memory.SharedMemory(create=True, size=max(1, sum(sizes)))
+        spans, offset = [], 0
+        for buffer, size in zip(buffers, sizes):
+            self._shm.buf[offset:offset + size] = buffer
+            spans.append((offset, size))
+            offset += size
+        self.ref: SharedImagesRef = (self._shm.name, spans)
+
+    def close(self):
+        if self._shm is None:
+            return
+        self._shm.close()
+        self._shm.unlink()
+        self._shm = None
+
+    def __enter__(self) -> "SharedImages":
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _attach(name: str, foreign: bool) -> shared_memory.SharedMemory:
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(name=name, track=False)
+    shm = shared_memory.SharedMemory(name=name)
+    if foreign:
+        # Before 3.13 attaching registers the segment with the resource tracker.
+        # Workers spawned by the creator share its tracker, where that is a
+        # harmless duplicate; any other tracker would keep the name forever and
+        # unlink it at exit, so take it back out.
+        resource_tracker.unregister(shm._name, "shared_memory")
+    return shm
+
+
+@contextmanager
+def open_shared_images(ref: SharedImagesRef, foreign: bool = False) -> Iterator[List[memoryview]]:
+    """Map a :class:`SharedImages` segment and yield a view of each image.
+
+    ``foreign`` tells that the segment was created outside this process tree
+    (by an API process talking to the OCR server).
+    """
+    name, spans = ref
+    shm = _attach(name, foreign)
+    views = [shm.buf[offset:offset + size] for offset, size in spans]
+    try:
+        yield views
+    finally:
+        try:
+            for view in views:
+                view.release()
+            shm.close()
+        except BufferError:
+            # Something still references the mapping; it is unmapped once that goes away
+            pass
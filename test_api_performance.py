@@ -1,174 +1,364 @@
-import time
-import requests
-import concurrent.futures
-import statistics
-import os
 import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+from collections import Counter
+from datetime import datetime
 from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+import httpx
 
 # API endpoint
 API_URL = "http://localhost:8000/upload/"
 
-def upload_image(image_path):
-    """Upload a single image and measure response time"""
-    start_time = time.time()
+IMAGE_PATTERNS = ("*.jpg", "*.jpeg", "*.png", "*.bmp", "*.webp")
+PERCENTILES = (50, 75, 90, 95, 99, 99.9, 99.99)
+# Compared against a baseline run by --baseline
+COMPARED_PERCENTILES = ("p50", "p90", "p99", "p99.9")
+
+# Random bytes appended to every upload, so each one misses the server's
+# result cache (decoders stop at the image's end marker and ignore them)
+NONCE_BYTES = 16
+
+
+def load_corpus(image: Optional[str], image_dir: Optional[str], limit: int = 0) -> List[Tuple[str, bytes]]:
+    """Read the test images into memory once, so disk reads do not skew the timings"""
+    if image:
+        paths = [Path(image)]
+    else:
+        paths = sorted(path for pattern in IMAGE_PATTERNS for path in Path(image_dir).glob(pattern))
+    if limit > 0:
+        paths = paths[:limit]
+    if not paths:
+        raise SystemExit(f"No test images found in {image or image_dir}")
+    return [(path.name, path.read_bytes()) for path in paths]
+
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    """Nearest-rank percentile of already sorted values"""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, int(-(-pct * len(sorted_values) // 100)))  # ceil
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def latency_summary(seconds: List[float]) -> Dict[str, float]:
+    """Percentiles in milliseconds, from exact values rather than buckets"""
+    values = sorted(seconds)
+    summary = {"count": len(values)}
+    if not values:
+        return summary
+    summary.update({f"p{pct:g}": percentile(values, pct) * 1000 for pct in PERCENTILES})
+    summary["min"] = values[0] * 1000
+    summary["max"] = values[-1] * 1000
+    summary["mean"] = sum(values) / len(values) * 1000
+    return summary
+
+
+def percentile_spectrum(seconds: List[float]) -> List[Tuple[float, float]]:
+    """HdrHistogram-style ``(percentile, ms)`` distribution, halving the remaining tail at each step"""
+    values = sorted(seconds)
+    spectrum, remaining = [], 100.0
+    while values and remaining >= 100.0 / len(values):
+        pct = 100.0 - remaining
+        spectrum.append((round(pct, 4), percentile(values, max(pct, 1e-9)) * 1000))
+        remaining /= 2
+    if values:
+        spectrum.append((100.0, values[-1] * 1000))
+    return spectrum
+
+
+async def send(client: httpx.AsyncClient, url: str, params: Dict[str, str], name: str, data: bytes,
+               intended: Optional[float] = None, unique: bool = True) -> Dict[str, Any]:
+    """POST one image; ``latency`` counts from ``intended`` (the scheduled send time) when given.
+
+    With ``unique`` the image gets a random suffix, so the server runs OCR
+    on it instead of answering from its cache.
+    """
+    result = {"image": name, "bytes": len(data)}
+    if unique:
+        data = data + os.urandom(NONCE_BYTES)
+    sent = time.perf_counter()
     try:
-        with open(image_path, "rb") as image_file:
-            files = {"file": (os.path.basename(image_path), image_file, "image/jpeg")}
-            response = requests.post(API_URL, files=files)
-        
-        end_time = time.time()
-        response_time = end_time - start_time
-        
-        if response.status_code == 200:
-            return {
-                "status": "success",
-                "response_time": response_time,
-                "text_length": len(response.json().get("text", "")),
-                "status_code": response.status_code
-            }
-        else:
-            return {
-                "status": "error",
-                "response_time": response_time,
-                "error": response.text,
-                "status_code": response.status_code
-            }
-    except Exception as e:
-        end_time = time.time()
-        return {
-            "status": "exception",
-            "response_time": end_time - start_time,
-            "error": str(e),
-            "status_code": 0
-        }
-
-def concurrent_test(image_path, num_requests, num_workers):
-    """Test API with concurrent requests"""
-    print(f"Starting concurrent test with {num_requests} requests using {num_workers} workers")
-    print(f"Testing image: {image_path}")
-    
+        response = await client.post(url, params=params, files={"file": (name, data, "application/octet-stream")})
+        result["status_code"] = response.status_code
+        if response.status_code != 200:
+            result["error"] = f"status_{response.status_code}"
+        elif response.headers.get("content-type", "").startswith("application/json"):
+            body = response.json()
+            # "miss" when OCR ran; anything else was answered from the cache
+            if "cache" in body:
+                result["cache"] = body["cache"]
+            # The API answers 200 with an "Error: ..." text when OCR itself fails
+            if str(body.get("text", "")).startswith("Error:"):
+                result["error"] = "ocr_error"
+    except (httpx.HTTPError, ValueError) as e:
+        result.setdefault("status_code", 0)
+        result["error"] = type(e).__name__
+    done = time.perf_counter()
+    result["service_time"] = done - sent
+    result["latency"] = done - (sent if intended is None else intended)
+    return result
+
+
+async def closed_loop(client, url, params, corpus, concurrency: int, requests: int, duration: float,
+                      rng: random.Random, unique: bool = True) -> List[Dict[str, Any]]:
+    """``concurrency`` virtual users, each sending its next request as soon as the last one returns"""
     results = []
-    start_time = time.time()
-    
-    # Use a thread pool to make concurrent requests
-    with concurrent.futures.ThreadPoolExecutor(max_workers=num_workers) as executor:
-        # Submit all tasks
-        futures = [executor.submit(upload_image, image_path) for _ in range(num_requests)]
-        
-        # Process results as they complete
-        for future in concurrent.futures.as_completed(futures):
-            results.append(future.result())
-            completed = len(results)
-            if completed % 5 == 0 or completed == num_requests:
-                print(f"Completed {completed}/{num_requests} requests")
-    
-    end_time = time.time()
-    
-    # Analyze results
-    total_time = end_time - start_time
-    success_count = sum(1 for r in results if r["status"] == "success")
-    error_count = len(results) - success_count
-    
-    response_times = [r["response_time"] for r in results if r["status"] == "success"]
-    
-    if response_times:
-        avg_response_time = statistics.mean(response_times)
-        min_response_time = min(response_times)
-        max_response_time = max(response_times)
-        p95_response_time = sorted(response_times)[int(len(response_times) * 0.95)]
-    else:
-        avg_response_time = min_response_time = max_response_time = p95_response_time = 0
-    
-    # Print summary
-    print("\n===== TEST RESULTS =====")
-    print(f"Total requests: {num_requests}")
-    print(f"Concurrent workers: {num_workers}")
-    print(f"Successful requests: {success_count} ({success_count/num_requests*100:.2f}%)")
-    print(f"Failed requests: {error_count} ({error_count/num_requests*100:.2f}%)")
-    print(f"Total test time: {total_time:.2f} seconds")
-    print(f"Request throughput: {num_requests/total_time:.2f} requests/second")
-    
-    if response_times:
-        print("\nResponse times (successful requests):")
-        print(f"  Average: {avg_response_time:.2f} seconds")
-        print(f"  Minimum: {min_response_time:.2f} seconds")
-        print(f"  Maximum: {max_response_time:.2f} seconds")
-        print(f"  95th percentile: {p95_response_time:.2f} seconds")
-    
-    # Print some error details if there were errors
-    if error_count > 0:
-        print("\nSample errors:")
-        for r in [r for r in results if r["status"] != "success"][:5]:  # Show up to 5 errors
-            print(f"  Status code: {r['status_code']}, Error: {r.get('error', 'Unknown error')[:100]}...")
-    
+    deadline = time.perf_counter() + duration if duration > 0 else None
+    counter = iter(range(requests)) if requests > 0 else None
+
+    async def user():
+        while True:
+            if deadline is not None and time.perf_counter() >= deadline:
+                return
+            if counter is not None and next(counter, None) is None:
+                return
+            name, data = corpus[rng.randrange(len(corpus))]
+            results.append(await send(client, url, params, name, data, unique=unique))
+
+    await asyncio.gather(*(user() for _ in range(concurrency)))
     return results
 
-def test_file_size_limits(directory, num_tests=3):
-    """Test API with different file sizes"""
+
+async def open_loop(client, url, params, corpus, rps: float, duration: float, arrival: str,
+                    max_in_flight: int, rng: random.Random, unique: bool = True) -> List[Dict[str, Any]]:
+    """Send at ``rps`` on a fixed schedule, whether or not earlier requests have returned.
+
+    Latency is measured from each request's scheduled time, so a server
+    that falls behind is charged for the queueing it causes (no
+    coordinated omission). Requests that would exceed ``max_in_flight`` are
+    counted as ``client_overloaded`` instead of being sent.
+    """
+    results, tasks = [], set()
+    start = time.perf_counter()
+    intended = start
+    while intended - start < duration:
+        delay = intended - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        name, data = corpus[rng.randrange(len(corpus))]
+        if len(tasks) >= max_in_flight:
+            results.append({"image": name, "bytes": len(data), "status_code": 0, "error": "client_overloaded",
+                            "latency": 0.0, "service_time": 0.0})
+        else:
+            task = asyncio.ensure_future(send(client, url, params, name, data, intended, unique))
+            task.add_done_callback(lambda done: (tasks.discard(done), results.append(done.result())))
+            tasks.add(task)
+        intended += rng.expovariate(rps) if arrival == "poisson" else 1.0 / rps
+    if tasks:
+        await asyncio.gather(*tasks)
+    return results
+
+
+def build_report(results: List[Dict[str, Any]], elapsed: float, config: Dict[str, Any]) -> Dict[str, Any]:
+    ok = [r for r in results if "error" not in r]
+    errors = Counter(r["error"] for r in results if "error" in r)
+    with_cache = [r for r in ok if "cache" in r]
+    cached = Counter(r["cache"] for r in with_cache if r["cache"] != "miss")
+    by_image = {}
+    for name in sorted({r["image"] for r in results}):
+        image_ok = [r["latency"] for r in ok if r["image"] == name]
+        summary = latency_summary(image_ok)
+        by_image[name] = {key: summary[key] for key in ("count", "p50", "p99") if key in summary}
+    return {
+        "config": config,
+        "elapsed_seconds": elapsed,
+        "requests": len(results),
+        "successes": len(ok),
+        "error_rate": (len(results) - len(ok)) / len(results) if results else 0.0,
+        "errors": dict(errors.most_common()),
+        "throughput_rps": len(results) / elapsed if elapsed else 0.0,
+        "goodput_rps": len(ok) / elapsed if elapsed else 0.0,
+        # Share of the responses reporting a cache status that did not run OCR
+        "cache_hit_rate": sum(cached.values()) / len(with_cache) if with_cache else None,
+        "cache_hits": dict(cached.most_common()),
+        "latency_ms": latency_summary([r["latency"] for r in ok]),
+        "service_time_ms": latency_summary([r["service_time"] for r in ok]),
+        "percentile_spectrum_ms": percentile_spectrum([r["latency"] for r in ok]),
+        "by_image": by_image,
+    }
+
+
+def print_report(report: Dict[str, Any]):
+    config = report["config"]
+    load = f"open loop at {config['rps']:g} req/s ({config['arrival']})" if config["rps"] \
+        else f"closed loop with {config['concurrency']} concurrent users"
+    print("\n===== TEST RESULTS =====")
+    print(f"{config['url']} {config['params'] or ''}, {load}, {config['images']} images")
+    print(f"Requests: {report['requests']} in {report['elapsed_seconds']:.2f}s "
+          f"(warmup of {config['warmup_seconds']:g}s excluded)")
+    print(f"Throughput: {report['throughput_rps']:.2f} req/s, goodput: {report['goodput_rps']:.2f} req/s")
+    print(f"Errors: {report['error_rate'] * 100:.2f}% {report['errors'] or ''}")
+    if report["cache_hit_rate"] is not None:
+        print(f"Served from cache: {report['cache_hit_rate'] * 100:.2f}% {report['cache_hits'] or ''}")
+    if report["cache_hit_rate"]:
+        print("WARNING: some responses came from the OCR result cache, so the latencies do not measure OCR alone. "
+              "Run the server with OCR_CACHE_SIZE=0" + ("" if config["unique"] else " or drop --allow-cache"))
+    latency = report["latency_ms"]
+    if latency["count"]:
+        print("\nLatency of successful requests (ms):")
+        print("| " + " | ".join(f"p{pct:g}" for pct in PERCENTILES) + " | max |")
+        print("|" + "------|" * (len(PERCENTILES) + 1))
+        print("| " + " | ".join(f"{latency[f'p{pct:g}']:.1f}" for pct in PERCENTILES) + f" | {latency['max']:.1f} |")
+    if len(report["by_image"]) > 1:
+        print("\n| Image | Requests | p50 (ms) | p99 (ms) |")
+        print("|-------|----------|----------|----------|")
+        for name, summary in report["by_image"].items():
+            print(f"| {name} | {summary['count']} | {summary.get('p50', 0):.1f} | {summary.get('p99', 0):.1f} |")
+
+
+def compare(report: Dict[str, Any], baseline: Dict[str, Any], threshold: float) -> List[str]:
+    """Describe every metric that got worse than ``baseline`` by more than ``threshold`` (0.1 = 10%)"""
+    regressions = []
+    for key in ("url", "params", "rps", "arrival", "concurrency", "images"):
+        if baseline["config"].get(key) != report["config"].get(key):
+            print(f"Note: {key} differs from the baseline ({baseline['config'].get(key)!r} vs {report['config'].get(key)!r})")
+    print("\n| Metric | Baseline | This run | Change |")
+    print("|--------|----------|----------|--------|")
+    rows = [(f"latency {key} (ms)", baseline["latency_ms"].get(key), report["latency_ms"].get(key), True)
+            for key in COMPARED_PERCENTILES]
+    rows.append(("goodput (req/s)", baseline["goodput_rps"], report["goodput_rps"], False))
+    for name, before, after, lower_is_better in rows:
+        if not before or after is None:
+            continue
+        change = (after - before) / before
+        print(f"| {name} | {before:.2f} | {after:.2f} | {change * 100:+.1f}% |")
+        if (change > threshold) if lower_is_better else (change < -threshold):
+            regressions.append(f"{name}: {before:.2f} -> {after:.2f} ({change * 100:+.1f}%)")
+    error_change = report["error_rate"] - baseline["error_rate"]
+    print(f"| error rate | {baseline['error_rate'] * 100:.2f}% | {report['error_rate'] * 100:.2f}% | {error_change * 100:+.2f} pt |")
+    if error_change > 0.01:
+        regressions.append(f"error rate: {baseline['error_rate'] * 100:.2f}% -> {report['error_rate'] * 100:.2f}%")
+    return regressions
+
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL,
+                                       cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def run_load_test(args) -> Dict[str, Any]:
+    corpus = load_corpus(args.image, args.image_dir, args.max_images)
+    params = dict(pair.split("=", 1) for pair in args.params.split("&")) if args.params else {}
+    in_flight = args.max_in_flight if args.rps else args.concurrency
+    limits = httpx.Limits(max_connections=in_flight, max_keepalive_connections=in_flight)
+    config = {
+        "url": args.url, "params": args.params, "rps": args.rps, "arrival": args.arrival,
+        "concurrency": args.concurrency, "requests": args.requests, "duration": args.duration,
+        "warmup_seconds": args.warmup, "images": len(corpus), "seed": args.seed, "unique": not args.allow_cache,
+        "started": datetime.now().isoformat(timespec="seconds"), "git_revision": git_revision(),
+    }
+    rng = random.Random(args.seed)
+    async with httpx.AsyncClient(limits=limits, timeout=args.timeout) as client:
+        try:
+            health = await client.get(args.url.split("/upload")[0].rstrip("/") + "/health")
+            # What served the run, so results from different setups are not compared blindly
+            config["server"] = {key: health.json().get(key) for key in ("status", "ocr_pool", "batching", "cache")}
+        except (httpx.HTTPError, ValueError):
+            config["server"] = None
+
+        async def phase(duration: float, requests: int):
+            if args.rps:
+                return await open_loop(client, args.url, params, corpus, args.rps, duration, args.arrival,
+                                       args.max_in_flight, rng, not args.allow_cache)
+            return await closed_loop(client, args.url, params, corpus, args.concurrency, requests, duration, rng,
+                                     not args.allow_cache)
+
+        if args.warmup > 0:
+            print(f"Warming up for {args.warmup:g}s...")
+            await phase(args.warmup, 0)
+        print("Measuring...")
+        start = time.perf_counter()
+        if args.rps:
+            results = await phase(args.duration or args.requests / args.rps, 0)
+        else:
+            results = await phase(args.duration, 0 if args.duration else args.requests)
+        elapsed = time.perf_counter() - start
+    return build_report(results, elapsed, config)
+
+
+async def test_file_size_limits(url: str, directory: str, num_tests: int = 3, timeout: float = 120):
+    """Send a few files spread over the size range one at a time"""
     print("\n===== FILE SIZE LIMIT TEST =====")
-    files = list(Path(directory).glob("*.jpg")) + list(Path(directory).glob("*.png")) + list(Path(directory).glob("*.jpeg"))
-    
+    files = sorted((path for pattern in IMAGE_PATTERNS for path in Path(directory).glob(pattern)),
+                   key=lambda path: path.stat().st_size)
     if not files:
         print(f"No image files found in {directory}")
         return
-    
-    # Sort files by size
-    files_with_size = [(f, f.stat().st_size) for f in files]
-    files_with_size.sort(key=lambda x: x[1])
-    
-    print(f"Testing {min(num_tests, len(files_with_size))} files of different sizes")
-    
-    # Test a sample of files with different sizes
-    test_files = []
-    if len(files_with_size) <= num_tests:
-        test_files = files_with_size
-    else:
-        # Select files distributed across the size range
-        step = len(files_with_size) // num_tests
-        for i in range(0, len(files_with_size), step):
-            if len(test_files) < num_tests:
-                test_files.append(files_with_size[i])
-    
-    results = []
-    for file_path, size in test_files:
-        size_kb = size / 1024
-        print(f"\nTesting file: {file_path.name} ({size_kb:.2f} KB)")
-        result = upload_image(str(file_path))
-        results.append((file_path, size, result))
-        
-        status = "✅ Success" if result["status"] == "success" else f"❌ Failed: {result.get('error', 'Unknown error')[:50]}..."
-        print(f"  Result: {status}")
-        print(f"  Response time: {result['response_time']:.2f} seconds")
-        
-        # Add a small delay between tests
-        time.sleep(1)
-    
-    # Print summary
-    print("\nFile Size Test Summary:")
+    step = max(1, len(files) // num_tests)
+    test_files = files[::step][:num_tests]
+    print(f"Testing {len(test_files)} files of different sizes")
     print("| File | Size (KB) | Status | Response Time (s) |")
     print("|------|-----------|--------|-------------------|")
-    for file_path, size, result in results:
-        size_kb = size / 1024
-        status = "Success" if result["status"] == "success" else "Failed"
-        print(f"| {file_path.name} | {size_kb:.2f} | {status} | {result['response_time']:.2f} |")
-    
-    return results
+    async with httpx.AsyncClient(timeout=timeout) as client:
+        for path in test_files:
+            result = await send(client, url, {}, path.name, path.read_bytes())
+            status = "Success" if "error" not in result else f"Failed ({result['error']})"
+            print(f"| {path.name} | {path.stat().st_size / 1024:.2f} | {status} | {result['latency']:.2f} |")
+
 
 def main():
-    parser = argparse.ArgumentParser(description="Test PaddleOCR API performance")
-    parser.add_argument("--image", type=str, help="Path to test image", default="test.jpg")
-    parser.add_argument("--requests", type=int, help="Number of requests to make", default=20)
-    parser.add_argument("--workers", type=int, help="Number of concurrent workers", default=5)
+    parser = argparse.ArgumentParser(
+        description="Load test the PaddleOCR API and record the results as JSON",
+        epilog="Run the server with OCR_CACHE_SIZE=0 (and no OCR_CACHE_DIR) so every request runs OCR, and with "
+               "RATE_LIMIT_REQUESTS raised well above the number of requests sent (the default allows 10 per 60 s "
+               "per client), e.g. OCR_CACHE_SIZE=0 RATE_LIMIT_REQUESTS=1000000 uvicorn main:app")
+    parser.add_argument("--url", default=API_URL, help="Endpoint receiving the uploads")
+    parser.add_argument("--params", default="", help='Query string added to every request, e.g. "mode=urls&lang=ch"')
+    parser.add_argument("--image", help="Send only this image")
+    parser.add_argument("--image-dir", default="./test_images", help="Send a random mix of the images in this directory")
+    parser.add_argument("--max-images", type=int, default=0, help="Use at most this many images from --image-dir")
+    parser.add_argument("--rps", type=float, default=0, help="Open loop: send at this rate regardless of responses")
+    parser.add_argument("--arrival", choices=("constant", "poisson"), default="poisson",
+                        help="Spacing of open-loop requests")
+    parser.add_argument("--max-in-flight", type=int, default=256, help="Open loop: requests outstanding at most")
+    parser.add_argument("--concurrency", "--workers", type=int, default=5,
+                        help="Closed loop: concurrent users, each waiting for its previous response")
+    parser.add_argument("--requests", type=int, default=100, help="Requests to measure (unless --duration is given)")
+    parser.add_argument("--duration", type=float, default=0, help="Seconds to measure")
+    parser.add_argument("--warmup", type=float, default=5, help="Seconds of load before measuring, excluded from results")
+    parser.add_argument("--timeout", type=float, default=120, help="Per-request timeout in seconds")
+    parser.add_argument("--seed", type=int, default=42, help="Seed for image choice and arrival times")
+    parser.add_argument("--allow-cache", action="store_true",
+                        help="Send the images unchanged, so repeats may be answered from the server's cache "
+                             "(by default each upload gets random trailing bytes and the run fails on cache hits)")
+    parser.add_argument("--output", help="Write the results to this JSON file")
+    parser.add_argument("--baseline", help="JSON results of an earlier run to compare with")
+    parser.add_argument("--max-regression", type=float, default=0.1,
+                        help="Relative worsening against --baseline that fails the run (default 0.1 = 10%%)")
     parser.add_argument("--test-size-limits", action="store_true", help="Test size limits with multiple files")
-    parser.add_argument("--image-dir", type=str, help="Directory containing test images", default="./test_images")
-    
     args = parser.parse_args()
-    
+
     if args.test_size_limits:
-        test_file_size_limits(args.image_dir)
-    else:
-        concurrent_test(args.image, args.requests, args.workers)
+        asyncio.run(test_file_size_limits(args.url, args.image_dir, timeout=args.timeout))
+        return
+
+    report = asyncio.run(run_load_test(args))
+    print_report(report)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nResults written to {args.output}")
+    if report["cache_hit_rate"] and not args.allow_cache:
+        print("\nFailed: unique uploads were answered from the cache")
+        sys.exit(1)
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(report, json.load(f), args.max_regression)
+        if regressions:
+            print("\nRegressions:\n  " + "\n  ".join(regressions))
+            sys.exit(1)
+        print("\nNo regressions")
+
 
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    main()
@@ -0,0 +1,168 @@
+import math
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import cv2
+import numpy as np
+
+# Tiles reach the workers as BMP, like document pages: encoding and decoding
+# are little more than a copy
+_TILE_ENCODING = ".bmp"
+
+# A box this close to a tile edge (in pixels) was cut off by that edge
+_EDGE_MARGIN = 3
+
+# (x, y, width, height) of a tile in the decoded image
+Tile = Tuple[int, int, int, int]
+
+
+def _starts(length: int, tile_size: int, overlap: int) -> List[int]:
+    """Tile offsets along one side, spread evenly so neighbours overlap by at least ``overlap``"""
+    if length <= tile_size:
+        return [0]
+    count = math.ceil((length - overlap) / (tile_size - overlap))
+    return [round(idx * (length - tile_size) / (count - 1)) for idx in range(count)]
+
+
+def tile_grid(width: int, height: int, tile_size: int, overlap: int) -> List[Tile]:
+    """Overlapping tiles covering a ``width`` x ``height`` image, row by row.
+
+    ``overlap`` should exceed the tallest text line, so that every line
+    cut by one tile's top or bottom edge lies whole in the next tile.
+    """
+    overlap = max(0, min(overlap, tile_size // 2))
+    return [(x, y, min(tile_size, width), min(tile_size, height))
+            for y in _starts(height, tile_size, overlap) for x in _starts(width, tile_size, overlap)]
+
+
+def encode_tile(image: np.ndarray, tile: Tile) -> bytes:
+    x, y, width, height = tile
+    ok, encoded = cv2.imencode(_TILE_ENCODING, image[y:y + height, x:x + width])
+    if not ok:
+        raise ValueError("Could not encode tile")
+    return encoded.tobytes()
+
+
+def _join_text(left: Dict[str, Any], right: Dict[str, Any]) -> str:
+    """Text of a line both pieces hold part of, reading their overlap only once"""
+    a, b = left["text"], right["text"]
+    lx0, _, lx1, _ = left["bounds"]
+    rx0, _, rx1, _ = right["bounds"]
+    # Roughly how many characters both pieces read; a much shorter match is a coincidence
+    shared = len(b) * (lx1 - rx0) / max(1.0, rx1 - rx0)
+    for size in range(min(len(a), len(b)), max(1, int(shared / 2)), -1):
+        if a.endswith(b[:size]):
+            return a + b[size:]
+    # The characters at either cut are often misread, so the texts may not
+    # agree: split both at the middle of the overlap instead
+    middle = (rx0 + lx1) / 2
+    keep = round(len(a) * (middle - lx0) / max(1.0, lx1 - lx0))
+    skip = round(len(b) * (middle - rx0) / max(1.0, rx1 - rx0))
+    return a[:keep] + b[skip:]
+
+
+def _merge(left: Dict[str, Any], right: Dict[str, Any]) -> Dict[str, Any]:
+    x0, y0 = min(left["bounds"][0], right["bounds"][0]), min(left["bounds"][1], right["bounds"][1])
+    x1, y1 = max(left["bounds"][2], right["bounds"][2]), max(left["bounds"][3], right["bounds"][3])
+    return {
+        "box": np.array([[x0, y0], [x1, y0], [x1, y1], [x0, y1]], dtype=np.float64),
+        "bounds": (x0, y0, x1, y1),
+        "text": _join_text(left, right),
+        "score": min(left["score"], right["score"]),
+        "cut_left": left["cut_left"],
+        "cut_right": right["cut_right"],
+        "cuts": left["cut_left"] + right["cut_right"],
+    }
+
+
+def _relation(line: Dict[str, Any], other: Dict[str, Any]) -> Optional[str]:
+    """``duplicate`` when ``line`` adds nothing to ``other``, ``continues`` when they are two cut pieces of one line"""
+    ax0, ay0, ax1, ay1 = line["bounds"]
+    bx0, by0, bx1, by1 = other["bounds"]
+    overlap_x = min(ax1, bx1) - max(ax0, bx0)
+    overlap_y = min(ay1, by1) - max(ay0, by0)
+    if overlap_x <= 0 or overlap_y <= 0:
+        return None
+    mostly_inside = overlap_x * overlap_y >= 0.5 * (ax1 - ax0) * (ay1 - ay0)
+    if overlap_y < 0.5 * min(ay1 - ay0, by1 - by0):
+        # Different rows, unless this is a piece cut by a top or bottom edge
+        return "duplicate" if mostly_inside else None
+    slack = (ay1 - ay0) / 2
+    if ax0 >= bx0 - slack and ax1 <= bx1 + slack:
+        return "duplicate"
+    left, right = (line, other) if ax0 < bx0 else (other, line)
+    if left["cut_right"] or right["cut_left"]:
+        return "continues"
+    return "duplicate" if mostly_inside else None
+
+
+def reading_order(lines: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Top to bottom, and left to right within a row of lines"""
+    rows: List[List[Dict[str, Any]]] = []
+    for line in sorted(lines, key=lambda line: line["bounds"][1]):
+        center = (line["bounds"][1] + line["bounds"][3]) / 2
+        if rows and rows[-1][0]["bounds"][1] <= center <= rows[-1][0]["bounds"][3]:
+            rows[-1].append(line)
+        else:
+            rows.append([line])
+    return [line for row in rows for line in sorted(row, key=lambda line: line["bounds"][0])]
+
+
+def merge_tile_lines(tiles: Sequence[Tile], tile_lines: Sequence[Sequence[Sequence[Any]]],
+                     width: int, height: int, scale: float = 1.0) -> List[List[Any]]:
+    """One page of ``[box, text, confidence]`` lines from the lines found in each tile.
+
+    ``tile_lines`` have their boxes in tile pixels. A line seen whole by
+    two tiles is kept once; pieces of a line cut by tile edges are joined,
+    with the text they share counted once. Boxes come back in original
+    image pixels (the decoded image was ``scale`` times the original).
+    """
+    candidates = []
+    for (tx, ty, tw, th), lines in zip(tiles, tile_lines):
+        for box, text, score in lines:
+            points = np.asarray(box, dtype=np.float64).reshape(4, 2) + (tx, ty)
+            x0, y0 = points.min(axis=0)
+            x1, y1 = points.max(axis=0)
+            cut_left = tx > 0 and x0 <= tx + _EDGE_MARGIN
+            cut_right = tx + tw < width and x1 >= tx + tw - _EDGE_MARGIN
+            cut_vertically = (ty > 0 and y0 <= ty + _EDGE_MARGIN) or (ty + th < height and y1 >= ty + th - _EDGE_MARGIN)
+            candidates.append({
+                "box": points, "bounds": (x0, y0, x1, y1), "text": text, "score": score,
+                "cut_left": cut_left, "cut_right": cut_right,
+                "cuts": cut_left + cut_right + 2 * cut_vertically,
+            })
+
+    # Whole lines first, then the largest pieces, so a piece is compared
+    # with the most complete version of its line already kept
+    candidates.sort(key=lambda line: (line["cuts"], -(line["bounds"][2] - line["bounds"][0])))
+    kept: List[Dict[str, Any]] = []
+    for line in candidates:
+        while True:
+            for idx, other in enumerate(kept):
+                relation = _relation(line, other)
+                if relation is not None:
+                    break
+            else:
+                kept.append(line)
+                break
+            if relation == "duplicate":
+                break
+            # Join the pieces, then look again: a line may span three tiles
+            del kept[idx]
+            line = _merge(*sorted((line, other), key=lambda piece: piece["bounds"][0]))
+
+    return [[np.rint(line["box"] / scale).astype(int).tolist(), line["text"], line["score"]]
+            for line in reading_order(kept)]
+
+
+def merge_tile_codes(tiles: Sequence[Tile], tile_codes: Sequence[Sequence[Dict[str, Any]]],
+                     scale: float = 1.0) -> List[Dict[str, Any]]:
+    """QR codes and barcodes found in the tiles, once each, with boxes in original image pixels"""
+    codes, seen = [], set()
+    for (tx, ty, _, _), found in zip(tiles, tile_codes):
+        for code in found:
+            if (code["type"], code["data"]) in seen:
+                continue
+            seen.add((code["type"], code["data"]))
+            box = (np.asarray(code["box"], dtype=np.float64) + (tx, ty)) / scale
+            codes.append({**code, "box": np.rint(box).astype(int).tolist()})
+    return codes
@@ -0,0 +1,126 @@
+import re
+import threading
+from typing import Any, Dict, List, Sequence
+
+import cv2
+import numpy as np
+
+# URLs with a scheme or a www. host, or bare domains under common TLDs; then an
+# optional port and a path, query and fragment (which may hold %-escapes and #)
+URL_PATTERN = re.compile(r"""
+    (?:
+        (?:https?|ftp)://[a-z0-9.-]+                     # scheme and host (name or IPv4)
+      | www\.[a-z0-9-]+(?:\.[a-z0-9-]+)+                  # www. host without a scheme
+      | (?<![\w@.-])[a-z0-9-]+(?:\.[a-z0-9-]+)*\.
+        (?:com|org|net|edu|gov|io|co|info|biz|me|app|dev|ai|ly|tw|cn|jp|hk|uk|de)
+        (?![\w-])                                         # bare domain, e.g. example.com/path
+    )
+    (?::\d{1,5})?                                         # port
+    (?:[/?#][^\s<>"'`{}|\\^]*)?                           # path, query and fragment
+""", re.IGNORECASE | re.VERBOSE)
+
+# Punctuation that usually ends the sentence around a URL rather than the URL
+_TRAILING = ".,;:!?)]}'\""
+
+# A URL ending a line with one of these (once sentence punctuation is
+# stripped) is cut mid-query or mid-word and continues on the next line
+_CONTINUES = tuple("-_=&%")
+
+# Otherwise the next line carries on a URL only when its first word looks
+# like a piece of one: it has one of these, or a dotted segment such as .com
+_CONTINUATION_MARKS = ("/", "?", "=", "#", "%", "&")
+_DOTTED_SEGMENT = re.compile(r"\w\.[a-z]{2,}", re.IGNORECASE)
+
+# Text boxes narrower than this (width / height) hold too few characters for a URL
+MIN_URL_ASPECT = 3.0
+
+# QR codes are searched on a copy downscaled to this long side: 3-4x faster
+# than full resolution, and still enough for codes with modules of ~2 px
+_CODE_SEARCH_SIDE = 1024
+
+_detectors = threading.local()
+
+
+def _clean(url: str) -> str:
+    return url.rstrip(_TRAILING)
+
+
+def _continues(url: str, word: str) -> bool:
+    """Whether ``word``, first on the next line, is the rest of ``url``, which ended the line"""
+    if URL_PATTERN.match(word):
+        return False  # A URL of its own
+    if _clean(url).endswith(_CONTINUES):
+        return True
+    return any(mark in word for mark in _CONTINUATION_MARKS) or _DOTTED_SEGMENT.search(word) is not None
+
+
+def find_urls(lines: Sequence[str]) -> List[str]:
+    """URLs in recognized text lines, rejoining URLs broken across two lines.
+
+    >>> find_urls(["Docs at https://example.com/docs/", "getting-started.html for details"])
+    ['https://example.com/docs/getting-started.html']
+    >>> find_urls(["Visit https://example.com.", "Thanks for reading"])
+    ['https://example.com']
+    >>> find_urls(["Visit www.example.com/docs/", "Thanks for reading"])
+    ['www.example.com/docs/']
+    >>> find_urls(["See https://example.com/search?q=", "paddle ocr"])
+    ['https://example.com/search?q=paddle']
+    """
+    urls = []
+    for idx, line in enumerate(lines):
+        for match in URL_PATTERN.finditer(line):
+            url = match.group(0)
+            if match.end() == len(line.rstrip()) and idx + 1 < len(lines):
+                words = lines[idx + 1].split(maxsplit=1)
+                if words and _continues(url, words[0]):
+                    url += words[0]
+            urls.append(_clean(url))
+    return urls
+
+
+def url_shaped(box) -> bool:
+    """Whether a detected text box is long enough, for its height, to hold a URL"""
+    points = np.asarray(box, dtype=np.float32).reshape(4, 2)
+    width = max(np.linalg.norm(points[1] - points[0]), np.linalg.norm(points[2] - points[3]))
+    height = max(np.linalg.norm(points[3] - points[0]), np.linalg.norm(points[2] - points[1]))
+    return height > 0 and width / height >= MIN_URL_ASPECT
+
+
+def _get_detectors():
+    if not hasattr(_detectors, "qr"):
+        # The ArUco-based detector (OpenCV 4.8+) finds more codes, faster
+        _detectors.qr = getattr(cv2, "QRCodeDetectorAruco", cv2.QRCodeDetector)()
+        _detectors.barcode = cv2.barcode.BarcodeDetector() if hasattr(cv2, "barcode") else None
+    return _detectors.qr, _detectors.barcode
+
+
+def read_codes(image: np.ndarray) -> List[Dict[str, Any]]:
+    """Decode the QR codes and barcodes in an image.
+
+    Returns ``{"type", "data", "box"}`` for each code, the box being four
+    corners in the pixels of ``image``.
+    """
+    qr_detector, barcode_detector = _get_detectors()
+    gray = image if image.ndim == 2 else cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    scale = min(1.0, _CODE_SEARCH_SIDE / max(gray.shape[:2]))
+    if scale < 1:
+        gray = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+
+    codes = []
+    found, decoded, points, _ = qr_detector.detectAndDecodeMulti(gray)
+    if found:
+        for data, corners in zip(decoded, points):
+            if data:
+                codes.append({"type": "QR", "data": data, "box": (np.asarray(corners) / scale).tolist()})
+    if barcode_detector is not None:
+        found, decoded, types, points = barcode_detector.detectAndDecodeWithType(gray)
+        if found:
+            for data, kind, corners in zip(decoded, types, points):
+                if data:
+                    codes.append({"type": kind, "data": data, "box": (np.asarray(corners) / scale).tolist()})
+    return codes
+
+
+def code_urls(codes: Sequence[Dict[str, Any]]) -> List[str]:
+    """URLs carried by decoded codes"""
+    return [_clean(match.group(0)) for code in codes for match in [URL_PATTERN.match(code["data"].strip())] if match]